@@ -0,0 +1,86 @@
+"""
+Concurrent variant of the apis: every call returns right away a Result, and runs in a pool of threads.
+The wrapped api does the actual work, so the resources tree, the path formatting
+and the parse_response/post_process hooks are the same.
+
+> api = AsyncSalesForceApi(max_concurrency=10)
+> results = [api.push('user', user) for user in users]
+> gather(results, return_exceptions=True)
+"""
+
+from django.conf import settings
+
+from sforce.api.client import WorkerPool
+from sforce.api.salesforce import SalesForceApi
+
+
+def gather(results, return_exceptions=False):
+    """
+    Waits for all the results and returns their values, in order.
+    With return_exceptions, the exception of a failed call is returned in place of its value,
+    else it is raised.
+    """
+    values = []
+    for result in results:
+        exception = result.exception()
+        if exception is not None and not return_exceptions:
+            result.get()  # raises it with its traceback
+        values.append(exception if exception is not None else result.value)
+    return values
+
+
+class AsyncApi(object):
+    """
+    Wraps an api, at most max_concurrency requests are sent at the same time.
+    """
+    api_class = None
+    max_concurrency = getattr(settings, 'SF_MAX_CONCURRENCY', 10)
+
+    def __init__(self, api=None, max_concurrency=None):
+        if api is None:
+            if self.api_class is None:
+                raise AttributeError("Either api or api_class must be set.")
+            api = self.api_class()
+        self.api = api
+        self.pool = WorkerPool(max_concurrency or self.max_concurrency)
+        api.ensure_pool_size(self.pool.size)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        self.pool.close()
+
+    def submit(self, func, *args, **kwargs):
+        return self.pool.submit(func, *args, **kwargs)
+
+    def head(self, resource, params={}, data={}):
+        return self.submit(self.api.head, resource, params, data)
+
+    def get(self, resource, params={}, data={}):
+        return self.submit(self.api.get, resource, params, data)
+
+    def post(self, resource, params={}, data={}):
+        return self.submit(self.api.post, resource, params, data)
+
+    def put(self, resource, params={}, data={}):
+        return self.submit(self.api.put, resource, params, data)
+
+    def patch(self, resource, params={}, data={}):
+        return self.submit(self.api.patch, resource, params, data)
+
+    def delete(self, resource, params={}, data={}):
+        return self.submit(self.api.delete, resource, params, data)
+
+    def pull(self, resource_name, instance, save=True):
+        return self.submit(self.api.pull, resource_name, instance, save)
+
+    def push(self, resource_name, instance):
+        return self.submit(self.api.push, resource_name, instance)
+
+
+class AsyncSalesForceApi(AsyncApi):
+    api_class = SalesForceApi
@@ -0,0 +1,159 @@
+"""
+The blob fields of the sobjects (Attachment.Body, Document.Body, ContentVersion.VersionData...),
+downloaded and uploaded in chunks, whatever their size.
+> api.get('Attachment.blob', params={'id': '00P...', 'field': 'Body'}).save_to(open('file.pdf', 'wb'))
+> api.post('ContentVersion.blob', data={'PathOnClient': 'file.pdf', 'VersionData': open('file.pdf', 'rb')})
+"""
+import os
+import uuid
+import urllib
+from tempfile import SpooledTemporaryFile
+
+import requests
+from django.core.files import File
+from django.core.files.storage import default_storage
+
+from sforce.api.salesforce import SalesForceResource
+
+
+class BlobDownload(object):
+    """
+    The body of a streamed blob response, read chunk_size bytes at a time.
+    """
+    spool_size = 1024 * 1024  # kept in memory when saved to a storage, on disk above
+
+    def __init__(self, response, chunk_size):
+        self.response = response
+        self.chunk_size = chunk_size
+        self.content_type = response.headers.get('Content-Type')
+
+    def __iter__(self):
+        try:
+            for chunk in self.response.iter_content(self.chunk_size):
+                yield chunk
+        finally:
+            self.response.close()
+
+    def save_to(self, fileobj):
+        """
+        Writes the blob in the file object, returns its size.
+        """
+        size = 0
+        for chunk in self:
+            fileobj.write(chunk)
+            size += len(chunk)
+        return size
+
+    def save(self, name, storage=None):
+        """
+        Saves the blob in a django storage, default_storage if not given, returns the name it was given.
+        The storages may read the file more than once, so it is spooled first.
+        """
+        with SpooledTemporaryFile(max_size=self.spool_size) as spooled:
+            self.save_to(spooled)
+            spooled.seek(0)
+            return (storage or default_storage).save(name, File(spooled, name=name))
+
+
+class MultipartStream(object):
+    """
+    A multipart/form-data body read by requests chunk_size bytes at a time, the files of the parts are never loaded whole.
+    parts are (name, content type, filename or None, content string or file object)
+    """
+    chunk_size = 64 * 1024
+
+    def __init__(self, parts, boundary):
+        self.items = []
+        for name, content_type, filename, content in parts:
+            disposition = u'form-data; name="%s"' % name
+            if filename:
+                disposition += u'; filename="%s"' % filename.replace('"', '')
+            headers = u'--%s\r\nContent-Disposition: %s\r\nContent-Type: %s\r\n\r\n' % (boundary, disposition, content_type)
+            self.items.append(headers.encode('utf-8'))
+            self.items.append(content)
+            self.items.append('\r\n')
+        self.items.append('--%s--\r\n' % boundary)
+        self.length = sum([requests.utils.super_len(item) for item in self.items])
+        self.chunks = self.iter_chunks()
+        self.buffer = ''
+
+    def __len__(self):
+        # lets requests send a Content-Length instead of a chunked body
+        return self.length
+
+    def iter_chunks(self):
+        for item in self.items:
+            if isinstance(item, basestring):
+                yield item
+            else:
+                for chunk in iter(lambda: item.read(self.chunk_size), ''):
+                    yield chunk
+
+    def read(self, size=-1):
+        while size < 0 or len(self.buffer) < size:
+            chunk = next(self.chunks, None)
+            if chunk is None:
+                break
+            self.buffer += chunk
+        if size < 0:
+            size = len(self.buffer)
+        data, self.buffer = self.buffer[:size], self.buffer[size:]
+        return data
+
+
+class BlobResource(SalesForceResource):
+    """
+    sobjects/{sobject}/{id}/{field}/, GET streams the blob of the field, see BlobDownload.
+    POST sobjects/{sobject}/ creates a record and PATCH sobjects/{sobject}/{id}/ updates it,
+    data being its fields and the file object of its blob field, sent as a streamed multipart body.
+    """
+    path = download_path = '{id}/{field}/'
+    methods = ['GET', 'POST', 'PATCH']
+    stream = True
+    chunk_size = 64 * 1024
+    # the name of the part of the other fields, entity_{sobject} by default
+    entity_parts = {'ContentVersion': 'entity_content'}
+
+    def __init__(self, api, **kwargs):
+        super(BlobResource, self).__init__(api, **kwargs)
+        self.boundary = uuid.uuid4().hex
+
+    def is_download(self):
+        return 'field' in self.params
+
+    def get_path(self):
+        if self.is_download():
+            return super(BlobResource, self).get_path()
+        # the sobject, or its record
+        path = self.path[:-len(self.download_path)]
+        if 'id' in self.params:
+            path += '%s/' % urllib.quote(self.params['id'])
+        return path
+
+    def get_headers(self):
+        if self.is_download():
+            return {}
+        return {'Content-Type': 'multipart/form-data; boundary=%s' % self.boundary}
+
+    def get_entity_part(self):
+        sobject = self.path[:-len(self.download_path)].rstrip('/').rsplit('/', 1)[-1]
+        return self.entity_parts.get(sobject, 'entity_%s' % sobject.lower())
+
+    def format_data(self, data):
+        if self.is_download():
+            return None
+        fields = dict([(field, value) for field, value in data.iteritems() if not hasattr(value, 'read')])
+        parts = [(self.get_entity_part(), 'application/json', None, self.get_codec().dumps(fields))]
+        for field, fileobj in data.iteritems():
+            if field not in fields:
+                # from the start, in case the request is rerun
+                fileobj.seek(0)
+                filename = os.path.basename(getattr(fileobj, 'name', None) or field)
+                parts.append((field, 'application/octet-stream', filename, fileobj))
+        return MultipartStream(parts, self.boundary)
+
+    def parse_response(self, response):
+        if response.status_code != requests.codes.ok or not self.is_download():
+            # the errors and the results of the uploads are json
+            return super(BlobResource, self).parse_response(response)
+        return BlobDownload(response, self.chunk_size)
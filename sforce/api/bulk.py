@@ -0,0 +1,454 @@
+"""
+Bulk API 2.0 jobs, to query and write large amounts of records asynchronously.
+The data are csv files, streamed and parsed row by row.
+> for row in api.bulk_query('SELECT Id, Name FROM Account'):
+>     ...
+> api.bulk_push('user', MyUser.objects.all(), operation='upsert', external_id_field='Django_Id__c')
+"""
+import csv
+import time
+import urllib
+from abc import ABCMeta, abstractmethod
+from datetime import date
+from tempfile import SpooledTemporaryFile
+
+import requests
+
+from sforce.api.client import APIException
+from sforce.api.client import JsonResource
+from sforce.api.client import bulk_update
+from sforce.api.client import chunks
+
+from logging import getLogger
+log = getLogger(__package__)
+
+
+def iter_lines(chunks):
+    """
+    Yields the lines of a stream of chunks, with their line endings (needed by the csv module for multiline values).
+    """
+    pending = ''
+    for chunk in chunks:
+        pending += chunk
+        lines = pending.split('\n')
+        pending = lines.pop()
+        for line in lines:
+            yield line + '\n'
+    if pending:
+        yield pending
+
+
+class CsvPage(object):
+    """
+    The rows of a streamed csv response, as dicts.
+    Only the chunk being parsed is held in memory.
+    """
+    def __init__(self, response, chunk_size):
+        self.response = response
+        self.chunk_size = chunk_size
+        # the locator of the next page, None for the last one
+        self.locator = response.headers.get('Sforce-Locator')
+        if self.locator in ('', 'null'):
+            self.locator = None
+        self.size = int(response.headers.get('Sforce-NumberOfRecords') or 0)
+
+    def __iter__(self):
+        try:
+            reader = csv.reader(iter_lines(self.response.iter_content(self.chunk_size)))
+            header = next(reader, None)
+            if header is None:
+                return
+            for row in reader:
+                yield dict(zip(header, [value.decode('utf-8') for value in row]))
+        finally:
+            self.response.close()
+
+
+class BulkResource(JsonResource):
+    error_key = u'errorCode'
+    methods = ['GET']
+
+
+class BulkJobsResource(BulkResource):
+    """
+    jobs/query/ or jobs/ingest/, POST creates a job
+    """
+    methods = ['GET', 'POST']
+
+    def post(self, data):
+        return self._request('POST', data, ok_code=requests.codes.ok)
+
+
+class BulkJobResource(BulkResource):
+    """
+    jobs/query/{id}/ or jobs/ingest/{id}/, GET returns the state of the job, PATCH changes it
+    """
+    path = '{id}/'
+    methods = ['GET', 'PATCH', 'DELETE']
+
+    def patch(self, data):
+        return self._request('PATCH', data, ok_code=requests.codes.ok)
+
+
+class BulkResultsResource(BulkResource):
+    """
+    The csv results of a job, exp: jobs/ingest/{id}/successfulResults/
+    """
+    stream = True
+    chunk_size = 64 * 1024
+
+    def get_headers(self):
+        headers = super(BulkResultsResource, self).get_headers()
+        headers['Accept'] = 'text/csv'
+        return headers
+
+    def parse_response(self, response):
+        if response.status_code != requests.codes.ok:
+            # the errors are json
+            return super(BulkResultsResource, self).parse_response(response)
+        return CsvPage(response, self.chunk_size)
+
+
+class BulkQueryResultsResource(BulkResultsResource):
+    """
+    jobs/query/{id}/results/, the csv results of a query job, a page at a time
+    """
+    path = '{id}/results/'
+    query_params = ('locator', 'maxRecords')
+
+    def get_path_params(self):
+        params = dict(super(BulkQueryResultsResource, self).get_path_params())
+        for param in self.query_params:
+            params.pop(param, None)
+        return params
+
+    def get_path(self):
+        path = super(BulkQueryResultsResource, self).get_path()
+        query = [(param, self.params[param]) for param in self.query_params if self.params.get(param)]
+        if query:
+            path += '?%s' % urllib.urlencode(query)
+        return path
+
+
+class BulkUploadResource(BulkResource):
+    """
+    jobs/ingest/{id}/batches/, PUT uploads the csv data of an ingest job, data being a file object
+    """
+    path = '{id}/batches/'
+    methods = ['PUT']
+
+    def get_headers(self):
+        return {'Content-Type': 'text/csv'}
+
+    def format_data(self, data):
+        # streamed by requests, from the start in case the request is rerun
+        data.seek(0)
+        return data
+
+    def parse_response(self, response):
+        if not response.text:
+            return {}
+        return super(BulkUploadResource, self).parse_response(response)
+
+    def put(self, data):
+        return self._request('PUT', data, ok_code=requests.codes.created)
+
+
+class BulkJob(object):
+    """
+    Base class of the Bulk API 2.0 jobs, created then polled until they are processed.
+    """
+    __metaclass__ = ABCMeta
+
+    jobs_resource = None
+    job_resource = None
+    min_api_version = None  # the version of the api the jobs need
+
+    poll_interval = 1  # in seconds, multiplied by poll_backoff after each poll
+    poll_backoff = 1.5
+    poll_max_interval = 30
+    timeout = 60 * 60
+
+    done_states = ('JobComplete',)
+    failed_states = ('Failed', 'Aborted')
+
+    def __init__(self, api):
+        self.api = api
+        self.id = None
+
+    @abstractmethod
+    def get_data(self):
+        """
+        The description of the job, posted to jobs_resource.
+        """
+
+    def create(self):
+        if self.min_api_version and not self.api.has_api_version(self.min_api_version):
+            raise APIException(u'The %s needs the api version %s, it is %s.' % (self.__class__.__name__, self.min_api_version, self.api.api_version))
+        payload = self.api.post(self.jobs_resource, data=self.get_data())
+        self.id = payload['id']
+        log.info('Created the bulk job %s' % self.id)
+        return payload
+
+    def get_state(self):
+        return self.api.get(self.job_resource, params={'id': self.id})
+
+    def wait(self):
+        """
+        Polls the job, less and less often, until it is processed.
+        """
+        interval = self.poll_interval
+        deadline = time.time() + self.timeout
+        while True:
+            job = self.get_state()
+            if job['state'] in self.done_states:
+                return job
+            if job['state'] in self.failed_states:
+                raise APIException(u'The bulk job %s is %s : %s' % (self.id, job['state'], job.get('errorMessage')),
+                                   payload=job)
+            if time.time() + interval > deadline:
+                raise APIException(u'The bulk job %s is still %s after %s seconds.' % (self.id, job['state'], self.timeout),
+                                   payload=job)
+            time.sleep(interval)
+            interval = min(interval * self.poll_backoff, self.poll_max_interval)
+
+    def abort(self):
+        return self.api.patch(self.job_resource, params={'id': self.id}, data={'state': 'Aborted'})
+
+
+class BulkQueryJob(BulkJob):
+    """
+    > job = BulkQueryJob(api, 'SELECT Id, Name FROM Account')
+    > for row in job.iter_rows():
+    >     ...
+    """
+    jobs_resource = 'jobs.query'
+    job_resource = 'jobs.query.job'
+    min_api_version = '47.0'
+    results_resource = 'jobs.query.results'
+    convert_batch_size = 1000  # the rows converted at once by iter_local_fields
+
+    def __init__(self, api, soql, include_deleted=False, max_records=None):
+        super(BulkQueryJob, self).__init__(api)
+        self.soql = soql
+        self.include_deleted = include_deleted
+        self.max_records = max_records  # per page of results
+
+    def get_data(self):
+        return {'operation': self.include_deleted and 'queryAll' or 'query',
+                'query': self.soql}
+
+    def iter_pages(self):
+        """
+        Runs the job and yields its pages of results, each page being an iterable of rows.
+        """
+        if self.id is None:
+            self.create()
+        self.wait()
+        locator = None
+        while True:
+            page = self.api.get(self.results_resource, params={'id': self.id,
+                                                               'locator': locator,
+                                                               'maxRecords': self.max_records})
+            yield page
+            locator = page.locator
+            if not locator:
+                break
+
+    def iter_rows(self):
+        for page in self.iter_pages():
+            for row in page:
+                yield row
+
+    def iter_local_fields(self, resource_name):
+        """
+        Yields the rows mapped to the local fields of a ModelResource,
+        the Id column (if selected) is mapped to its distant_id.
+        """
+        resource = self.api.get_resource(resource_name)
+        for rows in chunks(self.iter_rows(), self.convert_batch_size):
+            for row, fields in zip(rows, resource.get_distant_fields_many(rows)):
+                if 'Id' in row:
+                    fields[resource.distant_id] = row['Id']
+                yield fields
+
+
+class BulkIngestJob(BulkJob):
+    """
+    > job = BulkIngestJob(api, 'Account', 'insert')
+    > job.run(csv_file)
+    > for row in job.iter_results('failed'):
+    >     ...
+    """
+    jobs_resource = 'jobs.ingest'
+    min_api_version = '41.0'
+    job_resource = 'jobs.ingest.job'
+    upload_resource = 'jobs.ingest.batches'
+    results_resources = {'successful': 'jobs.ingest.successfulResults',
+                         'failed': 'jobs.ingest.failedResults'}
+
+    def __init__(self, api, sobject, operation, external_id_field=None):
+        super(BulkIngestJob, self).__init__(api)
+        self.sobject = sobject
+        self.operation = operation
+        self.external_id_field = external_id_field
+
+    def get_data(self):
+        data = {'object': self.sobject,
+                'operation': self.operation,
+                'contentType': 'CSV',
+                'lineEnding': 'LF'}
+        if self.external_id_field:
+            data['externalIdFieldName'] = self.external_id_field
+        return data
+
+    def upload(self, csv_file):
+        self.api.put(self.upload_resource, params={'id': self.id}, data=csv_file)
+        self.api.patch(self.job_resource, params={'id': self.id}, data={'state': 'UploadComplete'})
+
+    def run(self, csv_file):
+        self.create()
+        self.upload(csv_file)
+        return self.wait()
+
+    def iter_results(self, kind):
+        """
+        Yields the 'successful' or 'failed' rows, with their sf__ columns
+        """
+        return iter(self.api.get(self.results_resources[kind], params={'id': self.id}))
+
+
+class BulkPush(object):
+    """
+    Streams the instances of a queryset to Bulk API 2.0 ingest jobs, up to max_upload_size of csv per job,
+    then maps the results back to the local pks, and saves the ids of the created records.
+    The results are matched to the uploaded rows in order, by their key columns (see get_key_columns),
+    an insert with an external_id_field (a unique field of the sobject) is matched on it alone.
+    """
+    operations = ('insert', 'update', 'upsert', 'delete')
+    # the upload of a job is limited to 150MB once base64 encoded
+    max_upload_size = 100 * 1024 * 1024
+    max_memory_size = 10 * 1024 * 1024  # the bigger csv files are written on the disk
+    null_value = u'#N/A'
+
+    def __init__(self, api, resource_name, instances, operation='upsert', external_id_field=None):
+        if operation not in self.operations:
+            raise ValueError(u"operation should be one of %s." % ', '.join(self.operations))
+        if operation == 'upsert' and not external_id_field:
+            raise ValueError(u"external_id_field is mandatory for an upsert.")
+        if operation in ('update', 'delete'):
+            external_id_field = None
+        self.api = api
+        self.resource = api.get_resource(resource_name)
+        self.sobject = api.get_sobject_type(self.resource)
+        self.instances = instances
+        self.operation = operation
+        self.external_id_field = external_id_field
+        self.columns = self.get_columns()
+        self.model = None
+        # pk: distant id, and pk: error message
+        self.success = {}
+        self.errors = {}
+
+    def get_columns(self):
+        if self.operation == 'delete':
+            return ['Id']
+        columns = sorted(self.resource.fields_map)
+        if self.operation == 'update':
+            columns.insert(0, 'Id')
+        elif self.external_id_field and self.external_id_field not in columns:
+            raise ValueError(u"The external id field %s is not in the fields_map of %s." % (self.external_id_field, self.resource))
+        return columns
+
+    def get_key_columns(self):
+        """
+        The columns identifying a row in the results, which contain the uploaded columns.
+        Without an external_id_field, the rows of an insert are identified by all their values.
+        """
+        if self.operation in ('update', 'delete'):
+            return ['Id']
+        if self.external_id_field:
+            return [self.external_id_field]
+        return self.columns
+
+    def format_value(self, value):
+        if value is None:
+            return self.operation != 'insert' and self.null_value or u''
+        if isinstance(value, bool):
+            return value and u'true' or u'false'
+        if isinstance(value, date):
+            return value.isoformat()
+        return unicode(value)
+
+    def get_row(self, instance):
+        self.resource.instance = instance
+        fields = self.operation != 'delete' and self.resource.get_local_fields() or {}
+        if self.columns[0] == 'Id':
+            fields['Id'] = getattr(instance, self.resource.distant_id, None)
+        return [self.format_value(fields[column]) for column in self.columns]
+
+    def write_csv(self, instances):
+        """
+        Writes the rows of the next instances until the file reaches max_upload_size.
+        Returns the file, and the pks of the rows by key (see get_key_columns), in the order of the rows
+        """
+        csv_file = SpooledTemporaryFile(max_size=self.max_memory_size)
+        writer = csv.writer(csv_file, lineterminator='\n')
+        writer.writerow(self.columns)
+        key_indexes = [self.columns.index(column) for column in self.get_key_columns()]
+        keys = {}
+        while not keys or csv_file.tell() < self.max_upload_size:
+            instance = next(instances, None)
+            if instance is None:
+                break
+            self.model = instance.__class__
+            if self.operation in ('update', 'delete') and not getattr(instance, self.resource.distant_id, None):
+                self.errors[instance.pk] = u'The instance has no %s.' % self.resource.distant_id
+                continue
+            row = self.get_row(instance)
+            writer.writerow([value.encode('utf-8') for value in row])
+            keys.setdefault(tuple([row[i] for i in key_indexes]), []).append(instance.pk)
+        return csv_file, keys
+
+    def read_results(self, job, keys):
+        key_columns = self.get_key_columns()
+        created = []
+        for kind in ('successful', 'failed'):
+            for row in job.iter_results(kind):
+                pks = keys.get(tuple([row[column] for column in key_columns]))
+                if not pks:
+                    log.warning(u'Could not match the %s row %s of the bulk job %s.' % (kind, row, job.id))
+                    continue
+                pk = pks.pop(0)
+                if kind == 'failed':
+                    self.errors[pk] = row['sf__Error']
+                    continue
+                self.success[pk] = row['sf__Id']
+                if row.get('sf__Created') == 'true':
+                    created.append(self.model(pk=pk, **{self.resource.distant_id: row['sf__Id']}))
+        # the rows without a result (or whose result could not be matched) are not known to be pushed
+        for pks in keys.values():
+            for pk in pks:
+                self.errors[pk] = u'No result matched the row in the bulk job %s.' % job.id
+        bulk_update(created, [self.resource.distant_id])
+
+    def run(self):
+        """
+        Returns {'success': {pk: distant id}, 'errors': {pk: error message}}
+        """
+        if hasattr(self.instances, 'iterator'):  # a queryset
+            instances = self.instances.iterator()
+        else:
+            instances = iter(self.instances)
+        while True:
+            csv_file, keys = self.write_csv(instances)
+            if not keys:
+                break
+            try:
+                job = BulkIngestJob(self.api, self.sobject, self.operation,
+                                    self.operation == 'upsert' and self.external_id_field or None)
+                job.run(csv_file)
+            finally:
+                csv_file.close()
+            self.read_results(job, keys)
+        return {'success': self.success, 'errors': self.errors}
@@ -0,0 +1,357 @@
+"""
+Cache helpers shared by the api layers.
+All the shared caches go through the django cache framework,
+use the SF_CACHE setting to pick the backend alias (a file based backend works too).
+"""
+import copy
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+
+from django.conf import settings
+try:
+    import json
+except ImportError:
+    from django.utils import simplejson as json
+try:
+    from django.core.cache import caches
+except ImportError:  # django < 1.7
+    from django.core.cache import get_cache
+else:
+    get_cache = caches.__getitem__
+
+from sforce.api.client import import_class
+
+
+def get_sf_cache(alias=None):
+    """
+    Returns the django cache backend used by django-sforce.
+    """
+    return get_cache(alias or getattr(settings, 'SF_CACHE', 'default'))
+
+
+class TokenStore(object):
+    """
+    Shares an oauth token between all the processes using the same cache.
+    Only one process fetches a new token at a time, the others wait for it.
+    """
+    timeout = getattr(settings, 'SF_TOKEN_TIMEOUT', 60 * 60)  # in seconds
+    lock_timeout = 30  # the longest a process can hold the refresh lock
+    wait_interval = 0.1  # in seconds
+
+    def __init__(self, key):
+        self.key = key
+        self.lock_key = '%s:lock' % key
+        self.cache = get_sf_cache()
+
+    def get(self):
+        return self.cache.get(self.key)
+
+    def set(self, token):
+        self.cache.set(self.key, dict(token), self.timeout)
+
+    def is_valid(self, token, stale=None):
+        # a new login can return the same access token while the session is alive, only its issued_at changes
+        return bool(token) and (not stale or token != stale)
+
+    def get_or_fetch(self, fetch, stale=None):
+        """
+        Returns the shared token, unless it is missing or the same as the stale one,
+        in which case a new token is fetched by calling fetch().
+        """
+        token = self.get()
+        deadline = time.time() + self.lock_timeout
+        while not self.is_valid(token, stale):
+            if self.cache.add(self.lock_key, 1, self.lock_timeout):
+                try:
+                    # another process might have refreshed it in the meantime
+                    token = self.get()
+                    if not self.is_valid(token, stale):
+                        token = fetch()
+                        self.set(token)
+                finally:
+                    self.cache.delete(self.lock_key)
+                # Note: a fetched token can be the same as the stale one, if the session is still active
+                break
+            elif time.time() > deadline:
+                # the process holding the lock probably died
+                token = fetch()
+                self.set(token)
+                break
+            else:
+                time.sleep(self.wait_interval)
+                token = self.get()
+        return token
+
+
+class PushStore(object):
+    """
+    Remembers a hash of each field last pushed (or pulled) for each distant object, in the cache shared by all the processes,
+    so pushing the same fields again can be skipped, and an instance fresh from the db only sends the fields changed since.
+    stats counts the pushes sent and skipped by this process.
+    """
+    timeout = getattr(settings, 'SF_PUSH_STORE_TIMEOUT', 60 * 60 * 24)  # in seconds
+
+    def __init__(self, prefix):
+        self.prefix = prefix
+        self.cache = get_sf_cache()
+        self.stats = {'pushed': 0, 'skipped': 0}
+        self.stats_lock = threading.Lock()
+
+    def get_key(self, resource_name, dist_id):
+        return '%s:%s:%s' % (self.prefix, resource_name, dist_id)
+
+    def get_hash(self, value):
+        return hashlib.sha1(json.dumps(value, sort_keys=True, default=unicode)).hexdigest()
+
+    def get_hashes(self, fields):
+        return dict([(name, self.get_hash(value)) for name, value in fields.iteritems()])
+
+    def is_pushed(self, resource_name, dist_id, fields):
+        return self.cache.get(self.get_key(resource_name, dist_id)) == self.get_hashes(fields)
+
+    def get_changed_fields(self, resource_name, dist_id, fields):
+        """
+        Returns the fields which differ from the ones last pushed (or pulled), all of them if unknown.
+        """
+        hashes = self.cache.get(self.get_key(resource_name, dist_id))
+        if not isinstance(hashes, dict):  # unknown, or a single hash kept by an older version
+            return fields
+        return dict([(name, value) for name, value in fields.iteritems() if hashes.get(name) != self.get_hash(value)])
+
+    def set_pushed(self, resource_name, dist_id, fields):
+        self.cache.set(self.get_key(resource_name, dist_id), self.get_hashes(fields), self.timeout)
+
+    def delete(self, resource_name, dist_ids):
+        self.cache.delete_many([self.get_key(resource_name, dist_id) for dist_id in dist_ids])
+
+    def count(self, stat):
+        with self.stats_lock:
+            self.stats[stat] += 1
+
+
+class ResponseCache(object):
+    """
+    Keeps the responses of the GETs in the process, the entries of the least recently used paths are dropped
+    once a resource has more than its cache_max_entries paths.
+    The entries are grouped by path (the url without its query string), so a write on the path drops them all.
+    stats counts the responses served from the cache, revalidated (304) and fetched by this process.
+    """
+    def __init__(self, prefix):
+        self.prefix = prefix
+        self.paths = {}  # the paths of each resource, least recently used first: {name: {path: {url: entry}}}
+        self.lock = threading.Lock()
+        self.stats = {'hits': 0, 'revalidated': 0, 'misses': 0}
+        self.stats_lock = threading.Lock()
+
+    def get(self, resource, path):
+        """
+        Returns the entries of the path, by url.
+        """
+        with self.lock:
+            paths = self.paths.get(resource.name)
+            if not paths or path not in paths:
+                return {}
+            paths[path] = paths.pop(path)  # the most recently used
+            # copied, the caller could alter the payloads
+            return copy.deepcopy(paths[path])
+
+    def set(self, resource, path, entries):
+        entries = copy.deepcopy(entries)
+        with self.lock:
+            paths = self.paths.setdefault(resource.name, OrderedDict())
+            paths.pop(path, None)
+            paths[path] = entries
+            while len(paths) > resource.cache_max_entries:
+                paths.popitem(last=False)
+
+    def delete(self, path):
+        with self.lock:
+            for paths in self.paths.values():
+                paths.pop(path, None)
+
+    def count(self, stat):
+        with self.stats_lock:
+            self.stats[stat] += 1
+
+
+class SharedResponseCache(ResponseCache):
+    """
+    Keeps the responses of the GETs in the django cache, shared by all the processes,
+    the backend evicts them (most backends drop the least recently used entries when full).
+    cache_max_entries is not enforced, the paths are only bounded by the backend (exp: its MAX_ENTRIES option).
+    """
+    # how long the entries which can be revalidated are kept after they expire, in seconds
+    stale_timeout = getattr(settings, 'SF_RESPONSE_CACHE_STALE_TIMEOUT', 60 * 60 * 24)
+
+    def __init__(self, prefix):
+        super(SharedResponseCache, self).__init__(prefix)
+        self.cache = get_sf_cache()
+
+    def get_key(self, path):
+        return '%s:response:%s' % (self.prefix, hashlib.sha1(path.encode('utf-8')).hexdigest())
+
+    def get(self, resource, path):
+        return self.cache.get(self.get_key(path)) or {}
+
+    def set(self, resource, path, entries):
+        revalidable = [entry for entry in entries.values() if entry['etag'] or entry['last_modified']]
+        self.cache.set(self.get_key(path), entries,
+                       resource.cache_timeout + (self.stale_timeout if revalidable else 0))
+
+    def delete(self, path):
+        self.cache.delete(self.get_key(path))
+
+
+class CachedApi(object):
+    """
+    Mixin of a RestApi, caching the GETs of the resources having a cache_timeout, see sforce.api.client.BaseResource.
+    Once expired, a response having an ETag or a Last-Modified date is revalidated with If-None-Match/If-Modified-Since,
+    the api answers a 304 without any body if it did not change.
+    A POST, PUT, PATCH or DELETE on a path drops the responses cached for it.
+    """
+    # None disables the cache, exp: 'sforce.api.cache.ResponseCache'
+    response_cache_class = getattr(settings, 'SF_RESPONSE_CACHE', None)
+    write_methods = ('POST', 'PUT', 'PATCH', 'DELETE')
+
+    def __init__(self, *args, **kwargs):
+        # before the first requests, sent by the parent classes
+        self.response_cache = self.get_response_cache()
+        super(CachedApi, self).__init__(*args, **kwargs)
+
+    def get_response_cache(self):
+        cls = self.response_cache_class
+        if not cls:
+            return None
+        if isinstance(cls, (str, unicode)):
+            cls = import_class(cls)
+        return cls('%s:responses' % getattr(self, 'cache_prefix', self.__class__.__name__))
+
+    def get_cache_path(self, url):
+        return url.split('?', 1)[0]
+
+    def drop_responses(self, resource):
+        """
+        Drops the responses cached for the path of the resource, after a write on it.
+        """
+        if self.response_cache is not None:
+            self.response_cache.delete(self.get_cache_path(resource.get_url()))
+
+    def _dispatch(self, resource, method, params={}, data={}):
+        if self.response_cache is None:
+            return super(CachedApi, self)._dispatch(resource, method, params, data)
+        resource = self.get_resource(resource, params=params)
+        if method in self.write_methods:
+            try:
+                return super(CachedApi, self)._dispatch(resource, method, params, data)
+            finally:
+                self.drop_responses(resource)
+        if method != 'GET' or resource.cache_timeout is None or data or resource.headers:
+            # the conditional requests of the caller are left alone
+            return super(CachedApi, self)._dispatch(resource, method, params, data)
+
+        url = resource.get_url(method)
+        path = self.get_cache_path(url)
+        entries = self.response_cache.get(resource, path)
+        entry = entries.get(url)
+        if entry is not None and entry['expires'] > time.time():
+            self.response_cache.count('hits')
+            return entry['payload']
+
+        headers = {}
+        if entry is not None and entry['etag']:
+            headers['If-None-Match'] = entry['etag']
+        if entry is not None and entry['last_modified']:
+            headers['If-Modified-Since'] = entry['last_modified']
+        resource.headers = headers
+        payload = super(CachedApi, self)._dispatch(resource, method, params, data)
+        if payload is None and headers:
+            # not modified
+            self.response_cache.count('revalidated')
+        else:
+            self.response_cache.count('misses')
+            entry = {'payload': payload,
+                     'etag': resource.response_headers.get('ETag'),
+                     'last_modified': resource.response_headers.get('Last-Modified')}
+        entry['expires'] = time.time() + resource.cache_timeout
+        entries[url] = entry
+        self.response_cache.set(resource, path, entries)
+        return entry['payload']
+
+
+class RecordCache(object):
+    """
+    Caches the records fetched by id, in a per process LRU in front of the django cache shared by all the processes.
+    The records of an id are grouped by projection (the fields fetched), so they are dropped all at once.
+    A record dropped by another process can still be served by the LRU of this one for local_timeout seconds.
+    stats counts the local hits, shared hits and misses of this process.
+    """
+    timeout = getattr(settings, 'SF_RECORD_CACHE_TIMEOUT', 5 * 60)  # in seconds
+    local_timeout = getattr(settings, 'SF_RECORD_CACHE_LOCAL_TIMEOUT', 30)
+    max_entries = getattr(settings, 'SF_RECORD_CACHE_MAX_ENTRIES', 1000)  # the ids kept in the LRU
+
+    def __init__(self, prefix):
+        self.prefix = prefix
+        self.cache = get_sf_cache()
+        self.local = OrderedDict()  # least recently used first: {key: (expires, {projection: record})}
+        self.lock = threading.Lock()
+        self.stats = {'local_hits': 0, 'shared_hits': 0, 'misses': 0}
+        self.stats_lock = threading.Lock()
+
+    def get_key(self, sobject, record_id):
+        return '%s:%s:%s' % (self.prefix, sobject, record_id)
+
+    def get(self, sobject, record_id, projection):
+        """
+        Returns a copy of the record, None if it is not cached.
+        """
+        key = self.get_key(sobject, record_id)
+        with self.lock:
+            item = self.local.pop(key, None)
+            if item is not None and item[0] > time.time():
+                self.local[key] = item  # the most recently used
+                if projection in item[1]:
+                    self.count('local_hits')
+                    return copy.deepcopy(item[1][projection])
+        records = self.cache.get(key) or {}
+        if projection in records:
+            self.set_local(key, records)
+            self.count('shared_hits')
+            return records[projection]
+        self.count('misses')
+        return None
+
+    def set(self, sobject, record_id, projection, record):
+        key = self.get_key(sobject, record_id)
+        records = self.cache.get(key) or {}
+        records[projection] = record
+        self.cache.set(key, records, self.timeout)
+        self.set_local(key, records)
+
+    def set_local(self, key, records):
+        records = copy.deepcopy(records)
+        with self.lock:
+            self.local.pop(key, None)
+            self.local[key] = (time.time() + self.local_timeout, records)
+            while len(self.local) > self.max_entries:
+                self.local.popitem(last=False)
+
+    def delete(self, sobject, record_ids):
+        keys = [self.get_key(sobject, record_id) for record_id in record_ids]
+        with self.lock:
+            for key in keys:
+                self.local.pop(key, None)
+        self.cache.delete_many(keys)
+
+    def count(self, stat):
+        with self.stats_lock:
+            self.stats[stat] += 1
+
+    def get_hit_rate(self):
+        """
+        The share of the records served from the cache, None before the first one.
+        """
+        with self.stats_lock:
+            total = sum(self.stats.values())
+            return float(self.stats['local_hits'] + self.stats['shared_hits']) / total if total else None
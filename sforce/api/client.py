@@ -1,11 +1,17 @@
+import sys
+import Queue
+import logging
 import urllib
 import urlparse
 import requests
+import requests.adapters
+import threading
+from gzip import GzipFile
+from StringIO import StringIO
 from datetime import datetime
-try:
-    import json
-except ImportError:
-    from django.utils import simplejson as json
+from django.db import connection
+from django.db import transaction
+from sforce.api.serializers import JsonCodec
 
 
 from logging import getLogger
@@ -14,7 +20,125 @@ log = getLogger(__package__)
 
 
 class APIException(Exception):
-    pass
+    def __init__(self, msg, status_code=None, payload=None):
+        super(APIException, self).__init__(msg)
+        # the http status and the parsed error returned by the api, if any
+        self.status_code = status_code
+        self.payload = payload
+
+
+def chunks(items, size):
+    """
+    Yields lists of at most size items.
+    """
+    chunk = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+class Result(object):
+    """
+    The pending result of a call run in another thread,
+    get() blocks until it is available, and raises the exception of the call if it failed.
+    """
+    def __init__(self, func, args=(), kwargs={}):
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs
+        self.value = self.exc_info = None
+        self.event = threading.Event()
+
+    def run(self):
+        try:
+            value = self.func(*self.args, **self.kwargs)
+        except Exception:
+            self.set(exc_info=sys.exc_info())
+        else:
+            self.set(value)
+
+    def set(self, value=None, exc_info=None):
+        self.value = value
+        self.exc_info = exc_info
+        self.event.set()
+
+    def done(self):
+        return self.event.is_set()
+
+    def exception(self, timeout=None):
+        if not self.event.wait(timeout):
+            raise APIException(u'%s did not return in %s seconds.' % (self.func, timeout))
+        return self.exc_info and self.exc_info[1]
+
+    def get(self, timeout=None):
+        if self.exception(timeout) is not None:
+            raise self.exc_info[0], self.exc_info[1], self.exc_info[2]
+        return self.value
+
+
+class WorkerPool(object):
+    """
+    Runs the submitted calls in at most size threads, started on demand.
+    """
+    def __init__(self, size):
+        self.size = size
+        self.queue = Queue.Queue()
+        self.workers = []
+        self.lock = threading.Lock()
+
+    def submit(self, func, *args, **kwargs):
+        result = Result(func, args, kwargs)
+        self.queue.put(result)
+        with self.lock:
+            if len(self.workers) < self.size:
+                worker = threading.Thread(target=self.work)
+                worker.daemon = True
+                worker.start()
+                self.workers.append(worker)
+        return result
+
+    def work(self):
+        try:
+            for result in iter(self.queue.get, None):
+                result.run()
+        finally:
+            # each thread has its own db connection
+            connection.close()
+
+    def close(self):
+        """
+        Stops the threads once the submitted calls are done.
+        """
+        with self.lock:
+            for worker in self.workers:
+                self.queue.put(None)
+            workers, self.workers = self.workers, []
+        for worker in workers:
+            worker.join()
+
+
+def import_class(path):
+    """
+    Returns the class (or any module attribute) from its dotted path.
+    """
+    module, cls_name = path.rsplit('.', 1)
+    # TODO: use importlib
+    m = __import__(module, globals(), locals(), [cls_name], -1)
+    return getattr(m, cls_name)
+
+
+def get_wire_size(response):
+    """
+    Returns the size of the body of a downloaded response as read from the connection, compressed or not.
+    """
+    raw = getattr(response, 'raw', None)
+    if hasattr(raw, 'tell'):  # urllib3 counts the bytes read before decoding them
+        return raw.tell()
+    return len(response.content)
 
 
 class BaseResource(object):
@@ -25,21 +149,72 @@ class BaseResource(object):
     methods = ['HEAD', 'GET', 'POST', 'PUT', 'PATCH', 'DELETE']
     error_key = 'error'
     timeout = 1  # in seconds
+    stream = False  # if True, parse_response gets the response before its body is downloaded
+    name = None  # the full name of the resource, set by RestApi.get_resource_class
+    # the request bodies bigger than this (in bytes) are sent gzipped, None to never compress them
+    compress_threshold = None
+    compress_level = 6
+    # the GETs are cached by a CachedApi for cache_timeout seconds, None to never cache them,
+    # and at most cache_max_entries paths are kept per resource, see sforce.api.cache.ResponseCache
+    cache_timeout = None
+    cache_max_entries = 100
 
     def __init__(self, api, **kwargs):
         self.api = api
         # url parameters
-        self.params = kwargs.get('params', {})
+        # copied because some resources alter them, and a request can be rerun
+        self.params = dict(kwargs.get('params', {}))
         self.parent = kwargs.get('parent', None)
+        # extra request headers, exp: {'If-Modified-Since': ...}
+        self.headers = kwargs.get('headers', {})
+        # the headers of the last response, exp: {'ETag': ...}
+        self.response_headers = {}
+
+    def get_path_params(self):
+        return self.params
 
     def get_path(self):
-        return self.path.format(**dict(zip(self.params, map(urllib.quote, self.params.values()))))
+        params = self.get_path_params()
+        return self.path.format(**dict(zip(params, map(urllib.quote, params.values()))))
+
+    def get_url(self, method=None):
+        """
+        Construct the full url from the Api scheme, domain and the resource path,
+        and the query string of the method if given.
+        """
+        return urlparse.urljoin(self.api.get_base_url(), self.get_relative_url(method))
+
+    def get_relative_url(self, method=None):
+        """
+        The resource path, followed by the query string of the method if given.
+        """
+        url = self.get_path()
+        query = method and self.get_query(method)
+        if query:
+            url += '%s%s' % ('&' if '?' in url else '?', urllib.urlencode(sorted(query.items())))
+        return url
+
+    def get_query(self, method):
+        """
+        Returns the query string parameters of a request, exp: {'fields': 'Id,Name'}
+        """
+        return {}
+
+    @classmethod
+    def get_projected_fields(cls):
+        """
+        The fields a GET is restricted to, all of them if empty.
+        """
+        return []
 
-    def get_url(self):
+    @classmethod
+    def get_projection(cls):
         """
-        Construct the full url from the Api scheme, domain and the resource path.
+        The projected fields, comma separated, computed once per class.
         """
-        return urlparse.urljoin(self.api.get_base_url(), self.get_path())
+        if '_projection' not in cls.__dict__:
+            cls._projection = ','.join(sorted(set(cls.get_projected_fields())))
+        return cls._projection
 
     def get_headers(self):
         return {}
@@ -50,6 +225,21 @@ class BaseResource(object):
     def parse_response(self, response):
         return response.text
 
+    def compress(self, body, headers):
+        """
+        Returns the body gzipped if it is bigger than compress_threshold, and sets its Content-Encoding.
+        The files are streamed as they are.
+        """
+        if self.compress_threshold is None or not isinstance(body, basestring) or len(body) <= self.compress_threshold:
+            return body
+        if isinstance(body, unicode):
+            body = body.encode('utf-8')
+        buf = StringIO()
+        with GzipFile(fileobj=buf, mode='wb', compresslevel=self.compress_level) as gzip_file:
+            gzip_file.write(body)
+        headers['Content-Encoding'] = 'gzip'
+        return buf.getvalue()
+
     def _request(self,
                  method,
                  data={},        # content data
@@ -60,21 +250,48 @@ class BaseResource(object):
         """
         if not method in self.methods:
             raise ValueError(u"The method %s is not available for the resource %s." % (method, self))
-        url = self.get_url()
+        url = self.get_url(method)
+        headers = self.get_headers()
+        headers.update(self.headers)
+        if self.stream:
+            kwargs['stream'] = True
+        body = self.format_data(data)
+        sent = requests.utils.super_len(body)
+        body = self.compress(body, headers)
         try:
             log.info(u'Accessing api %s : %s -data- %s' % (method, url, data))
             response = self.api.session.request(method,
                                                 url,
-                                                data=self.format_data(data),
-                                                headers=self.get_headers(),
-                                                timeout=self.timeout)
+                                                data=body,
+                                                headers=headers,
+                                                timeout=self.timeout,
+                                                **kwargs)
         except requests.Timeout:
             msg = u'Api call on %s : %s timed out !' % (method, url)
             log.error(msg)
             raise APIException(msg)
 
-        log.debug('Api call returned : %s', response.text)
-        if ok_code != requests.codes.no_content:
+        sizes = {'sent': sent, 'sent_on_wire': requests.utils.super_len(body)}
+        if not self.stream:
+            # the body of a streamed response is not downloaded yet
+            sizes.update({'received': len(response.content), 'received_on_wire': get_wire_size(response)})
+        self.api.count_bytes(self.name, **sizes)
+        self.response_headers = response.headers
+
+        if not self.stream and log.isEnabledFor(logging.DEBUG):
+            # decoding the whole body is costly on the big pages
+            log.debug('Api call returned : %s', response.text)
+        if response.status_code == requests.codes.not_modified:
+            # answer to a conditional request, the caller already has the content
+            return None
+
+        if response.status_code != ok_code:
+            try:
+                payload = self.parse_response(response)
+            except APIException:
+                # not a json error, exp: the html page of a proxy, the status code is still raised below
+                payload = {}
+        elif ok_code != requests.codes.no_content:
             payload = self.parse_response(response)
         else:
             # Some methods expect an empty response : PUT, PATCH and DELETE
@@ -87,7 +304,7 @@ class BaseResource(object):
             #if self.error_key in payload:
             msg += ' - %s' % payload
             log.error(msg)
-            raise APIException(msg)
+            raise APIException(msg, status_code=response.status_code, payload=payload)
 
         self.post_process(method, payload)
         return payload
@@ -127,9 +344,31 @@ class RestApi(object):
     resources_tree = None
     resources_tree_module = ''
 
+    # the resources classes built by all the instances, see get_resource_class
+    _resource_classes = {}
+    _resource_classes_lock = threading.Lock()
+
+    # the default number of threads of map, the connection pool keeps as many connections per host
+    max_workers = 10
+    # connection pooling, see requests.adapters.HTTPAdapter
+    pool_connections = 10  # the number of hosts kept in the pool
+    pool_maxsize = 10  # the number of connections kept per host
+    pool_block = False  # if True, the threads wait for a free connection instead of opening extra ones
+    max_retries = 0  # the retries of the failed connections, an int or a urllib3 Retry
+    keep_alive = True
+    # parses and serializes the data of the JsonResources, see sforce.api.serializers
+    json_codec = JsonCodec()
+
     def __init__(self):
         self.session = self._get_session()
+        self.mount_adapters(self.session)
+        self.pool_lock = threading.Lock()
+        # the responses are decoded by requests, the streamed ones included
+        self.session.headers['Accept-Encoding'] = 'gzip'
         self.resources = {}
+        self.resources_lock = threading.Lock()
+        self.wire_stats = {}
+        self.wire_stats_lock = threading.Lock()
         self.build_api()
 
     def raw(self, method, path, data={}):
@@ -144,28 +383,47 @@ class RestApi(object):
         return response
 
     def make_resource(self, name, node, parent=None):
+        """
+        Registers the resource described by node, and its subresources.
+        Only plain data is kept here, the class is built on first use by get_resource_class.
+        parent is the full name of the parent resource.
+        The resources are registered all at once, so the other threads never see half of them.
+        """
+        resources = {}
+        nodes = [(name, node, parent)]
+        while nodes:
+            name, node, parent = nodes.pop()
+            if parent:
+                full_name = '%s%s%s' % (parent, self.sub_resource_separator, name)
+            else:
+                full_name = name
+            resources[full_name] = (name, node, parent)
+            for sname, snode in (node.get('resources') or {}).iteritems():
+                nodes.append((sname, snode, full_name))
+        with self.resources_lock:
+            self.resources.update(resources)
+
+    def get_resource_class(self, name):
+        """
+        Builds the class of a registered resource,
+        the classes are shared between all the instances of the api class.
+        """
+        short_name, node, parent = self.resources[name]
         cls = node.get('class') or self.base_resource_class
         if isinstance(cls, (str, unicode)):
-            module, cls_name = cls.rsplit('.', 1)
-            # TODO: use importlib
-            m = __import__(module, globals(), locals(), [cls_name], -1)
-            cls = getattr(m, cls_name)
+            cls = import_class(cls)
 
-        path = node.get('path') or getattr(cls, 'path', None) or '%s/' % name
+        path = node.get('path') or getattr(cls, 'path', None) or '%s/' % short_name
         if parent:
-            name = '%s%s%s' % (parent.name,
-                               self.sub_resource_separator,
-                               name)
-            path = '%s%s' % (parent.path, path)
-
-        new_cls = type('_%sResource' % name.encode('ascii', errors='ignore').replace('.', ''),
-                       (cls,), {'name': name,
-                                'path': path})
-        self.resources[name] = new_cls
-        subnodes = node.get('resources')
-        if subnodes:
-            for name, snode in subnodes.iteritems():
-                self.make_resource(name, snode, parent=new_cls)
+            path = '%s%s' % (self.get_resource_class(parent).path, path)
+
+        key = (self.__class__, name, cls, path)
+        with self._resource_classes_lock:
+            if key not in self._resource_classes:
+                self._resource_classes[key] = type('_%sResource' % name.encode('ascii', errors='ignore').replace('.', ''),
+                                                   (cls,), {'name': name,
+                                                            'path': path})
+            return self._resource_classes[key]
 
     def build_api(self):
         """
@@ -188,13 +446,91 @@ class RestApi(object):
     def _get_session(self):
         return requests.Session()
 
+    def mount_adapters(self, session, pool_size=None):
+        """
+        Configures the connection pools of the session, they keep pool_size connections per host,
+        so as many threads can share it without opening (and dropping) extra connections.
+        """
+        pool_size = pool_size or max(self.pool_maxsize, self.max_workers)
+        for prefix in ('http://', 'https://'):
+            session.mount(prefix, requests.adapters.HTTPAdapter(pool_connections=self.pool_connections,
+                                                                pool_maxsize=pool_size,
+                                                                pool_block=self.pool_block,
+                                                                max_retries=self.max_retries))
+        if not self.keep_alive:
+            session.headers['Connection'] = 'close'
+
+    def ensure_pool_size(self, size):
+        """
+        Grows the connection pools of the session, if they are smaller than size.
+        The session may be in use by other threads: the replaced adapters are closed,
+        their connections being dropped once released by the requests in flight.
+        """
+        with self.pool_lock:
+            if size <= max(self.pool_maxsize, self.max_workers):
+                return
+            replaced = [self.session.adapters.get(prefix) for prefix in ('http://', 'https://')]
+            self.pool_maxsize = size
+            self.mount_adapters(self.session)
+        for adapter in set(replaced):
+            if adapter is not None:
+                adapter.close()
+
+    def get_pool_stats(self):
+        """
+        Returns the stats of the connection pool of each host,
+        the connections are reused when there are less connections than requests.
+        exp: {'https://na1.salesforce.com:443': {'connections': 2, 'requests': 40}}
+        """
+        stats = {}
+        for adapter in set(self.session.adapters.values()):
+            pools = adapter.poolmanager.pools
+            for key in pools.keys():
+                pool = pools.get(key)
+                if pool is not None:
+                    stats['%s://%s:%s' % (pool.scheme, pool.host, pool.port)] = {'connections': pool.num_connections,
+                                                                                 'requests': pool.num_requests}
+        return stats
+
+    def count_bytes(self, name, **sizes):
+        with self.wire_stats_lock:
+            stats = self.wire_stats.setdefault(name, {'requests': 0, 'sent': 0, 'sent_on_wire': 0,
+                                                      'received': 0, 'received_on_wire': 0})
+            stats['requests'] += 1
+            for key, size in sizes.iteritems():
+                stats[key] += size
+
+    def get_wire_stats(self):
+        """
+        Returns the bytes sent and received per resource, before and after compression.
+        The bodies of the streamed responses are not counted.
+        exp: {'query': {'requests': 2, 'sent': 4, 'sent_on_wire': 4, 'received': 3000000, 'received_on_wire': 400000}}
+        """
+        with self.wire_stats_lock:
+            return dict([(name, dict(stats)) for name, stats in self.wire_stats.iteritems()])
+
+    def map(self, method, resource, params_list, data={}, max_workers=None):
+        """
+        Sends the request once per params of params_list, in at most max_workers threads sharing the session.
+        Returns the results in order, the exception of a failed request takes its place.
+        """
+        params_list = list(params_list)
+        max_workers = max_workers or self.max_workers
+        self.ensure_pool_size(max_workers)
+        pool = WorkerPool(max(min(max_workers, len(params_list)), 1))
+        try:
+            results = [pool.submit(self._dispatch, resource, method, params, data) for params in params_list]
+            return [result.exception() or result.value for result in results]
+        finally:
+            pool.close()
+
     def get_resource(self, resource, **kwargs):
         if isinstance(resource, BaseResource):
             return resource
 
         if not resource in self.resources:
             raise APIException("%s is not a valid resource." % resource)
-        return self.resources[resource](self, **kwargs)
+        return self.get_resource_class(resource)(self, **kwargs)
 
     def _dispatch(self, resource, method, params={}, data={}):
         resource = self.get_resource(resource, params=params)
@@ -220,19 +556,25 @@ class RestApi(object):
 
 
 class JsonResource(BaseResource):
+    codec = None  # defaults to the json_codec of the api
+
+    def get_codec(self):
+        return self.codec or self.api.json_codec
+
     def get_headers(self):
         return {"Content-Type": "application/json"}
 
     def parse_response(self, response):
         try:
-            return response.json()
+            # straight from the bytes, response.text would guess the encoding and decode the body first
+            return self.get_codec().loads(response.content)
         except ValueError, e:
             msg = u'Api call on returned invalid json : %s !' % (response.text)
             log.error(msg + repr(e))
             raise APIException(msg)
 
     def format_data(self, data):
-        return json.dumps(data)
+        return self.get_codec().dumps(data)
 
 
 class DateRangeResource(BaseResource):
@@ -245,17 +587,18 @@ class DateRangeResource(BaseResource):
     date_end_param = 'end'
     date_format = "%Y-%m-%dT%H:%M:%S+00:00"
 
-    def get_path(self):
+    def get_path_params(self):
+        params = dict(super(DateRangeResource, self).get_path_params())
         try:
-            if self.params['start'] >= self.params['end']:
-                raise ValueError(u"The 'start' parameter must chronologically precede 'end'.")
-            self.params[self.date_start_param] = datetime.strftime(self.params[self.date_start_param], self.date_format)
-            self.params[self.date_end_param] = datetime.strftime(self.params[self.date_end_param], self.date_format)
+            if params[self.date_start_param] >= params[self.date_end_param]:
+                raise ValueError(u"The '%s' parameter must chronologically precede '%s'." % (self.date_start_param, self.date_end_param))
+            params[self.date_start_param] = datetime.strftime(params[self.date_start_param], self.date_format)
+            params[self.date_end_param] = datetime.strftime(params[self.date_end_param], self.date_format)
         except KeyError:
             raise ValueError(u"'%s' and '%s' are both mandatory parameters for the %s resource." % (self.date_start_param, self.date_end_param, self.__class__))
         except TypeError:
             raise TypeError(u"'%s' and '%s' parameters for the %s resource should be instances of datetime.datetime." % (self.date_start_param, self.date_end_param, self.__class__))
-        return super(DateRangeResource, self).get_path()
+        return params
 
 
 class InstanceResource(BaseResource):
@@ -264,12 +607,23 @@ class InstanceResource(BaseResource):
     """
     path = '{id}/'
     methods = ['HEAD', 'GET', 'PATCH', 'DELETE']
+    fields = []  # the fields fetched by a GET, all of them if empty
 
     def get_path(self):
         if not u'id' in self.params:
             raise ValueError(u"'id' is a mandatory parameter of an %s." % self.__class__.__name__)
         return super(InstanceResource, self).get_path()
 
+    @classmethod
+    def get_projected_fields(cls):
+        return cls.fields
+
+    def get_query(self, method):
+        query = super(InstanceResource, self).get_query(method)
+        if method == 'GET' and self.get_projection():
+            query['fields'] = self.get_projection()
+        return query
+
 
 class ExternalIdInstanceResource(BaseResource):
     """
@@ -278,12 +632,23 @@ class ExternalIdInstanceResource(BaseResource):
     """
     path = '{fieldname}/{fieldvalue}/'
     methods = ['HEAD', 'GET', 'PATCH', 'DELETE']
+    fields = []  # the fields fetched by a GET, all of them if empty
 
     def get_path(self):
         if not u'fieldname' in self.params or not u'fieldvalue' in self.params:
             raise ValueError(u"'fieldname' and 'fieldvalue' are both mandatory parameters of an %s." % self.__class__.__name__)
         return super(ExternalIdInstanceResource, self).get_path()
 
+    @classmethod
+    def get_projected_fields(cls):
+        return cls.fields
+
+    def get_query(self, method):
+        query = super(ExternalIdInstanceResource, self).get_query(method)
+        if method == 'GET' and self.get_projection():
+            query['fields'] = self.get_projection()
+        return query
+
 
 ### django specific
 class ModelResource(BaseResource):
@@ -295,6 +660,9 @@ class ModelResource(BaseResource):
     model = None
     distant_id = 'dist_id'  # local name of the distant id
     fields_map = {}
+    extra_fields = []  # distant fields pulled along with the ones of fields_map, exp: ['LastModifiedDate']
+    # the instance attribute keeping the fields last synced, by resource name
+    synced_fields_attr = '_sforce_synced_fields'
 
     def __init__(self, api, **kwargs):
         super(ModelResource, self).__init__(api, **kwargs)
@@ -306,41 +674,162 @@ class ModelResource(BaseResource):
             self.path += '{id}/'
         return super(ModelResource, self).get_path()
 
-    def get_local_value(self, distant_field, distant_value):
+    @classmethod
+    def get_projected_fields(cls):
+        return list(cls.fields_map) + list(cls.extra_fields)
+
+    def get_query(self, method):
+        query = super(ModelResource, self).get_query(method)
+        # only the mapped fields of the instance are pulled
+        if method == 'GET' and getattr(self.instance, self.distant_id, None) and self.get_projection():
+            query['fields'] = self.get_projection()
+        return query
+
+    @classmethod
+    def get_converters(cls):
+        """
+        Returns the (distant field, local field, to local, to distant) of each mapped field, built once per class.
+        The conversions are the get_local_FIELD_value and get_distant_FIELD_value methods of the resource, if any,
+        FIELD being the local field name, exp:
+        > def get_local_country_value(self, value):
+        >     return COUNTRIES.index(value)
+        The get_local_FIELD_values and get_distant_FIELD_values methods convert a whole column at once.
+        """
+        if '_converters' not in cls.__dict__:
+            converters = []
+            for distant_field, local_field in sorted(cls.fields_map.iteritems()):
+                to_local = getattr(cls, 'get_local_%s_value' % local_field, None)
+                to_distant = getattr(cls, 'get_distant_%s_value' % local_field, None)
+                to_local_many = getattr(cls, 'get_local_%s_values' % local_field, None)
+                to_distant_many = getattr(cls, 'get_distant_%s_values' % local_field, None)
+                converters.append((distant_field, local_field,
+                                   (to_local, to_local_many),
+                                   (to_distant, to_distant_many)))
+            cls._converters = converters
+        return cls._converters
+
+    def convert(self, converters, value):
+        one, many = converters
+        if one is not None:
+            return one(self, value)
+        elif many is not None:
+            return many(self, [value])[0]
+        return value
+
+    def convert_many(self, converters, values):
+        one, many = converters
+        if many is not None:
+            return many(self, values)
+        elif one is not None:
+            return [one(self, value) for value in values]
+        return values
+
+    def get_local_value(self, local_field, distant_value):
         """
         From the distant value to the local value
         exp: 'France' becomes 1
         """
-        method_name = 'get_local_%s_value' % distant_field
-        if hasattr(self, method_name):
-            return getattr(self, method_name)(distant_value)
-        else:
-            return distant_value
+        for distant, local, to_local, to_distant in self.get_converters():
+            if local == local_field:
+                return self.convert(to_local, distant_value)
+        return distant_value
 
-    def get_distant_value(self, distant_field, local_value):
+    def get_distant_value(self, local_field, local_value):
         """
         From the local value to the distant value
         exp: 1 would become 'France'
         """
-        method_name = 'get_local_%s_value' % distant_field
-        if hasattr(self, method_name):
-            return getattr(self, method_name)(local_value)
-        else:
-            return local_value
+        for distant, local, to_local, to_distant in self.get_converters():
+            if local == local_field:
+                return self.convert(to_distant, local_value)
+        return local_value
 
     def get_local_fields(self):
         """
         Returns a mapping of the form:
         DISTANT_FIELD_NAME: LOCAL_VALUE
         """
-        return dict([(k, self.get_distant_value(v, getattr(self.instance, v, v))) for k, v in self.fields_map.iteritems()])
+        instance = self.instance
+        return dict([(distant, self.convert(to_distant, getattr(instance, local, local)))
+                     for distant, local, to_local, to_distant in self.get_converters()])
 
     def get_distant_fields(self, payload):
         """
         Returns a mapping of the form:
         LOCAL_FIELD_NAME: DISTANT_VALUE
         """
-        return dict([(v, self.get_local_value(v, payload[k])) for k, v in self.fields_map.iteritems()])
+        return dict([(local, self.convert(to_local, payload[distant]))
+                     for distant, local, to_local, to_distant in self.get_converters()])
+
+    def get_local_fields_many(self, instances):
+        """
+        get_local_fields of each instance, the values are converted column by column.
+        """
+        rows = [{} for instance in instances]
+        for distant, local, to_local, to_distant in self.get_converters():
+            values = self.convert_many(to_distant, [getattr(instance, local, local) for instance in instances])
+            for row, value in zip(rows, values):
+                row[distant] = value
+        return rows
+
+    def get_distant_fields_many(self, payloads):
+        """
+        get_distant_fields of each payload, the values are converted column by column.
+        """
+        rows = [{} for payload in payloads]
+        for distant, local, to_local, to_distant in self.get_converters():
+            values = self.convert_many(to_local, [payload[distant] for payload in payloads])
+            for row, value in zip(rows, values):
+                row[local] = value
+        return rows
+
+    def get_synced_fields(self):
+        """
+        Returns the local fields (see get_local_fields) as they were last pulled or pushed, None if unknown.
+        """
+        return getattr(self.instance, self.synced_fields_attr, {}).get(self.name)
+
+    def set_synced_fields(self, fields=None):
+        if fields is None:
+            fields = self.get_local_fields()
+        self.instance.__dict__.setdefault(self.synced_fields_attr, {})[self.name] = fields
+
+    def get_changed_fields(self, fields=None):
+        """
+        Returns the local fields which changed since the instance was last synced, all of them if it never was.
+        """
+        if fields is None:
+            fields = self.get_local_fields()
+        synced = self.get_synced_fields()
+        if synced is None:
+            return fields
+        return dict([(k, v) for k, v in fields.iteritems() if k not in synced or synced[k] != v])
+
+
+def bulk_update(instances, fields):
+    """
+    Saves only the given fields of the instances, in as few queries as the django version allows.
+    """
+    if not instances:
+        return
+    manager = instances[0].__class__._default_manager
+    if hasattr(manager, 'bulk_update'):  # django >= 2.2
+        manager.bulk_update(instances, fields)
+        return
+    atomic = getattr(transaction, 'atomic', None) or transaction.commit_on_success  # django < 1.6
+    with atomic():
+        for instance in instances:
+            manager.filter(pk=instance.pk).update(**dict([(f, getattr(instance, f)) for f in fields]))
+
+
+def get_errors(exception):
+    """
+    Describes an APIException the way the api describes a failed record.
+    """
+    payload = exception.payload if isinstance(exception.payload, dict) else {}
+    return [{'statusCode': payload.get('errorCode'),
+             'message': payload.get('message', unicode(exception)),
+             'fields': payload.get('fields', [])}]
 
 
 class ModelBasedApi(RestApi):
@@ -355,6 +844,8 @@ class ModelBasedApi(RestApi):
     > u.last_name = 'bar'
     > api.push('Account', u)  # synchro local -> distant
     """
+    # if set, skips the pushes of the fields already pushed, see sforce.api.cache.PushStore
+    push_store = None
 
     def pull(self, resource_name, instance, save=True):
         resource = self.get_resource(resource_name, instance=instance)
@@ -366,21 +857,86 @@ class ModelBasedApi(RestApi):
         payload = self.get(resource)
         for local_field, distant_value in resource.get_distant_fields(payload).iteritems():
             setattr(instance, local_field, distant_value)
+        resource.set_synced_fields()
+        if self.push_store is not None:
+            self.push_store.set_pushed(resource.name, dist_id, resource.get_local_fields())
         if save:
             instance.save()
         return payload
 
+    def pull_many(self, resource_name, instances, batch_size=100):
+        """
+        Pulls every instance, and saves each batch in a single bulk update.
+        Returns the instances which could not be pulled (not synced yet or failed).
+        """
+        if hasattr(instances, 'iterator'):  # a queryset
+            instances = instances.iterator()
+        missing = []
+        for batch in chunks(instances, batch_size):
+            pulled = []
+            for instance in batch:
+                try:
+                    self.pull(resource_name, instance, save=False)
+                except (ValueError, APIException):
+                    missing.append(instance)
+                else:
+                    pulled.append(instance)
+            resource = self.get_resource(resource_name)
+            bulk_update(pulled, resource.fields_map.values())
+        return missing
+
+    def get_changed_fields(self, resource, dist_id, fields):
+        """
+        Returns the fields of the instance of resource changed since its last pull or push,
+        the push_store tells them for an instance fresh from the db, which doesn't know its synced fields.
+        """
+        if resource.get_synced_fields() is None and self.push_store is not None:
+            return self.push_store.get_changed_fields(resource.name, dist_id, fields)
+        return resource.get_changed_fields(fields)
+
     def push(self, resource_name, instance):
+        """
+        Creates or updates the distant object, an update only sends the fields changed since the last pull or push,
+        and nothing at all if none changed (or if the push_store knows they were already pushed).
+        """
         resource = self.get_resource(resource_name, instance=instance)
+        store = self.push_store
+        dist_id = getattr(instance, resource.distant_id, None)
         fields = resource.get_local_fields()
 
-        if getattr(instance, resource.distant_id, None):
+        if dist_id:
             # update - TODO: check the updated fields returned ?
-            return self.patch(resource, data=fields)
+            changed = self.get_changed_fields(resource, dist_id, fields)
+            if not changed or (store is not None and store.is_pushed(resource.name, dist_id, fields)):
+                if store is not None:
+                    store.count('skipped')
+                resource.set_synced_fields(fields)
+                return {}
+            payload = self.patch(resource, data=changed)
         else:
             # create
             payload = self.post(resource, data=fields)
             # if no exception was raised, it's a success
-            setattr(instance, resource.distant_id, payload['id'])
+            dist_id = payload['id']
+            setattr(instance, resource.distant_id, dist_id)
             instance.save()
-            return payload
+        resource.set_synced_fields(fields)
+        if store is not None:
+            store.count('pushed')
+            store.set_pushed(resource.name, dist_id, fields)
+        return payload
+
+    def push_many(self, resource_name, instances):
+        """
+        Pushes every instance, a failure does not stop the others.
+        Returns the result of each instance, in order, exp: {'id': ..., 'success': True, 'errors': []}
+        """
+        results = []
+        for instance in instances:
+            resource = self.get_resource(resource_name, instance=instance)
+            try:
+                self.push(resource_name, instance)
+                results.append({'id': getattr(instance, resource.distant_id), 'success': True, 'errors': []})
+            except APIException, e:
+                results.append({'id': getattr(instance, resource.distant_id, None), 'success': False, 'errors': get_errors(e)})
+        return results
@@ -0,0 +1,163 @@
+"""
+Salesforce composite resources, allowing to work on several records in a single request.
+"""
+import sys
+import requests
+
+from sforce.api.client import Result
+from sforce.api.client import APIException
+from sforce.api.client import chunks
+from sforce.api.salesforce import SalesForceResource
+
+from logging import getLogger
+log = getLogger(__package__)
+
+
+class SObjectCollectionsResource(SalesForceResource):
+    """
+    composite/sobjects/, creates or updates up to max_records records of any type,
+    returns the result of each record, in order.
+    """
+    methods = ['POST', 'PATCH', 'DELETE']
+    max_records = 200
+    min_api_version = '42.0'
+
+    def post(self, data):
+        return self._request('POST', data, ok_code=requests.codes.ok)
+
+    def patch(self, data):
+        return self._request('PATCH', data, ok_code=requests.codes.ok)
+
+
+class SObjectCollectionsRetrieveResource(SalesForceResource):
+    """
+    composite/sobjects/{sobject}/, fetches the given fields of up to max_records records of the same type,
+    returns the records in the order of the ids, null for the ones which were not found.
+    """
+    path = '{sobject}/'
+    methods = ['POST']
+    max_records = 2000
+    min_api_version = '42.0'
+    max_query_ids = 200  # the ids per soql query fetching the records below min_api_version
+
+    def post(self, data):
+        return self._request('POST', data, ok_code=requests.codes.ok)
+
+
+class SObjectTreeResource(SalesForceResource):
+    """
+    composite/tree/{sobject}/, creates up to max_records records along with their children (5 levels deep), all or none.
+    returns the id of each record by referenceId.
+    """
+    methods = ['POST']
+    max_records = 200
+
+
+class CompositeBatchResource(SalesForceResource):
+    """
+    composite/batch/, runs up to max_requests independent subrequests (api version min_api_version and above),
+    returns the status code and the result of each one, in order.
+    """
+    methods = ['POST']
+    max_requests = 25
+    min_api_version = '34.0'
+
+    def post(self, data):
+        return self._request('POST', data, ok_code=requests.codes.ok)
+
+
+class BatchResult(Result):
+    """
+    The result of a queued request, waiting for it sends the batch right away.
+    """
+    def __init__(self, batch):
+        super(BatchResult, self).__init__(batch.flush)
+        self.batch = batch
+
+    def exception(self, timeout=None):
+        if not self.done():
+            self.batch.flush()
+        return super(BatchResult, self).exception(timeout)
+
+
+class Batch(object):
+    """
+    Queues the requests on the batchable resources, and sends them with composite/batch,
+    see SalesForceApi.batching
+    """
+    resource_name = 'composite.batch'
+    methods = ['GET', 'POST', 'PATCH', 'DELETE']
+
+    def __init__(self, api):
+        self.api = api
+        self.resource = api.get_resource(self.resource_name)
+        self.supported = api.has_api_version(self.resource.min_api_version)
+        self.queue = []
+
+    def accepts(self, resource, method):
+        return getattr(resource, 'batchable', False) and method in self.methods
+
+    def add(self, resource, method, data={}):
+        if not self.supported:
+            result = Result(self.send, (resource, method, data))
+            result.run()
+            return result
+        result = BatchResult(self)
+        self.queue.append((resource, method, data, result))
+        if len(self.queue) >= self.resource.max_requests:
+            self.flush()
+        return result
+
+    def get_subrequest(self, resource, method, data):
+        subrequest = {'method': method,
+                      'url': 'v%s/%s' % (self.api.api_version, resource.get_relative_url(method))}
+        if data:
+            subrequest['richInput'] = data
+        return subrequest
+
+    def send(self, resource, method, data):
+        """
+        Sends a request on its own, below the api version of composite/batch.
+        """
+        batch, self.api.local.batch = self.api.local.batch, None
+        try:
+            return self.api._dispatch(resource, method, data=data)
+        finally:
+            self.api.local.batch = batch
+
+    def flush(self):
+        """
+        Sends the queued requests, and sets their results.
+        """
+        queue, self.queue = self.queue, []
+        for queued in chunks(queue, self.resource.max_requests):
+            data = {'batchRequests': [self.get_subrequest(resource, method, data) for resource, method, data, result in queued],
+                    'haltOnError': False}
+            try:
+                payload = self.api.post(self.resource, data=data)
+            except Exception:
+                # the api errors as well as the connection ones, the waiting results would never be set otherwise
+                exc_info = sys.exc_info()
+                for resource, method, data, result in queued:
+                    result.set(exc_info=exc_info)
+                continue
+            finally:
+                # whatever the outcome, the writes might have been applied
+                for resource, method, data, result in queued:
+                    self.api.drop_written(resource, method)
+            for (resource, method, data, result), subresult in zip(queued, payload['results']):
+                self.set_result(resource, method, result, subresult)
+
+    def set_result(self, resource, method, result, subresult):
+        status_code, payload = subresult['statusCode'], subresult['result']
+        if status_code >= requests.codes.multiple_choices:
+            if type(payload) == list:
+                payload = payload[0]
+            msg = u'Batched api call on %s : %s returned a status code %s - %s' % (method, resource.get_path(), status_code, payload)
+            log.error(msg)
+            result.set(exc_info=(APIException, APIException(msg, status_code=status_code, payload=payload), None))
+            return
+        if payload is None:
+            payload = {}  # the methods expecting an empty response
+        resource.post_process(method, payload)
+        result.set(payload)
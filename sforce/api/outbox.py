@@ -0,0 +1,144 @@
+"""
+Transactional outbox of the pushes: saving an instance only writes an OutboxEntry, in the same transaction,
+and a worker pushes the pending entries in batches.
+> enqueue('user', user)  # in a post_save signal handler
+> Outbox(api).drain()  # in a worker, see the drain_sforce_outbox command
+
+The saves of an instance are coalesced in a single entry, pushed with the state of the instance at the time of the push.
+An instance is pushed by one worker at a time, and pushed again if it was saved during its push.
+"""
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db import IntegrityError
+from django.db.models import F
+from django.utils import timezone
+
+from sforce.models import OutboxEntry
+
+from logging import getLogger
+log = getLogger(__package__)
+
+
+def enqueue(resource_name, instance):
+    """
+    Schedules the push of the instance, call it in the transaction saving the instance.
+    """
+    lookup = {'resource': resource_name, 'object_id': unicode(instance.pk)}
+    # next_attempt is left alone, the entry might be in a push or waiting for a retry
+    if OutboxEntry.objects.filter(**lookup).update(version=F('version') + 1):
+        return
+    sid = transaction.savepoint()
+    try:
+        OutboxEntry.objects.create(next_attempt=timezone.now(), **lookup)
+    except IntegrityError:
+        # created by a concurrent save
+        transaction.savepoint_rollback(sid)
+        OutboxEntry.objects.filter(**lookup).update(version=F('version') + 1)
+    else:
+        transaction.savepoint_commit(sid)
+
+
+class Outbox(object):
+    """
+    Pushes the pending entries with api.push_many, batch_size instances at a time.
+    The instances are fetched from the model of the ModelResource, which must be set.
+    The failed pushes are retried after an exponential backoff.
+    """
+    batch_size = getattr(settings, 'SF_OUTBOX_BATCH_SIZE', 200)
+    lease = timedelta(minutes=5)  # how long a worker owns the entries it is pushing
+    retry_delay = timedelta(seconds=30)  # doubled by each failed attempt
+    max_retry_delay = timedelta(hours=6)
+
+    def __init__(self, api, batch_size=None):
+        self.api = api
+        self.batch_size = batch_size or self.batch_size
+
+    def get_retry_delay(self, attempts):
+        return min(self.retry_delay * 2 ** min(attempts - 1, 16), self.max_retry_delay)
+
+    def claim(self):
+        """
+        Returns the due entries of a batch, and keeps the other workers off them until the lease ends.
+        """
+        now = timezone.now()
+        ids = list(OutboxEntry.objects.filter(next_attempt__lte=now)
+                                      .order_by('next_attempt', 'pk')
+                                      .values_list('pk', flat=True)[:self.batch_size])
+        if not ids:
+            return []
+        # the entries claimed (or saved) by someone else in the meantime are left out
+        leased_until = now + self.lease
+        OutboxEntry.objects.filter(pk__in=ids, next_attempt__lte=now).update(next_attempt=leased_until)
+        return list(OutboxEntry.objects.filter(pk__in=ids, next_attempt=leased_until))
+
+    def push(self, resource_name, entries):
+        """
+        Pushes the instances of the entries, and removes the entries of the successful pushes.
+        Returns the number of instances pushed and failed.
+        """
+        resource = self.api.get_resource(resource_name)
+        if resource.model is None:
+            # the instances are fetched by pk, from the model of the ModelResource
+            now = timezone.now()
+            for entry in entries:
+                self.retry(entry, u'The %s resource has no model.' % resource_name, now)
+            return 0, len(entries)
+        manager = resource.model._default_manager
+        instances = dict([(unicode(instance.pk), instance)
+                          for instance in manager.filter(pk__in=[entry.object_id for entry in entries])])
+        # the instances deleted since then have nothing to push
+        gone = [entry.pk for entry in entries if entry.object_id not in instances]
+        OutboxEntry.objects.filter(pk__in=gone).delete()
+        entries = [entry for entry in entries if entry.object_id in instances]
+
+        try:
+            results = self.api.push_many(resource_name, [instances[entry.object_id] for entry in entries])
+        except Exception, e:
+            # the whole batch failed (a connection error...), its entries are retried instead of waiting for the lease to end
+            log.exception(u'Push of %s %s entries failed' % (len(entries), resource_name))
+            now = timezone.now()
+            for entry in entries:
+                self.retry(entry, unicode(e) or e.__class__.__name__, now)
+            return 0, len(entries)
+        pushed = failed = 0
+        now = timezone.now()
+        for entry, result in zip(entries, results):
+            if result['success']:
+                # an entry saved again during the push is pushed again
+                OutboxEntry.objects.filter(pk=entry.pk, version=entry.version).delete()
+                OutboxEntry.objects.filter(pk=entry.pk).update(attempts=0, last_error='', next_attempt=now)
+                pushed += 1
+            else:
+                self.retry(entry, u'; '.join([u'%s: %s' % (error['statusCode'], error['message']) for error in result['errors']]), now)
+                failed += 1
+        return pushed, failed
+
+    def retry(self, entry, error, now):
+        """
+        Schedules the next attempt of a failed entry, after the backoff of its attempts.
+        """
+        attempts = entry.attempts + 1
+        log.warning(u'Push of %s failed (attempt %s): %s' % (entry, attempts, error))
+        OutboxEntry.objects.filter(pk=entry.pk).update(attempts=attempts,
+                                                       last_error=error,
+                                                       next_attempt=now + self.get_retry_delay(attempts))
+
+    def drain(self):
+        """
+        Pushes the due entries until there are none left.
+        Returns the number of instances pushed and failed.
+        """
+        pushed = failed = 0
+        entries = self.claim()
+        while entries:
+            by_resource = {}
+            for entry in entries:
+                by_resource.setdefault(entry.resource, []).append(entry)
+            for resource_name, resource_entries in by_resource.iteritems():
+                batch_pushed, batch_failed = self.push(resource_name, resource_entries)
+                pushed += batch_pushed
+                failed += batch_failed
+            entries = self.claim()
+        return pushed, failed
@@ -5,9 +5,10 @@ resources_tree = {
             }
         },
     'appMenu': {
+        'class': 'sforce.api.salesforce.MetadataResource',
         'resources': {
-            'AppSwitcher':{},
-            'SalesForce1':{},
+            'AppSwitcher': {'class': 'sforce.api.salesforce.MetadataResource'},
+            'SalesForce1': {'class': 'sforce.api.salesforce.MetadataResource'},
             }
         },
     'chatter': {
@@ -17,6 +18,19 @@ resources_tree = {
             'users': {},
             }
         },
+    'composite': {
+        'resources': {
+            'batch': {'class': 'sforce.api.composite.CompositeBatchResource'},
+            'sobjects': {
+                'class': 'sforce.api.composite.SObjectCollectionsResource',
+                'resources': {
+                    'retrieve': {'class': 'sforce.api.composite.SObjectCollectionsRetrieveResource'},
+                    }
+                },
+            'tree': {'class': 'sforce.api.composite.SObjectTreeResource',
+                     'path': 'tree/{sobject}/'},
+            }
+        },
     'connect': {
         'resources': {
             'comunities': {},
@@ -24,8 +38,30 @@ resources_tree = {
             }
         },
     'flexiPage': {'class': 'sforce.api.salesforce.InstanceResource'},
-    'limits': {},
+    'limits': {'class': 'sforce.api.salesforce.LimitsResource'},
     'identity': {},
+    'jobs': {
+        'resources': {
+            'query': {
+                'class': 'sforce.api.bulk.BulkJobsResource',
+                'resources': {
+                    'job': {'class': 'sforce.api.bulk.BulkJobResource'},
+                    'results': {'class': 'sforce.api.bulk.BulkQueryResultsResource'},
+                    }
+                },
+            'ingest': {
+                'class': 'sforce.api.bulk.BulkJobsResource',
+                'resources': {
+                    'job': {'class': 'sforce.api.bulk.BulkJobResource'},
+                    'batches': {'class': 'sforce.api.bulk.BulkUploadResource'},
+                    'successfulResults': {'class': 'sforce.api.bulk.BulkResultsResource',
+                                          'path': '{id}/successfulResults/'},
+                    'failedResults': {'class': 'sforce.api.bulk.BulkResultsResource',
+                                      'path': '{id}/failedResults/'},
+                    }
+                },
+            }
+        },
     'licensing': {
         'resources': {
             'tenants': {}
@@ -39,10 +75,10 @@ resources_tree = {
         },
     'query': {'class': 'sforce.api.salesforce.QueryResource'},
     'queryAll': {'class': 'sforce.api.salesforce.QueryAllResource'},
-    'quickActions': {},
+    'quickActions': {'class': 'sforce.api.salesforce.MetadataResource'},
     'recent': {},
     'search': {'class': 'sforce.api.salesforce.SearchResource'},
     'sobjects': {'class': 'sforce.api.salesforce.SObjectsResource'},
-    'theme': {},
+    'theme': {'class': 'sforce.api.salesforce.MetadataResource'},
     'tooling': {},
     }
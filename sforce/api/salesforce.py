@@ -5,7 +5,13 @@ Note: list of error codes i bumped into, we might want to recover from some of t
 + ENTITY_IS_DELETED
 """
 
+import time
+import urllib
+import hashlib
 import urlparse
+import threading
+from contextlib import contextmanager
+from email.utils import formatdate
 
 from django.conf import settings
 try:
@@ -17,11 +23,21 @@ from oauthlib.oauth2 import LegacyApplicationClient
 from oauthlib.oauth2.rfc6749.parameters import validate_token_parameters
 
 from sforce.api.client import RestApi
+from sforce.api.client import APIException
+from sforce.api.client import chunks
+from sforce.api.client import get_errors
+from sforce.api.client import bulk_update
+from sforce.api.client import import_class
 from sforce.api.client import JsonResource
 from sforce.api.client import InstanceResource
 from sforce.api.client import ModelBasedApi
 from sforce.api.client import DateRangeResource
 from sforce.api.client import ExternalIdInstanceResource
+from sforce.api.cache import get_sf_cache
+from sforce.api.cache import CachedApi
+from sforce.api.serializers import get_codec
+from sforce.api.bulk import BulkPush
+from sforce.api.bulk import BulkQueryJob
 
 from logging import getLogger
 log = getLogger(__package__)
@@ -59,53 +75,177 @@ class SalesForceAuthApi(RestApi):
     client_key = settings.SF_CONSUMER_KEY
     client_secret = settings.SF_CONSUMER_SECRET
 
+    # the session lifetime (in seconds) configured in the org, None to only refresh the token on auth errors
+    session_timeout = getattr(settings, 'SF_SESSION_TIMEOUT', 2 * 60 * 60)
+    session_refresh_margin = 5 * 60
+    # shared by all the instances, so only one thread refreshes the token at a time
+    token_lock = threading.RLock()
+
+    # connection pooling, see RestApi
+    pool_connections = getattr(settings, 'SF_POOL_CONNECTIONS', 10)
+    pool_maxsize = getattr(settings, 'SF_POOL_MAXSIZE', 10)
+    pool_block = getattr(settings, 'SF_POOL_BLOCK', False)
+    max_retries = getattr(settings, 'SF_MAX_RETRIES', 0)
+    keep_alive = getattr(settings, 'SF_KEEP_ALIVE', True)
+    json_codec = get_codec(getattr(settings, 'SF_JSON_CODEC', 'json'))
+
+    cache_prefix = 'SalesForceApi'
+    token_store_class = getattr(settings, 'SF_TOKEN_STORE', 'sforce.api.cache.TokenStore')
+
     def __init__(self):
         super(SalesForceAuthApi, self).__init__()
+        self.token = None
+        self.token_store = self.get_token_store()
         self.get_session_id()
 
     def _get_session(self):
         return OAuth2Session(client=SalesForceLegacyApplicationClient(client_id=self.client_key))
 
-    def get_session_id(self):
+    def get_token_store(self):
+        cls = self.token_store_class
+        if isinstance(cls, (str, unicode)):
+            cls = import_class(cls)
+        credentials = hashlib.sha1('%s:%s:%s' % (self.token_request_url, self.client_key, self.username)).hexdigest()
+        return cls('%s:token:%s' % (self.cache_prefix, credentials))
+
+    def fetch_token(self):
         token = self.session.fetch_token(self.token_request_url,
                                          username=self.username,
                                          password=self.password,
                                          client_id=self.client_key,
                                          client_secret=self.client_secret)
         log.info('Fetched token %s' % token)
+        return token
+
+    def get_session_id(self, stale_token=None):
+        """
+        Authenticates the session with the token shared by all the processes,
+        a new one is only fetched if there is none yet or if the shared one is stale_token.
+        """
+        token = self.token_store.get_or_fetch(self.fetch_token, stale=stale_token)
+        self.token = self.session.token = token
         self.domain = token['instance_url']
+        # the identity url looks like https://login.salesforce.com/id/ORG_ID/USER_ID
+        self.org_id = token['id'].rstrip('/').split('/')[-2]
         if 'identity' in self.resources:
-            self.resources['identity'].path = token['id']
-
-    def _dispatch(self, *args, **kwargs):
-        rerun = kwargs.pop('rerun', None)
-        response = super(SalesForceAuthApi, self)._dispatch(*args, **kwargs)
-        if response and self.error_key in response:
-            # we had an Authentification exception
-            # trying to refetch a token and rerun the request
-            if response[self.error_key] == self.auth_error and not rerun:
-                log.warning('Got %s error, trying to fetch another token and rerun the request.' % self.auth_error)
-                self.get_session_id()
-                kwargs['rerun'] = True  # ensure we will not try to do it indefinitely
-                self._dispatch(*args, **kwargs)
-        return response
+            name, node, parent = self.resources['identity']
+            self.resources['identity'] = (name, dict(node, path=token['id']), parent)
+
+    def refresh_session_id(self, stale_token=None):
+        """
+        Replaces the stale token, the threads waiting on the lock
+        reuse the token fetched by the first one instead of fetching their own.
+        """
+        with self.token_lock:
+            if self.token and stale_token and self.token != stale_token:
+                return  # already refreshed by another thread
+            self.get_session_id(stale_token=stale_token)
+
+    def token_expires_soon(self):
+        if not self.session_timeout or not self.token or 'issued_at' not in self.token:
+            return False
+        issued_at = int(self.token['issued_at']) / 1000.0  # in milliseconds
+        return time.time() > issued_at + self.session_timeout - self.session_refresh_margin
+
+    def is_auth_error(self, exception):
+        payload = exception.payload
+        return isinstance(payload, dict) and payload.get(self.error_key) == self.auth_error
+
+    def _dispatch(self, resource, method, params={}, data={}):
+        token = self.token
+        if self.token_expires_soon():
+            log.info('The session is about to expire, fetching another token.')
+            self.refresh_session_id(stale_token=token)
+            token = self.token
+
+        try:
+            return super(SalesForceAuthApi, self)._dispatch(resource, method, params, data)
+        except APIException, e:
+            if not self.is_auth_error(e):
+                raise
+        # we had an Authentification exception
+        # trying to refetch a token and rerun the request, only once
+        log.warning('Got %s error, trying to fetch another token and rerun the request.' % self.auth_error)
+        self.refresh_session_id(stale_token=token)
+        return super(SalesForceAuthApi, self)._dispatch(resource, method, params, data)
+
+
+class Prefetch(threading.Thread):
+    """
+    Calls func in a thread, the result (or the exception) is available with result().
+    """
+    def __init__(self, func, *args):
+        super(Prefetch, self).__init__()
+        self.daemon = True
+        self.func = func
+        self.args = args
+        self.value = self.error = None
+        self.start()
+
+    def run(self):
+        try:
+            self.value = self.func(*self.args)
+        except Exception, e:
+            self.error = e
+
+    def result(self):
+        self.join()
+        if self.error is not None:
+            raise self.error
+        return self.value
 
 
 class SalesForceResource(JsonResource):
     error_key = u'errorCode'
     methods = ['GET']
+    batchable = False  # if True, the requests are queued within api.batching()
+    cache_records = False  # if True, the GETs of a record by id go through the record cache of the api
+    compress_threshold = getattr(settings, 'SF_COMPRESS_THRESHOLD', None)
+
+
+class MetadataResource(SalesForceResource):
+    """
+    The read-mostly resources (describe, theme, appMenu...), cached by SalesForceApi, see sforce.api.cache.CachedApi
+    """
+    cache_timeout = getattr(settings, 'SF_METADATA_CACHE_TIMEOUT', 60 * 60)
+    cache_max_entries = 1000
 
 
-class DeletedResource(SalesForceResource, DateRangeResource):
+class LimitsResource(MetadataResource):
+    cache_timeout = 60
+
+
+class FeedResource(SalesForceResource, DateRangeResource):
+    """
+    The ids of the records of a sobject changed between 2 dates, their cached copies are dropped.
+    """
+    def get_sobject(self):
+        return self.api.get_sobject_type(self.api.get_resource(self.name.rsplit('.', 1)[0]))
+
+    def get_ids(self, data):
+        """
+        The ids of the changed records, exp: the 'ids' of updated/
+        """
+        return data['ids']
+
+    def post_process(self, method, data):
+        if self.api.record_cache is not None:
+            self.api.drop_records(self.get_sobject(), self.get_ids(data))
+
+
+class DeletedResource(FeedResource):
     path = 'deleted/?start={start}&end={end}'
 
+    def get_ids(self, data):
+        return [record['id'] for record in data['deletedRecords']]
 
-class UpdatedResource(SalesForceResource, DateRangeResource):
+
+class UpdatedResource(FeedResource):
     path = 'updated/?start={start}&end={end}'
 
 
 class SFInstanceResource(SalesForceResource, InstanceResource):
-    pass
+    cache_records = True
 
 
 class SFExternalIdInstanceResource(SalesForceResource, ExternalIdInstanceResource):
@@ -113,7 +253,22 @@ class SFExternalIdInstanceResource(SalesForceResource, ExternalIdInstanceResourc
 
 
 class QueryResource(SalesForceResource):
-    pass
+    """
+    query/?q=SELECT..., the records come in pages, see SalesForceApi.iter_query
+    """
+    query_param = 'q'
+
+    def get_path_params(self):
+        # the query goes in the query string, see get_path
+        params = dict(super(QueryResource, self).get_path_params())
+        params.pop(self.query_param, None)
+        return params
+
+    def get_path(self):
+        path = super(QueryResource, self).get_path()
+        if self.query_param in self.params:
+            path += '?%s' % urllib.urlencode({self.query_param: self.params[self.query_param].encode('utf-8')})
+        return path
 
 
 class QueryAllResource(QueryResource):
@@ -129,42 +284,233 @@ class SObjectResource(SalesForceResource):
     'super' resource handling /Foo/ AND /Foo/instance
     """
     methods = ['GET', 'POST', 'PATCH', 'DELETE']
+    batchable = True
+    cache_records = True
 
+    def get_path(self):
+        path = super(SObjectResource, self).get_path()
+        if 'id' in self.params:
+            path += '%s/' % urllib.quote(self.params['id'])
+        return path
 
-class SObjectsResource(SalesForceResource):
-    def post_process(self, method, data):
-        # we populate the resources
-        if self.api.sobjects_whitelist:
-            sobjects = [d for d in data['sobjects'] if d['name'] in self.api.sobjects_whitelist]
-        else:
-            sobjects = data['sobjects']
 
+class SObjectsResource(SalesForceResource):
+    def get_tree(self, sobjects):
+        """
+        Returns the resources tree of the sobjects, as plain (cacheable) data.
+        """
+        tree = {}
         for obj in sobjects:
-            name = obj['name']
             sub = dict([(r, {}) for r in obj['urls']])
             # adding deleted and updated resources because for some reason they are not listed in 'urls'
             sub['updated'] = {'class': 'sforce.api.salesforce.UpdatedResource'}
             sub['deleted'] = {'class': 'sforce.api.salesforce.DeletedResource'}
+            for metadata in ('describe', 'layouts', 'compactLayouts', 'quickActions'):
+                if metadata in sub:
+                    sub[metadata] = {'class': 'sforce.api.salesforce.MetadataResource'}
+            # the blob fields (Attachment.Body, ContentVersion.VersionData...), streamed
+            sub['blob'] = {'class': 'sforce.api.blob.BlobResource'}
             # removing sobject wich is redundant
             del sub['sobject']
-            self.api.make_resource(name,
-                                   {'class': 'sforce.api.salesforce.SObjectResource',
-                                    'resources': sub},
-                                   parent=self)
+            tree[obj['name']] = {'class': 'sforce.api.salesforce.SObjectResource',
+                                 'resources': sub}
+        return tree
 
+    def post_process(self, method, data):
+        # we populate the resources
+        self.api.set_sobjects_tree(self.get_tree(data['sobjects']))
 
-class SalesForceApi(ModelBasedApi, SalesForceAuthApi):  # CachedApi
+
+class SalesForceApi(CachedApi, ModelBasedApi, SalesForceAuthApi):
     base_resource_class = SalesForceResource
     scheme = 'https'  # not actualy used, only here for information
     timeout = 3  # TODO: the sandbox is sloww...
     root_path = u'services/data/v%s/' % settings.SF_API_VERSION
-    cache_prefix = 'SalesForceApi'
+    api_version = settings.SF_API_VERSION
     resources_tree_module = getattr(settings, 'SF_RESOURCES', 'sforce.api.resources')
     sobjects_whitelist = getattr(settings, 'SF_SOBJECTS_WHITELIST', [])
+    # None disables the cache of the sobjects resources tree
+    sobjects_cache_timeout = getattr(settings, 'SF_SOBJECTS_CACHE_TIMEOUT', 60 * 60 * 24)
+    # how often (in seconds) a cached tree is checked against the org schema, None to never check
+    sobjects_check_interval = getattr(settings, 'SF_SOBJECTS_CHECK_INTERVAL', 60 * 60)
+    # bumped whenever SObjectsResource.get_tree changes, so the trees cached by older versions are not reused
+    sobjects_tree_version = 3
+
+    batch_class = 'sforce.api.composite.Batch'
+    # None disables the skipping of the pushes already done, see sforce.api.cache.PushStore
+    push_store_class = getattr(settings, 'SF_PUSH_STORE', None)
+    # None disables the cache of the records fetched by id, see sforce.api.cache.RecordCache
+    record_cache_class = getattr(settings, 'SF_RECORD_CACHE', None)
+    record_write_methods = ('PUT', 'PATCH', 'DELETE')
 
     def __init__(self):
+        self.local = threading.local()
+        self.record_cache = None
         super(SalesForceApi, self).__init__()
-        self.get('sobjects')
+        self.push_store = self.get_push_store()
+        self.record_cache = self.get_record_cache()
+        self.load_sobjects()
+
+    def get_push_store(self):
+        cls = self.push_store_class
+        if not cls:
+            return None
+        if isinstance(cls, (str, unicode)):
+            cls = import_class(cls)
+        return cls('%s:pushed:%s' % (self.cache_prefix, self.org_id))
+
+    def get_record_cache(self):
+        cls = self.record_cache_class
+        if not cls:
+            return None
+        if isinstance(cls, (str, unicode)):
+            cls = import_class(cls)
+        return cls('%s:records:%s' % (self.cache_prefix, self.org_id))
+
+    def get_record_key(self, resource):
+        """
+        Returns the (sobject, id) of the record of the resource, None if it is not about a single record.
+        """
+        record_id = resource.params.get('id')
+        instance = getattr(resource, 'instance', None)
+        if instance is not None and getattr(resource, 'distant_id', None):
+            record_id = getattr(instance, resource.distant_id, None)
+        if not record_id:
+            return None
+        return self.get_sobject_type(resource), record_id
+
+    def drop_records(self, sobject, ids):
+        """
+        Drops the cached copies of the records, after they changed.
+        """
+        if self.record_cache is not None and ids:
+            self.record_cache.delete(sobject, ids)
+
+    def drop_written(self, resource, method):
+        """
+        Drops the cached responses and record a request sent aside of _dispatch (exp: in a Batch) made stale.
+        """
+        if method in self.write_methods:
+            self.drop_responses(resource)
+        key = method in self.record_write_methods and self.record_cache is not None and self.get_record_key(resource)
+        if key:
+            sobject, record_id = key
+            self.drop_records(sobject, [record_id])
+
+    @contextmanager
+    def batching(self):
+        """
+        Within the block, the requests of the thread on batchable resources are queued, and sent
+        with composite/batch by groups of up to 25. They return a result right away,
+        get() returns the response of the request or raises its APIException: unlike outside of the block,
+        get, post, patch and delete return a BatchResult and not the payload on those resources.
+        The queue is sent when it is full, when a result is waited for, and at the end of the block.
+        Below the api version of composite/batch, the requests are sent one by one, their results are already set.
+        """
+        batch = getattr(self.local, 'batch', None)
+        if batch is not None:  # nested
+            yield batch
+            return
+        self.local.batch = batch = import_class(self.batch_class)(self)
+        try:
+            yield batch
+        finally:
+            self.local.batch = None
+            batch.flush()
+
+    def _dispatch(self, resource, method, params={}, data={}):
+        resource = self.get_resource(resource, params=params)
+        key = self.record_cache is not None and self.get_record_key(resource)
+        batch = getattr(self.local, 'batch', None)
+        if key and method in self.record_write_methods:
+            sobject, record_id = key
+            self.drop_records(sobject, [record_id])
+            if batch is None or not batch.accepts(resource, method):
+                try:
+                    return super(SalesForceApi, self)._dispatch(resource, method, params, data)
+                finally:
+                    # the record might have been cached again during the request
+                    self.drop_records(sobject, [record_id])
+        if batch is not None and batch.accepts(resource, method):
+            return batch.add(resource, method, data)
+        if not key or method != 'GET' or not getattr(resource, 'cache_records', False) or data or resource.headers:
+            return super(SalesForceApi, self)._dispatch(resource, method, params, data)
+
+        sobject, record_id = key
+        projection = resource.get_query(method).get('fields', '')
+        record = self.record_cache.get(sobject, record_id, projection)
+        if record is None:
+            record = super(SalesForceApi, self)._dispatch(resource, method, params, data)
+            self.record_cache.set(sobject, record_id, projection, record)
+        return record
+
+    def get_sobjects_cache_key(self, fingerprint=None):
+        key = '%s:sobjects:%s:%s:%s' % (self.cache_prefix, self.org_id, self.api_version, self.sobjects_tree_version)
+        if fingerprint:
+            key += ':%s' % fingerprint
+        return key
+
+    def load_sobjects(self):
+        """
+        Populates the sobjects resources from the cache,
+        only fetches the 'sobjects' resource if the cache is empty.
+        """
+        index = tree = None
+        if self.sobjects_cache_timeout:
+            cache = get_sf_cache()
+            index = cache.get(self.get_sobjects_cache_key())
+            if index:
+                tree = cache.get(self.get_sobjects_cache_key(index['fingerprint']))
+
+        if not tree:
+            self.get('sobjects')  # populates and caches the tree, see SObjectsResource.post_process
+            return
+
+        self.make_sobjects_resources(tree)
+        if self.sobjects_check_interval is not None and \
+                time.time() - index['checked_at'] > self.sobjects_check_interval:
+            check = threading.Thread(target=self.check_sobjects)
+            check.daemon = True
+            check.start()
+
+    def check_sobjects(self):
+        """
+        Conditional GET of the 'sobjects' resource, which is cheap as long as the org schema did not change.
+        The cached tree (and the resources) are replaced otherwise.
+        """
+        cache = get_sf_cache()
+        key = self.get_sobjects_cache_key()
+        index = cache.get(key)
+        if not index:
+            self.get('sobjects')
+            return
+
+        resource = self.get_resource('sobjects', headers={'If-Modified-Since': index['last_modified']})
+        if self.get(resource) is None:
+            log.debug('The sobjects did not change since %s.' % index['last_modified'])
+            index['checked_at'] = time.time()
+            cache.set(key, index, self.sobjects_cache_timeout)
+
+    def set_sobjects_tree(self, tree):
+        if self.sobjects_cache_timeout:
+            self.cache_sobjects_tree(tree)
+        self.make_sobjects_resources(tree)
+
+    def cache_sobjects_tree(self, tree):
+        fingerprint = hashlib.sha1(json.dumps(tree, sort_keys=True)).hexdigest()
+        index = {'fingerprint': fingerprint,
+                 'last_modified': formatdate(usegmt=True),
+                 'checked_at': time.time()}
+        cache = get_sf_cache()
+        # the tree first, so the index never points to a missing tree
+        cache.set(self.get_sobjects_cache_key(fingerprint), tree, self.sobjects_cache_timeout)
+        cache.set(self.get_sobjects_cache_key(), index, self.sobjects_cache_timeout)
+
+    def make_sobjects_resources(self, tree):
+        for name, node in tree.iteritems():
+            if self.sobjects_whitelist and name not in self.sobjects_whitelist:
+                continue
+            self.make_resource(name, node, parent='sobjects')
 
     def get_resource(self, resource, **kwargs):
         """
@@ -176,6 +522,253 @@ class SalesForceApi(ModelBasedApi, SalesForceAuthApi):  # CachedApi
                 resource = proxy
         return super(SalesForceApi, self).get_resource(resource, **kwargs)
 
+    def get_sobject_type(self, resource):
+        """
+        The sobject name of a resource, exp: 'Account' for sobjects/Account/
+        """
+        return getattr(resource, 'sobject', None) or [part for part in resource.path.split('/') if part and '{' not in part][-1]
+
+    def has_api_version(self, version):
+        """
+        Whether the api version is at least version, exp: '42.0'
+        """
+        return [int(n) for n in self.api_version.split('.')] >= [int(n) for n in version.split('.')]
+
+    def push_many(self, resource_name, instances):
+        """
+        Creates or updates the instances with the sObject Collections resource,
+        and saves the ids of the created ones in a single bulk update.
+        The updates only send the fields changed since the last pull or push, the unchanged instances are skipped.
+        Below the api version of the sObject Collections, the instances are pushed one by one.
+        Returns the result of each instance, in order, exp: {'id': ..., 'success': True, 'errors': []}
+        """
+        collections = self.get_resource('composite.sobjects')
+        if not self.has_api_version(collections.min_api_version):
+            return super(SalesForceApi, self).push_many(resource_name, instances)
+        instances = list(instances)
+        resource = self.get_resource(resource_name)
+        sobject = self.get_sobject_type(resource)
+
+        results = [None] * len(instances)
+        local_fields = resource.get_local_fields_many(instances)
+        creates, updates = [], []
+        for i, instance in enumerate(instances):
+            resource.instance = instance
+            dist_id = getattr(instance, resource.distant_id, None)
+            if dist_id:
+                record = self.get_changed_fields(resource, dist_id, local_fields[i])
+                if not record:
+                    resource.set_synced_fields(local_fields[i])
+                    results[i] = {'id': dist_id, 'success': True, 'errors': []}
+                    continue
+                record['id'] = dist_id
+                updates.append((i, record))
+            else:
+                record = dict(local_fields[i])
+                creates.append((i, record))
+            record['attributes'] = {'type': sobject}
+
+        created = []
+        for method, records in (('POST', creates), ('PATCH', updates)):
+            for chunk in chunks(records, collections.max_records):
+                data = {'allOrNone': False, 'records': [chunk_record for i, chunk_record in chunk]}
+                try:
+                    payload = self._dispatch(collections, method, data=data)
+                except APIException, e:
+                    payload = [{'id': chunk_record.get('id'), 'success': False, 'errors': get_errors(e)} for i, chunk_record in chunk]
+                for (i, record), result in zip(chunk, payload):
+                    results[i] = result
+                    if not result['success']:
+                        continue
+                    resource.instance = instances[i]
+                    resource.set_synced_fields(local_fields[i])
+                    if self.push_store is not None:
+                        self.push_store.set_pushed(resource.name, result['id'], local_fields[i])
+                    if method == 'POST':
+                        setattr(instances[i], resource.distant_id, result['id'])
+                        created.append(instances[i])
+
+        bulk_update(created, [resource.distant_id])
+        self.drop_records(sobject, [record['id'] for i, record in updates])
+        return results
+
+    def get_tree_record(self, resource_name, instance, children, refs):
+        """
+        Returns the sObject Tree record of the instance and its children,
+        refs gets the (instance, resource) of each record, the referenceId is its index.
+        """
+        resource = self.get_resource(resource_name, instance=instance)
+        if getattr(instance, resource.distant_id, None):
+            raise ValueError('%s(%s) already has a %s ! You can not push it in a tree !' % (instance, instance.__class__, resource.distant_id))
+        record = resource.get_local_fields()
+        record['attributes'] = {'type': self.get_sobject_type(resource),
+                                'referenceId': 'ref%d' % len(refs)}
+        refs.append((instance, resource))
+        for relationship, (child_resource_name, child_instances) in children.iteritems():
+            records = []
+            for child in child_instances:
+                child, grandchildren = child if isinstance(child, tuple) else (child, {})
+                records.append(self.get_tree_record(child_resource_name, child, grandchildren, refs))
+            record[relationship] = {'records': records}
+        return record
+
+    def push_tree(self, resource_name, instance, children={}):
+        """
+        Creates the instance and its children in a single request with the sObject Tree resource.
+        children maps the relationship names to the resource name and the instances of the children,
+        a child can come with its own children, exp:
+        {'Contacts': ('contact', [contact, (other_contact, {'Cases': ('case', [case])})])}
+        The distant ids are saved in a bulk update per model.
+        Returns the results of the request, an APIException is raised if any record failed, none is created then.
+        """
+        refs = []
+        record = self.get_tree_record(resource_name, instance, children, refs)
+        tree = self.get_resource('composite.tree', params={'sobject': record['attributes']['type']})
+        if len(refs) > tree.max_records:
+            raise ValueError('A tree can not hold more than %s records, got %s.' % (tree.max_records, len(refs)))
+
+        payload = self._dispatch(tree, 'POST', data={'records': [record]})
+        created = {}
+        for result in payload['results']:
+            instance, resource = refs[int(result['referenceId'][len('ref'):])]
+            fields = resource.get_local_fields()
+            resource.set_synced_fields(fields)
+            if self.push_store is not None:
+                self.push_store.set_pushed(resource.name, result['id'], fields)
+            setattr(instance, resource.distant_id, result['id'])
+            created.setdefault((instance.__class__, resource.distant_id), []).append(instance)
+        for (model, distant_id), instances in created.iteritems():
+            bulk_update(instances, [distant_id])
+        return payload['results']
+
+    def retrieve_many(self, sobject, ids, fields):
+        """
+        Fetches the given fields of the records with the sObject Collections resource, max_records ids per request,
+        or with soql queries below its api version.
+        Returns the records in the order of the ids, None for the ones which were not found.
+        """
+        retrieve = self.get_resource('composite.sobjects.retrieve', params={'sobject': sobject})
+        records = []
+        if not self.has_api_version(retrieve.min_api_version):
+            select = ', '.join(['Id'] + [field for field in fields if field != 'Id'])
+            for batch in chunks(ids, retrieve.max_query_ids):
+                soql = u"SELECT %s FROM %s WHERE Id IN (%s)" % (select, sobject, ', '.join([u"'%s'" % record_id.replace("'", "\\'") for record_id in batch]))
+                # the ids returned have 18 characters, the ones given might have 15
+                found = dict([(record['Id'][:15], record) for record in self.iter_query(soql)])
+                records.extend([found.get(record_id[:15]) for record_id in batch])
+            return records
+        for batch in chunks(ids, retrieve.max_records):
+            records.extend(self._dispatch(retrieve, 'POST', data={'ids': batch, 'fields': fields}))
+        return records
+
+    def pull_many(self, resource_name, instances, batch_size=2000):
+        """
+        Fetches the mapped fields of batches of instances with the sObject Collections resource,
+        and saves each batch in a single bulk update.
+        Returns the instances which could not be pulled (not synced yet or deleted).
+        """
+        resource = self.get_resource(resource_name)
+        sobject = self.get_sobject_type(resource)
+        fields = sorted(resource.fields_map)
+        if hasattr(instances, 'iterator'):  # a queryset
+            instances = instances.iterator()
+
+        missing = []
+        for batch in chunks(instances, batch_size):
+            synced = []
+            for instance in batch:
+                if getattr(instance, resource.distant_id, None):
+                    synced.append(instance)
+                else:
+                    missing.append(instance)
+            if not synced:
+                continue
+
+            records = self.retrieve_many(sobject, [getattr(instance, resource.distant_id) for instance in synced], fields)
+            pulled, found = [], []
+            for instance, record in zip(synced, records):
+                if record is None:
+                    missing.append(instance)
+                else:
+                    pulled.append(instance)
+                    found.append(record)
+            for instance, local_fields in zip(pulled, resource.get_distant_fields_many(found)):
+                for local_field, distant_value in local_fields.iteritems():
+                    setattr(instance, local_field, distant_value)
+            for instance, fields in zip(pulled, resource.get_local_fields_many(pulled)):
+                resource.instance = instance
+                resource.set_synced_fields(fields)
+                if self.push_store is not None:
+                    self.push_store.set_pushed(resource.name, getattr(instance, resource.distant_id), fields)
+            bulk_update(pulled, resource.fields_map.values())
+        return missing
+
+    def get_next_page(self, page, headers={}):
+        url = page.get('nextRecordsUrl') or page.get('nextPageUrl')  # chatter uses nextPageUrl
+        if not url:
+            return None
+        resource = self.base_resource_class(self, headers=headers)
+        resource.path = url
+        return self._dispatch(resource, 'GET')
+
+    def iter_pages(self, resource, params={}, headers={}, prefetch=False):
+        """
+        Yields the pages of a paginated resource, following nextRecordsUrl (or nextPageUrl).
+        With prefetch, the next page is fetched in a thread while the current one is processed,
+        otherwise only one page is held in memory.
+        """
+        resource = self.get_resource(resource, params=params, headers=headers)
+        page = self._dispatch(resource, 'GET')
+        while page is not None:
+            if prefetch:
+                next_page = Prefetch(self.get_next_page, page, headers)
+                yield page
+                page = next_page.result()
+            else:
+                yield page
+                page = self.get_next_page(page, headers)
+
+    def iter_records(self, resource, params={}, headers={}, prefetch=False, records_key='records'):
+        for page in self.iter_pages(resource, params, headers, prefetch):
+            for record in page[records_key]:
+                yield record
+
+    def iter_query(self, soql, batch_size=None, prefetch=False, include_deleted=False):
+        """
+        Yields the records matching the soql query, fetched lazily page after page.
+        batch_size is the number of records per page, between 200 and 2000.
+        """
+        headers = {}
+        if batch_size:
+            headers['Sforce-Query-Options'] = 'batchSize=%d' % batch_size
+        resource = include_deleted and 'queryAll' or 'query'
+        return self.iter_records(resource, params={'q': soql}, headers=headers, prefetch=prefetch)
+
+    def bulk_query(self, soql, resource_name=None, include_deleted=False, max_records=None):
+        """
+        Runs the soql query as a Bulk API 2.0 job, and yields the rows of its results lazily.
+        If resource_name is given, the rows are mapped to the local fields of that ModelResource.
+        """
+        job = BulkQueryJob(self, soql, include_deleted=include_deleted, max_records=max_records)
+        if resource_name:
+            return job.iter_local_fields(resource_name)
+        return job.iter_rows()
+
+    def bulk_push(self, resource_name, instances, operation='upsert', external_id_field=None):
+        """
+        Inserts, updates, upserts or deletes the instances (a queryset is iterated) with Bulk API 2.0 ingest jobs.
+        The distant ids of the created records are saved in bulk,
+        the hashes the push_store kept for the changed ones are dropped.
+        Returns {'success': {pk: distant id}, 'errors': {pk: error message}}
+        """
+        results = BulkPush(self, resource_name, instances, operation, external_id_field).run()
+        if operation != 'insert':
+            resource = self.get_resource(resource_name)
+            self.drop_records(self.get_sobject_type(resource), results['success'].values())
+            if self.push_store is not None:
+                self.push_store.delete(resource.name, results['success'].values())
+        return results
+
     def get_base_url(self):
         """
         Overrides get_base_url because the scheme is included in the domain
@@ -0,0 +1,70 @@
+"""
+The json codecs of the JsonResources, parsing the bytes of the responses and serializing the request data.
+SF_JSON_CODEC picks the one of the SalesForceApi:
+'json' (the standard library), 'ujson', 'auto' (ujson if installed) or the dotted path of a class.
+"""
+import datetime
+import decimal
+try:
+    import json
+except ImportError:
+    from django.utils import simplejson as json
+
+
+def default(value):
+    """
+    Serializes the values json doesn't know, the dates as iso 8601, and the decimals as numbers,
+    or as strings when a float would not keep their precision.
+    """
+    if isinstance(value, (datetime.datetime, datetime.date, datetime.time)):
+        return value.isoformat()
+    if isinstance(value, decimal.Decimal):
+        if value.is_finite() and decimal.Decimal(repr(float(value))) == value:
+            return float(value)
+        return unicode(value)
+    raise TypeError('%r is not JSON serializable' % (value,))
+
+
+class JsonCodec(object):
+    """
+    loads parses the raw bytes of a response (ValueError if invalid), dumps returns the body of a request (TypeError if not serializable).
+    """
+    def loads(self, content):
+        return json.loads(content)
+
+    def dumps(self, data):
+        return json.dumps(data, default=default)
+
+
+class UJsonCodec(JsonCodec):
+    """
+    Only parses with ujson, its encoder has no default hook and turns the dates into timestamps.
+    """
+    def __init__(self):
+        import ujson
+        self.ujson = ujson
+
+    def loads(self, content):
+        return self.ujson.loads(content)
+
+
+codecs = {
+    'json': JsonCodec,
+    'ujson': UJsonCodec,
+}
+
+
+def get_codec(name):
+    """
+    Returns an instance of the codec, 'auto' falls back to the standard library if ujson is not installed.
+    """
+    if name == 'auto':
+        try:
+            return UJsonCodec()
+        except ImportError:
+            return JsonCodec()
+    if name in codecs:
+        return codecs[name]()
+    # sforce.api.client imports this module
+    from sforce.api.client import import_class
+    return import_class(name)()
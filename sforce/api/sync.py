@@ -0,0 +1,159 @@
+"""
+Incremental synchronisation of a model with the 'updated' and 'deleted' resources of a sobject.
+> IncrementalSync(api, 'user').run()  # in a cron, every few minutes
+"""
+from datetime import datetime, timedelta
+
+from django.conf import settings
+from django.utils import timezone
+
+from sforce.api.client import APIException
+from sforce.api.client import chunks
+from sforce.api.client import bulk_update
+from sforce.models import SyncWatermark
+
+from logging import getLogger
+log = getLogger(__package__)
+
+
+def utc(value):
+    """
+    Returns the naive utc datetime as stored by django (aware if settings.USE_TZ).
+    """
+    if getattr(settings, 'USE_TZ', False):
+        return timezone.make_aware(value, timezone.utc)
+    return value
+
+
+def parse_datetime(value):
+    """
+    Parses the dates returned by salesforce, always in utc, exp: 2014-02-19T12:00:00.000+0000
+    """
+    return utc(datetime.strptime(value[:19], '%Y-%m-%dT%H:%M:%S'))
+
+
+class IncrementalSync(object):
+    """
+    Applies the records updated and deleted since the last run (the watermark) to the model of a ModelResource.
+    Salesforce only keeps 30 days of history, and returns at most 600000 ids per call,
+    the bigger windows are split.
+    """
+    max_window = timedelta(days=30)
+    # how far back the first run starts, a bit short of the 30 days so the call is not rejected
+    # when the clocks of the server and salesforce drift apart
+    max_history = timedelta(days=29, hours=23)
+    id_limit_error = 'EXCEEDED_ID_LIMIT'
+    lookup_batch_size = 500  # ids per local query, sqlite allows 999 variables
+    create = True  # create the local instances of the records created distantly
+
+    def __init__(self, api, resource_name):
+        self.api = api
+        self.resource_name = resource_name
+        self.resource = api.get_resource(resource_name)
+        self.sobject = api.get_sobject_type(self.resource)
+        self.model = self.resource.model
+        self.manager = self.model._default_manager
+
+    def get_windows(self, start, end):
+        while end - start > self.max_window:
+            yield start, start + self.max_window
+            start += self.max_window
+        yield start, end
+
+    def get_changes(self, kind, start, end):
+        """
+        Returns the payloads of the 'updated' or 'deleted' resource between start and end,
+        splitting the window in 2 while it contains too many ids.
+        """
+        payloads = []
+        for window_start, window_end in self.get_windows(start, end):
+            if window_start >= window_end:
+                continue
+            try:
+                payloads.append(self.api.get('%s.%s' % (self.sobject, kind),
+                                             params={'start': window_start, 'end': window_end}))
+            except APIException, e:
+                if not isinstance(e.payload, dict) or e.payload.get('errorCode') != self.id_limit_error:
+                    raise
+                middle = window_start + (window_end - window_start) / 2
+                log.info('Too many %s %s ids between %s and %s, splitting at %s.' % (kind, self.sobject, window_start, window_end, middle))
+                payloads.extend(self.get_changes(kind, window_start, middle))
+                payloads.extend(self.get_changes(kind, middle, window_end))
+        return payloads
+
+    def get_start(self, watermark, end):
+        oldest = end - self.max_history
+        if watermark is None:
+            return oldest
+        if watermark < oldest:
+            log.warning('The %s watermark %s is older than the history kept by salesforce, some changes were lost.' % (self.resource_name, watermark))
+            return oldest
+        return watermark
+
+    def get_existing(self, ids):
+        instances = {}
+        for batch in chunks(ids, self.lookup_batch_size):
+            for instance in self.manager.filter(**{'%s__in' % self.resource.distant_id: batch}):
+                instances[getattr(instance, self.resource.distant_id)] = instance
+        return instances
+
+    def apply_updates(self, ids):
+        distant_id = self.resource.distant_id
+        fields = sorted(self.resource.fields_map)
+        updated_count = created_count = 0
+        for batch in chunks(ids, 2000):
+            records = self.api.retrieve_many(self.sobject, batch, fields)
+            existing = self.get_existing(batch)
+            found = [(dist_id, record) for dist_id, record in zip(batch, records)
+                     if record is not None]  # else deleted in the meantime
+            rows = self.resource.get_distant_fields_many([record for dist_id, record in found])
+            updated, created = [], []
+            for (dist_id, record), local_fields in zip(found, rows):
+                instance = existing.get(dist_id)
+                if instance is None:
+                    if not self.create:
+                        continue
+                    instance = self.model(**local_fields)
+                    setattr(instance, distant_id, dist_id)
+                    created.append(instance)
+                else:
+                    for local_field, value in local_fields.iteritems():
+                        setattr(instance, local_field, value)
+                    updated.append(instance)
+            bulk_update(updated, self.resource.fields_map.values())
+            self.manager.bulk_create(created)
+            updated_count += len(updated)
+            created_count += len(created)
+        return updated_count, created_count
+
+    def apply_deletes(self, ids):
+        for batch in chunks(ids, self.lookup_batch_size):
+            self.manager.filter(**{'%s__in' % self.resource.distant_id: batch}).delete()
+        return len(ids)
+
+    def run(self):
+        """
+        Returns the number of updated, created and deleted local instances.
+        """
+        watermark, created = SyncWatermark.objects.get_or_create(resource=self.resource_name)
+        end = utc(datetime.utcnow())
+
+        payloads = self.get_changes('updated', self.get_start(watermark.updated, end), end)
+        ids, seen = [], set()
+        for payload in payloads:
+            for dist_id in payload['ids']:
+                if dist_id not in seen:
+                    seen.add(dist_id)
+                    ids.append(dist_id)
+        updated, created = self.apply_updates(ids)
+        if payloads:
+            watermark.updated = max([parse_datetime(payload['latestDateCovered']) for payload in payloads])
+
+        payloads = self.get_changes('deleted', self.get_start(watermark.deleted, end), end)
+        deleted = self.apply_deletes([record['id'] for payload in payloads for record in payload['deletedRecords']])
+        if payloads:
+            watermark.deleted = max([parse_datetime(payload['latestDateCovered']) for payload in payloads])
+
+        watermark.save()
+        log.info('Synchronised %s : %s updated, %s created, %s deleted.' % (self.resource_name, updated, created, deleted))
+        return updated, created, deleted
@@ -0,0 +1,31 @@
+import time
+from optparse import make_option
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from sforce.api.client import import_class
+from sforce.api.outbox import Outbox
+
+
+class Command(BaseCommand):
+    help = 'Pushes the instances waiting in the outbox, see sforce.api.outbox'
+    option_list = BaseCommand.option_list + (
+        make_option('--batch-size', type='int', dest='batch_size', default=None,
+                    help='The number of instances pushed per request.'),
+        make_option('--loop', action='store_true', dest='loop', default=False,
+                    help='Keeps draining the outbox, every --interval seconds.'),
+        make_option('--interval', type='float', dest='interval', default=5,
+                    help='The pause between two drains, in seconds.'),
+    )
+
+    def handle(self, *args, **options):
+        api = import_class(getattr(settings, 'SF_OUTBOX_API', 'sforce.api.salesforce.SalesForceApi'))()
+        outbox = Outbox(api, batch_size=options['batch_size'])
+        while True:
+            pushed, failed = outbox.drain()
+            if pushed or failed or int(options['verbosity']) > 1:
+                self.stdout.write('%s pushed, %s failed\n' % (pushed, failed))
+            if not options['loop']:
+                break
+            time.sleep(options['interval'])
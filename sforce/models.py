@@ -1,3 +1,32 @@
 from django.db import models
 
-# Create your models here.
+
+class SyncWatermark(models.Model):
+    """
+    How far the local copy of a resource is synchronised, see sforce.api.sync.IncrementalSync
+    """
+    resource = models.CharField(max_length=255, unique=True)  # the name of the ModelResource
+    updated = models.DateTimeField(null=True)  # latestDateCovered of the last 'updated' call
+    deleted = models.DateTimeField(null=True)  # latestDateCovered of the last 'deleted' call
+
+    def __unicode__(self):
+        return self.resource
+
+
+class OutboxEntry(models.Model):
+    """
+    An instance waiting to be pushed, the saves of the same instance are coalesced, see sforce.api.outbox
+    """
+    resource = models.CharField(max_length=255)  # the name of the ModelResource
+    object_id = models.CharField(max_length=255)  # the pk of the instance
+    version = models.PositiveIntegerField(default=0)  # incremented by each save
+    attempts = models.PositiveIntegerField(default=0)  # the failed pushes since the last success
+    next_attempt = models.DateTimeField(db_index=True)
+    last_error = models.TextField(blank=True)
+    created = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        unique_together = ('resource', 'object_id')
+
+    def __unicode__(self):
+        return u'%s %s' % (self.resource, self.object_id)
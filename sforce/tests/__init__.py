@@ -7,8 +7,25 @@ from sforce.tests.test_client import DateRangeResourceTest
 from sforce.tests.test_client import InstanceResourceTest
 from sforce.tests.test_client import ExternalIdInstanceResourceTest
 from sforce.tests.test_client import RestApiTest
+from sforce.tests.test_client import PoolingTest
+from sforce.tests.test_client import CompressionTest
+from sforce.tests.test_client import ModelResourceTest
 from sforce.tests.test_client import ModelSyncTest
 from sforce.tests.test_client import SalesForceApiTest
+from sforce.tests.test_client import SObjectsCacheTest
+from sforce.tests.test_client import ResponseCacheTest
+from sforce.tests.test_client import RecordCacheTest
+from sforce.tests.test_client import TokenStoreTest
+from sforce.tests.test_client import SObjectCollectionsTest
+from sforce.tests.test_client import SObjectTreeTest
+from sforce.tests.test_client import CompositeBatchTest
+from sforce.tests.test_client import PagerTest
+from sforce.tests.test_bulk import BulkQueryTest
+from sforce.tests.test_bulk import BulkPushTest
+from sforce.tests.test_blob import BlobTest
+from sforce.tests.test_sync import IncrementalSyncTest
+from sforce.tests.test_asynchronous import AsyncApiTest
+from sforce.tests.test_outbox import OutboxTest
 
 
 def suite():
@@ -22,8 +39,25 @@ def suite():
         InstanceResourceTest,
         ExternalIdInstanceResourceTest,
         RestApiTest,
+        PoolingTest,
+        CompressionTest,
+        ModelResourceTest,
         ModelSyncTest,
         SalesForceApiTest,
+        SObjectsCacheTest,
+        ResponseCacheTest,
+        RecordCacheTest,
+        TokenStoreTest,
+        SObjectCollectionsTest,
+        SObjectTreeTest,
+        CompositeBatchTest,
+        PagerTest,
+        BulkQueryTest,
+        BulkPushTest,
+        BlobTest,
+        IncrementalSyncTest,
+        AsyncApiTest,
+        OutboxTest,
     ]
 
     for test_case in test_cases:
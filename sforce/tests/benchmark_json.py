@@ -0,0 +1,56 @@
+"""
+Compares the parsing of a 2000 records query page, the way JsonResource did it and with the codecs.
+> python -m sforce.tests.benchmark_json [number]  # with DJANGO_SETTINGS_MODULE set, as the tests
+"""
+import sys
+import timeit
+
+import requests
+
+from sforce.api.serializers import get_codec
+try:
+    import json
+except ImportError:
+    from django.utils import simplejson as json
+
+
+def make_page(size=2000):
+    records = [{'attributes': {'type': 'Contact', 'url': '/services/data/v29.0/sobjects/Contact/003D000000QV9n2IAD'},
+                'Id': '003D000000QV9n2IAD',
+                'FirstName': u'Fran\xe7ois',
+                'LastName': 'Dupont %s' % i,
+                'Email': 'francois.dupont%s@example.com' % i,
+                'Amount__c': 1234.5,
+                'IsActive__c': True,
+                'LastModifiedDate': '2014-02-19T12:00:00.000+0000'} for i in range(size)]
+    response = requests.Response()
+    response.status_code = 200
+    response.headers['Content-Type'] = 'application/json;charset=UTF-8'
+    response._content = json.dumps({'totalSize': size, 'done': True, 'records': records})
+    return response
+
+
+def text_and_json(response):
+    # the debug log and response.json()
+    response.text
+    return response.json()
+
+
+def main(number=20):
+    response = make_page()
+    candidates = [('response.text + response.json()', text_and_json)]
+    for name in ('json', 'ujson'):
+        try:
+            codec = get_codec(name)
+        except ImportError:
+            continue
+        candidates.append(('%s codec, from response.content' % name, lambda r, codec=codec: codec.loads(r.content)))
+    reference = None
+    for name, parse in candidates:
+        seconds = min(timeit.repeat(lambda: parse(response), number=number, repeat=3)) / number
+        reference = reference or seconds
+        print '%-45s %7.2f ms  x%.1f' % (name, seconds * 1000, reference / seconds)
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,67 @@
+import time
+import mock
+import threading
+
+from django.test import TestCase
+from django.contrib.auth.models import User
+
+from sforce.api.client import APIException
+from sforce.api.asynchronous import AsyncApi, gather
+from sforce.tests.test_client import SFUserResource, make_response, make_sf_api
+
+
+class AsyncApiTest(TestCase):
+    def setUp(self):
+        self.api = AsyncApi(make_sf_api(user_class=SFUserResource), max_concurrency=2)
+
+    def tearDown(self):
+        self.api.close()
+
+    def test_bounded_concurrency(self):
+        lock = threading.Lock()
+        running = [0, 0]  # current, max
+
+        def request(method, url, **kwargs):
+            with lock:
+                running[0] += 1
+                running[1] = max(running)
+            time.sleep(0.02)
+            with lock:
+                running[0] -= 1
+            return make_response(200, u'{"url": "%s"}' % url)
+
+        self.api.api.session.request = mock.MagicMock(side_effect=request)
+        results = [self.api.get('sobjects.Account.describe') for i in range(6)]
+        self.assertEqual(gather(results), [{'url': 'https://footest.salesforce.com/rest/v1.0/sobjects/Account/describe/'}] * 6)
+        self.assertEqual(running[1], 2)
+        self.assertEqual(len(self.api.pool.workers), 2)
+
+    def test_gather_exceptions(self):
+        self.api.api.session.request = mock.MagicMock(side_effect=[
+            make_response(200, u'{"Id": "001A"}'),
+            make_response(404, u'[{"errorCode": "NOT_FOUND", "message": "not found"}]'),
+        ])
+        self.api.close()
+        self.api.pool.size = 1  # keep the order of the responses
+        results = [self.api.get('sobjects.Account', params={'id': '001A'}),
+                   self.api.get('sobjects.Account', params={'id': '001B'})]
+        values = gather(results, return_exceptions=True)
+        self.assertEqual(values[0], {'Id': '001A'})
+        self.assertIsInstance(values[1], APIException)
+        self.assertEqual(values[1].status_code, 404)
+        with self.assertRaises(APIException):
+            gather(results)
+        with self.assertRaises(APIException):
+            results[1].get()
+
+    def test_pull_push(self):
+        user = User(username='foo', email='001A')
+        self.api.api.session.request = mock.MagicMock(return_value=make_response(200, u'{"FirstName": "foo", "LastName": "bar"}'))
+        self.api.pull('user', user, save=False).get(timeout=1)
+        self.assertEqual((user.first_name, user.last_name), ('foo', 'bar'))
+
+        self.api.api.session.request = mock.MagicMock(return_value=make_response(204, u''))
+        user.first_name = 'foo2'
+        self.assertEqual(self.api.push('user', user).get(timeout=1), {})
+        args, kwargs = self.api.api.session.request.call_args
+        self.assertEqual(args, ('PATCH', 'https://footest.salesforce.com/rest/v1.0/sobjects/Contact/001A/'))
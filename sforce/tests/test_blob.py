@@ -0,0 +1,122 @@
+import json
+import mock
+import shutil
+import tempfile
+from StringIO import StringIO
+
+from django.test import TestCase
+from django.core.files.storage import FileSystemStorage
+
+from sforce.api.client import APIException
+from sforce.api.blob import MultipartStream
+from sforce.tests.test_client import make_response, make_sf_api
+
+
+class MockBlobResponse(object):
+    def __init__(self, content, chunk_size=3):
+        self.status_code = 200
+        self.headers = {'Content-Type': 'application/pdf'}
+        self.chunks = [content[i:i + chunk_size] for i in range(0, len(content), chunk_size)]
+        self.closed = False
+
+    def iter_content(self, chunk_size):
+        return iter(self.chunks)
+
+    def close(self):
+        self.closed = True
+
+
+class ReadLog(StringIO):
+    """
+    Logs the size of the reads.
+    """
+    def __init__(self, *args, **kwargs):
+        StringIO.__init__(self, *args, **kwargs)
+        self.sizes = []
+
+    def read(self, size=-1):
+        self.sizes.append(size)
+        return StringIO.read(self, size)
+
+
+class BlobTest(TestCase):
+    def setUp(self):
+        self.api = make_sf_api()
+        self.blob = '%PDF\x00\xff\xfe binary'
+        self.response = MockBlobResponse(self.blob)
+        self.api.session.request = mock.MagicMock(return_value=self.response)
+
+    def test_download(self):
+        download = self.api.get('Account.blob', params={'id': '001A', 'field': 'Body'})
+        args, kwargs = self.api.session.request.call_args
+        self.assertEqual(args, ('GET', 'https://footest.salesforce.com/rest/v1.0/sobjects/Account/001A/Body/'))
+        self.assertTrue(kwargs['stream'])
+        self.assertEqual(download.content_type, 'application/pdf')
+
+        fileobj = StringIO()
+        self.assertEqual(download.save_to(fileobj), len(self.blob))
+        self.assertEqual(fileobj.getvalue(), self.blob)
+        self.assertTrue(self.response.closed)
+
+    def test_download_storage(self):
+        location = tempfile.mkdtemp()
+        try:
+            storage = FileSystemStorage(location=location)
+            download = self.api.get('Account.blob', params={'id': '001A', 'field': 'Body'})
+            name = download.save('attachments/001A.pdf', storage=storage)
+            self.assertEqual(name, 'attachments/001A.pdf')
+            self.assertEqual(storage.open(name).read(), self.blob)
+        finally:
+            shutil.rmtree(location)
+
+    def test_download_error(self):
+        self.api.session.request = mock.MagicMock(return_value=make_response(404, u'[{"errorCode": "NOT_FOUND", "message": "not found"}]'))
+        with self.assertRaises(APIException) as cm:
+            self.api.get('Account.blob', params={'id': '001A', 'field': 'Body'})
+        self.assertEqual(cm.exception.payload['errorCode'], 'NOT_FOUND')
+
+    def test_upload(self):
+        self.api.session.request = mock.MagicMock(return_value=make_response(201, u'{"id": "001A", "success": true, "errors": []}'))
+        fileobj = StringIO(self.blob)
+        fileobj.name = '/tmp/report.pdf'
+        result = self.api.post('Account.blob', data={'Name': 'report', 'Body': fileobj})
+        self.assertEqual(result['id'], '001A')
+
+        args, kwargs = self.api.session.request.call_args
+        self.assertEqual(args, ('POST', 'https://footest.salesforce.com/rest/v1.0/sobjects/Account/'))
+        boundary = kwargs['headers']['Content-Type'].split('boundary=')[1]
+        self.assertEqual(kwargs['headers']['Content-Type'], 'multipart/form-data; boundary=%s' % boundary)
+        body = kwargs['data']
+        self.assertIsInstance(body, MultipartStream)
+        content = body.read()
+        self.assertEqual(len(body), len(content))
+        self.assertEqual(content,
+                         '--%(boundary)s\r\n'
+                         'Content-Disposition: form-data; name="entity_account"\r\n'
+                         'Content-Type: application/json\r\n\r\n'
+                         '{"Name": "report"}\r\n'
+                         '--%(boundary)s\r\n'
+                         'Content-Disposition: form-data; name="Body"; filename="report.pdf"\r\n'
+                         'Content-Type: application/octet-stream\r\n\r\n'
+                         '%(blob)s\r\n'
+                         '--%(boundary)s--\r\n' % {'boundary': boundary, 'blob': self.blob})
+
+    def test_update(self):
+        self.api.session.request = mock.MagicMock(return_value=make_response(204, u''))
+        self.assertEqual(self.api.patch('Account.blob', params={'id': '001A'}, data={'Body': StringIO(self.blob)}), {})
+        args, kwargs = self.api.session.request.call_args
+        self.assertEqual(args, ('PATCH', 'https://footest.salesforce.com/rest/v1.0/sobjects/Account/001A/'))
+        self.assertIn('filename="Body"', kwargs['data'].read())
+
+    def test_multipart_stream(self):
+        fileobj = ReadLog('x' * 100000)
+        body = MultipartStream([('entity_content', 'application/json', None, json.dumps({'PathOnClient': 'x.bin'})),
+                                ('VersionData', 'application/octet-stream', 'x.bin', fileobj)], 'BOUNDARY')
+        length = len(body)
+        read = 0
+        for block in iter(lambda: body.read(8192), ''):
+            self.assertTrue(len(block) <= 8192)
+            read += len(block)
+        self.assertEqual(read, length)
+        # never read whole
+        self.assertEqual(fileobj.sizes, [MultipartStream.chunk_size] * 3)
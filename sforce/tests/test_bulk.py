@@ -0,0 +1,184 @@
+# -*- coding: utf-8 -*-
+import mock
+import json
+
+from django.test import TestCase
+from django.contrib.auth.models import User
+
+from sforce.api.client import APIException
+from sforce.api.bulk import iter_lines, BulkJob, BulkPush
+from sforce.api.cache import PushStore
+from sforce.tests.test_client import SFUserResource, make_response, make_sf_api
+
+
+class MockCsvResponse(object):
+    def __init__(self, content, locator=None, chunk_size=7):
+        self.status_code = 200
+        self.content = content
+        self.headers = {'Sforce-Locator': locator or 'null'}
+        self.chunks = [content[i:i + chunk_size] for i in range(0, len(content), chunk_size)]
+        self.closed = False
+
+    def iter_content(self, chunk_size):
+        return iter(self.chunks)
+
+    def close(self):
+        self.closed = True
+
+
+class BulkQueryTest(TestCase):
+    def setUp(self):
+        self.api = make_sf_api(user_class=SFUserResource)
+
+        self.page1 = MockCsvResponse('"Id","FirstName","LastName"\n"003A","Jos\xc3\xa9","Doe"\n"003B","Jane","multi\nline"\n', locator='MTAwMDA')
+        self.page2 = MockCsvResponse('"Id","FirstName","LastName"\n"003C","John","Smith"\n')
+        self.api.session.request = mock.MagicMock(side_effect=[
+            make_response(200, u'{"id": "750R0000000zlh9IAA", "state": "UploadComplete"}'),
+            make_response(200, u'{"id": "750R0000000zlh9IAA", "state": "InProgress"}'),
+            make_response(200, u'{"id": "750R0000000zlh9IAA", "state": "JobComplete"}'),
+            self.page1,
+            self.page2,
+        ])
+
+    def test_iter_lines(self):
+        self.assertEqual(list(iter_lines(['a,"b', '\nc"\r\n', 'd', ',e'])), ['a,"b\n', 'c"\r\n', 'd,e'])
+
+    @mock.patch('time.sleep')
+    def test_bulk_query(self, sleep):
+        rows = list(self.api.bulk_query('SELECT Id, FirstName, LastName FROM Contact', max_records=2))
+        self.assertEqual(rows, [{'Id': '003A', 'FirstName': u'Jos\xe9', 'LastName': 'Doe'},
+                                {'Id': '003B', 'FirstName': 'Jane', 'LastName': 'multi\nline'},
+                                {'Id': '003C', 'FirstName': 'John', 'LastName': 'Smith'}])
+
+        calls = self.api.session.request.call_args_list
+        self.assertEqual(calls[0][0], ('POST', 'https://footest.salesforce.com/rest/v1.0/jobs/query/'))
+        self.assertEqual(json.loads(calls[0][1]['data']), {'operation': 'query', 'query': 'SELECT Id, FirstName, LastName FROM Contact'})
+        self.assertEqual(calls[1][0], ('GET', 'https://footest.salesforce.com/rest/v1.0/jobs/query/750R0000000zlh9IAA/'))
+        self.assertEqual(calls[3][0], ('GET', 'https://footest.salesforce.com/rest/v1.0/jobs/query/750R0000000zlh9IAA/results/?maxRecords=2'))
+        self.assertEqual(calls[4][0], ('GET', 'https://footest.salesforce.com/rest/v1.0/jobs/query/750R0000000zlh9IAA/results/?locator=MTAwMDA&maxRecords=2'))
+        self.assertTrue(calls[3][1]['stream'])
+        self.assertEqual(calls[3][1]['headers']['Accept'], 'text/csv')
+        # polled once, after 1 second
+        sleep.assert_called_once_with(1)
+        self.assertTrue(self.page1.closed)
+
+    @mock.patch('time.sleep')
+    def test_bulk_query_local_fields(self, sleep):
+        rows = list(self.api.bulk_query('SELECT Id, FirstName, LastName FROM Contact', resource_name='user'))
+        self.assertEqual(rows[0], {'email': '003A', 'first_name': u'Jos\xe9', 'last_name': 'Doe'})
+
+    @mock.patch('time.sleep')
+    def test_failed_job(self, sleep):
+        self.api.session.request = mock.MagicMock(side_effect=[
+            make_response(200, u'{"id": "750R0000000zlh9IAA", "state": "UploadComplete"}'),
+            make_response(200, u'{"id": "750R0000000zlh9IAA", "state": "Failed", "errorMessage": "INVALID_FIELD"}'),
+        ])
+        with self.assertRaises(APIException):
+            list(self.api.bulk_query('SELECT Foo FROM Contact'))
+
+    def test_old_api_version(self):
+        self.api.api_version = '46.0'
+        self.api.session.request = mock.MagicMock()
+        with self.assertRaises(APIException):
+            list(self.api.bulk_query('SELECT Id FROM Contact'))
+        self.assertFalse(self.api.session.request.called)
+
+    def test_abstract_job(self):
+        with self.assertRaises(TypeError):
+            BulkJob(self.api)
+
+
+class BulkPushTest(TestCase):
+    def setUp(self):
+        self.api = make_sf_api(user_class=SFUserResource)
+        self.users = [User.objects.create(username='user%s' % i, first_name=u'f\xe9%s' % i, last_name='bar') for i in range(3)]
+        self.uploaded = []
+
+    def _job_responses(self, successful, failed):
+        def upload(*args, **kwargs):
+            self.uploaded.append(kwargs['data'].read())
+            return make_response(201, u'')
+        return [
+            make_response(200, u'{"id": "7500000000000001", "state": "Open"}'),
+            upload,
+            make_response(200, u'{"id": "7500000000000001", "state": "UploadComplete"}'),
+            make_response(200, u'{"id": "7500000000000001", "state": "JobComplete"}'),
+            MockCsvResponse(successful),
+            MockCsvResponse(failed),
+        ]
+
+    def _mock_requests(self, *responses):
+        responses = list(responses)
+
+        def request(*args, **kwargs):
+            response = responses.pop(0)
+            return response(*args, **kwargs) if callable(response) else response
+        self.api.session.request = mock.MagicMock(side_effect=request)
+
+    @mock.patch('time.sleep')
+    def test_insert(self, sleep):
+        self._mock_requests(*self._job_responses(
+            '"sf__Id","sf__Created","FirstName","LastName"\n"003A","true","f\xc3\xa90","bar"\n"003C","true","f\xc3\xa92","bar"\n',
+            '"sf__Id","sf__Error","FirstName","LastName"\n"","DUPLICATES_DETECTED:Duplicate","f\xc3\xa91","bar"\n'))
+        results = self.api.bulk_push('user', User.objects.filter(username__startswith='user').order_by('pk'), operation='insert')
+
+        self.assertEqual(self.uploaded, ['FirstName,LastName\nf\xc3\xa90,bar\nf\xc3\xa91,bar\nf\xc3\xa92,bar\n'])
+        calls = self.api.session.request.call_args_list
+        self.assertEqual(json.loads(calls[0][1]['data']), {'object': 'Contact', 'operation': 'insert', 'contentType': 'CSV', 'lineEnding': 'LF'})
+        self.assertEqual(calls[1][0], ('PUT', 'https://footest.salesforce.com/rest/v1.0/jobs/ingest/7500000000000001/batches/'))
+        self.assertEqual(calls[1][1]['headers']['Content-Type'], 'text/csv')
+        self.assertEqual(json.loads(calls[2][1]['data']), {'state': 'UploadComplete'})
+        self.assertEqual(calls[4][0][1], 'https://footest.salesforce.com/rest/v1.0/jobs/ingest/7500000000000001/successfulResults/')
+
+        pks = [user.pk for user in self.users]
+        self.assertEqual(results['success'], {pks[0]: '003A', pks[2]: '003C'})
+        self.assertEqual(results['errors'], {pks[1]: 'DUPLICATES_DETECTED:Duplicate'})
+        self.assertEqual(list(User.objects.filter(pk__in=pks).order_by('pk').values_list('email', flat=True)), ['003A', '', '003C'])
+
+    @mock.patch('time.sleep')
+    def test_insert_external_id(self, sleep):
+        # only the external id column is compared, the other values may come back reformatted
+        self._mock_requests(*self._job_responses(
+            '"sf__Id","sf__Created","FirstName","LastName"\n"003B","true","f\xc3\xa91","Bar "\n',
+            '"sf__Id","sf__Error","FirstName","LastName"\n'))
+        results = self.api.bulk_push('user', User.objects.filter(username__startswith='user').order_by('pk'),
+                                     operation='insert', external_id_field='FirstName')
+
+        calls = self.api.session.request.call_args_list
+        self.assertNotIn('externalIdFieldName', json.loads(calls[0][1]['data']))
+        pks = [user.pk for user in self.users]
+        self.assertEqual(results['success'], {pks[1]: '003B'})
+        # the rows without a result are not known to be pushed
+        self.assertEqual(sorted(results['errors']), [pks[0], pks[2]])
+
+    def test_old_api_version(self):
+        self.api.api_version = '40.0'
+        self.api.session.request = mock.MagicMock()
+        with self.assertRaises(APIException):
+            self.api.bulk_push('user', self.users, operation='insert')
+        self.assertFalse(self.api.session.request.called)
+
+    @mock.patch('time.sleep')
+    def test_update_chunks(self, sleep):
+        for i, user in enumerate(self.users):
+            user.email = '003%s' % i
+        self.users[1].email = ''
+        self.api.push_store = PushStore('test')
+        self.api.push_store.set_pushed('user', '0030', {'FirstName': 'foo'})
+        with mock.patch.object(BulkPush, 'max_upload_size', 1):
+            self._mock_requests(*(self._job_responses('"sf__Id","sf__Created","Id","FirstName","LastName"\n"0030","false","0030","f\xc3\xa90","bar"\n', '"sf__Id","sf__Error","Id"\n') +
+                                  self._job_responses('"sf__Id","sf__Created","Id","FirstName","LastName"\n"0032","false","0032","f\xc3\xa92","bar"\n', '"sf__Id","sf__Error","Id"\n')))
+            results = self.api.bulk_push('user', self.users, operation='update')
+        # one job per row
+        self.assertEqual(len(self.uploaded), 2)
+        self.assertEqual(self.uploaded[0], 'Id,FirstName,LastName\n0030,f\xc3\xa90,bar\n')
+        self.assertEqual(results['success'], {self.users[0].pk: '0030', self.users[2].pk: '0032'})
+        self.assertEqual(results['errors'].keys(), [self.users[1].pk])
+        # the hash of the fields pushed before is dropped
+        self.assertFalse(self.api.push_store.is_pushed('user', '0030', {'FirstName': 'foo'}))
+
+    def test_invalid_upsert(self):
+        with self.assertRaises(ValueError):
+            self.api.bulk_push('user', self.users, operation='upsert')
+        with self.assertRaises(ValueError):
+            self.api.bulk_push('user', self.users, operation='upsert', external_id_field='Email')
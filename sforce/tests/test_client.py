@@ -1,6 +1,16 @@
+import time
 import mock
 import json
+import logging
+import datetime
+import decimal
+import threading
+import urlparse
 import requests
+import SocketServer
+import BaseHTTPServer
+from gzip import GzipFile
+from StringIO import StringIO
 from requests_oauthlib import OAuth2Session
 
 from django.test import TestCase
@@ -8,8 +18,10 @@ from django.contrib.auth.models import User
 
 from sforce.api.client import APIException
 from sforce.api.client import RestApi, ModelBasedApi
-from sforce.api.client import BaseResource, JsonResource, ModelResource
-from sforce.api.salesforce import SalesForceApi
+from sforce.api.client import BaseResource, JsonResource, ModelResource, InstanceResource
+from sforce.api.salesforce import SalesForceApi, SalesForceResource, SFInstanceResource
+from sforce.api.cache import get_sf_cache, TokenStore, PushStore, ResponseCache, SharedResponseCache, RecordCache
+from sforce.api.serializers import JsonCodec, get_codec
 
 
 class MockResponse(object):
@@ -24,11 +36,35 @@ class MockResponse(object):
     def text(self):
         return self.api.return_value
 
+    @property
+    def content(self):
+        return self.api.return_value.encode('utf-8')
+
     @property
     def status_code(self):
         return self.api.status_code
 
 
+def make_response(status_code, text):
+    return MockResponse(mock.Mock(status_code=status_code, return_value=text))
+
+
+token_response = {u'access_token': u'ACCESS_TOKEN', u'token_type': u'Bearer', u'instance_url': u'https://footest.salesforce.com', u'id': u'https://footest.salesforce.com/id/00D11000000CqsdEAC/005b0000000vDaGAAU'}
+
+
+def make_sf_api(api_class=None, user_class=None):
+    """
+    Returns a MySalesForceApi (or an api_class) logged in with token_response on an empty cache,
+    with a 'user' resource of user_class if given.
+    """
+    get_sf_cache().clear()
+    with mock.patch.object(OAuth2Session, 'fetch_token', return_value=token_response):
+        api = (api_class or MySalesForceApi)()
+    if user_class is not None:
+        api.make_resource('user', {'class': user_class})
+    return api
+
+
 class TestApi(RestApi):
     scheme = 'https'
     domain = 'api.test.com'
@@ -102,13 +138,79 @@ class JsonResourceTest(TestCase):
         with self.assertRaises(APIException):
             self.api.get('custom_class')
 
+    def test_parse_bytes(self):
+        self.api.return_value = u'{"name": "Fran\xe7ois"}'
+        logger = logging.getLogger('sforce.api')
+        level = logger.level
+        logger.setLevel(logging.INFO)
+        try:
+            with mock.patch.object(MockResponse, 'text', new_callable=mock.PropertyMock,
+                                   return_value=self.api.return_value) as text:
+                response = self.api.get('custom_class')
+        finally:
+            logger.setLevel(level)
+        self.assertEqual(response, {'name': u'Fran\xe7ois'})
+        # only decoded for the debug log
+        self.assertFalse(text.called)
+
+    def test_debug_log(self):
+        logger = logging.getLogger('sforce.api')
+        level = logger.level
+        logger.setLevel(logging.DEBUG)
+        try:
+            with mock.patch('sforce.api.client.log.debug') as debug:
+                self.api.get('custom_class')
+        finally:
+            logger.setLevel(level)
+        debug.assert_called_once_with('Api call returned : %s', '{"success": true}')
+
+    def test_format_data(self):
+        resource = self.api.get_resource('custom_class')
+        data = {'date': datetime.date(2014, 2, 19),
+                'datetime': datetime.datetime(2014, 2, 19, 12, 30),
+                'amount': decimal.Decimal('12345678901234.5678'),
+                'price': decimal.Decimal('12.50')}
+        self.assertEqual(json.loads(resource.format_data(data)),
+                         {'date': '2014-02-19', 'datetime': '2014-02-19T12:30:00', 'amount': '12345678901234.5678', 'price': 12.5})
+        with self.assertRaises(TypeError):
+            resource.format_data({'set': set()})
+
+    def test_resource_codec(self):
+        resource = self.api.get_resource('custom_class')
+        self.assertIs(resource.get_codec(), self.api.json_codec)
+        resource.codec = mock.Mock(spec=JsonCodec)
+        resource.codec.dumps.return_value = '{}'
+        resource.codec.loads.return_value = {'parsed': True}
+        self.assertEqual(resource.get(), {'parsed': True})
+        resource.codec.loads.assert_called_once_with('{"success": true}')
+
+    def test_get_codec(self):
+        self.assertIsInstance(get_codec('json'), JsonCodec)
+        self.assertIsInstance(get_codec('sforce.api.serializers.JsonCodec'), JsonCodec)
+        self.assertIsInstance(get_codec('auto'), JsonCodec)  # whichever is installed
+        with self.assertRaises(ImportError):
+            get_codec('sforce.api.missing.Codec')
+
 
 class DateRangeResourceTest(TestCase):
     pass
 
 
 class InstanceResourceTest(TestCase):
-    pass
+    def setUp(self):
+        self.api = TestApi()
+
+    def test_projection(self):
+        resource = type('AccountResource', (InstanceResource,), {'path': 'account/{id}/', 'fields': ['Name', 'Id']})(self.api, params={'id': '001A'})
+        self.assertEqual(resource.get_url('GET'), 'https://api.test.com/rest/v1.0/account/001A/?fields=Id%2CName')
+        self.assertEqual(resource.get_url('PATCH'), 'https://api.test.com/rest/v1.0/account/001A/')
+        # computed once per class
+        resource.fields = ['Other']
+        self.assertEqual(resource.get_projection(), 'Id,Name')
+
+    def test_no_projection(self):
+        resource = InstanceResource(self.api, params={'id': '001A'})
+        self.assertEqual(resource.get_url('GET'), 'https://api.test.com/rest/v1.0/001A/')
 
 
 class ExternalIdInstanceResourceTest(TestCase):
@@ -179,6 +281,19 @@ class RestApiTest(TestCase):
         api = MyApi()
         self._test_resources(api)
 
+    def test_lazy_resource_classes(self):
+        MyApi = type('MyApi', (TestApi,), {})
+        api = MyApi()
+        built = lambda: [key[1] for key in RestApi._resource_classes if key[0] is MyApi]
+        self.assertEqual(built(), [])
+        api.get_resource('cascading.foo')
+        # the parent is needed for the path
+        self.assertEqual(sorted(built()), ['cascading', 'cascading.foo'])
+
+    def test_shared_resource_classes(self):
+        api = TestApi()
+        self.assertTrue(api.get_resource('cascading.foo').__class__ is self.api.get_resource('cascading.foo').__class__)
+
     def test_invalid_resource(self):
         with self.assertRaises(APIException):
             self.api.get_resource('foobar')
@@ -221,6 +336,184 @@ class RestApiTest(TestCase):
     def test_delete(self):
         self._test_request('simple', 'DELETE', status_code=requests.status_codes.codes.no_content)
 
+    def test_map(self):
+        def request(method, url, **kwargs):
+            time.sleep(0.01 * (5 - int(url[-2])))  # the first ones answer last
+            if url.endswith('3/'):
+                return make_response(404, u'{"error": "not found"}')
+            return make_response(200, u'{"url": "%s"}' % url)
+
+        self.api.make_resource('item', {'class': JsonResource, 'path': 'item/{id}/'})
+        self.api.session.request = mock.MagicMock(side_effect=request)
+        results = self.api.map('GET', 'item', [{'id': str(i)} for i in range(5)], max_workers=3)
+        self.assertEqual(self.api.session.request.call_count, 5)
+        self.assertEqual([r['url'] for r in results[:3]], ['https://api.test.com/rest/v1.0/item/%s/' % i for i in range(3)])
+        self.assertIsInstance(results[3], APIException)
+        self.assertEqual(results[3].status_code, 404)
+        self.assertEqual(results[4], {'url': 'https://api.test.com/rest/v1.0/item/4/'})
+
+    def test_map_pool_size(self):
+        adapter = self.api.session.get_adapter('https://api.test.com/')
+        self.assertEqual(adapter._pool_maxsize, 10)
+        with mock.patch.object(adapter, 'close') as close:
+            self.api.map('GET', 'simple', [{}], max_workers=20)
+        self.assertEqual(self.api.session.get_adapter('https://api.test.com/')._pool_maxsize, 20)
+        self.assertEqual(self.api.pool_maxsize, 20)
+        # the replaced adapter is closed, the smaller sizes keep the pools
+        close.assert_called_once_with()
+        adapter = self.api.session.get_adapter('https://api.test.com/')
+        self.api.ensure_pool_size(5)
+        self.assertIs(self.api.session.get_adapter('https://api.test.com/'), adapter)
+
+    def test_pool_size_threads(self):
+        sizes = range(11, 31)
+        threads = [threading.Thread(target=self.api.ensure_pool_size, args=(size,)) for size in sizes]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(self.api.pool_maxsize, 30)
+        self.assertEqual(self.api.session.get_adapter('https://api.test.com/')._pool_maxsize, 30)
+
+    def test_make_resource_threads(self):
+        node = {'resources': dict([('sub%s' % i, {}) for i in range(50)])}
+        seen = []
+
+        def read():
+            # a registered parent always comes with its subresources
+            for i in range(200):
+                if 'threaded' in self.api.resources:
+                    seen.append(len([name for name in self.api.resources.keys() if name.startswith('threaded.')]))
+
+        reader = threading.Thread(target=read)
+        reader.start()
+        self.api.make_resource('threaded', node)
+        reader.join()
+        self.assertTrue(all(count == 50 for count in seen))
+        self.assertEqual(self.api.get_resource('threaded.sub7').path, 'threaded/sub7/')
+
+
+class LocalHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'  # keeps the connections alive
+
+    def do_GET(self):
+        self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        body = json.dumps({'connection': self.headers.get('Connection')})
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class PoolingTest(TestCase):
+    def setUp(self):
+        self.server = SocketServer.ThreadingTCPServer(('127.0.0.1', 0), LocalHandler)
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, kwargs={'poll_interval': 0.01}).start()
+        self.LocalApi = type('LocalApi', (RestApi,), {'domain': '127.0.0.1:%s' % self.server.server_address[1],
+                                                      'root_path': '',
+                                                      'resources_tree': {'simple': {'class': JsonResource}}})
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_adapters(self):
+        LocalApi = type('LocalApi', (self.LocalApi,), {'pool_connections': 3, 'pool_maxsize': 4, 'pool_block': True, 'max_retries': 2})
+        api = LocalApi()
+        for prefix in ('http://', 'https://'):
+            adapter = api.session.adapters[prefix]
+            self.assertEqual((adapter._pool_connections, adapter._pool_maxsize, adapter._pool_block, adapter.max_retries.total),
+                             (3, 10, True, 2))  # at least max_workers connections per host
+
+    def test_connection_reuse(self):
+        api = self.LocalApi()
+        for i in range(5):
+            api.get('simple')
+        self.assertEqual(api.get_pool_stats(), {'http://127.0.0.1:%s' % self.server.server_address[1]: {'connections': 1, 'requests': 5}})
+
+        api.map('GET', 'simple', [{}] * 20, max_workers=4)
+        stats = api.get_pool_stats().values()[0]
+        self.assertEqual(stats['requests'], 25)
+        self.assertTrue(stats['connections'] <= 5)
+
+    def test_no_keep_alive(self):
+        api = type('LocalApi', (self.LocalApi,), {'keep_alive': False})()
+        self.assertEqual(api.get('simple'), {'connection': 'close'})
+
+
+def gzip(data):
+    buf = StringIO()
+    with GzipFile(fileobj=buf, mode='wb') as gzip_file:
+        gzip_file.write(data)
+    return buf.getvalue()
+
+
+class GzipHandler(LocalHandler):
+    """
+    Answers the size of the body received, and gzips its answer if accepted.
+    """
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        encoding = self.headers.get('Content-Encoding')
+        if encoding == 'gzip':
+            body = GzipFile(fileobj=StringIO(body)).read()
+        answer = json.dumps({'encoding': encoding, 'size': len(body), 'padding': 'x' * 10000})
+        self.send_response(201)
+        if 'gzip' in self.headers.get('Accept-Encoding', ''):
+            answer = gzip(answer)
+            self.send_header('Content-Encoding', 'gzip')
+        self.send_header('Content-Length', str(len(answer)))
+        self.end_headers()
+        self.wfile.write(answer)
+
+
+class CompressionTest(TestCase):
+    def setUp(self):
+        self.server = SocketServer.ThreadingTCPServer(('127.0.0.1', 0), GzipHandler)
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, kwargs={'poll_interval': 0.01}).start()
+        resource_class = type('GzipResource', (JsonResource,), {'compress_threshold': 1000})
+        self.LocalApi = type('LocalApi', (RestApi,), {'domain': '127.0.0.1:%s' % self.server.server_address[1],
+                                                      'root_path': '',
+                                                      'resources_tree': {'gzip': {'class': resource_class},
+                                                                         'plain': {'class': JsonResource}}})
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_compress_request(self):
+        api = self.LocalApi()
+        data = {'records': ['record %s' % i for i in range(200)]}
+        size = len(json.dumps(data))
+        response = api.post('gzip', data=data)
+        self.assertEqual((response['encoding'], response['size']), ('gzip', size))
+        # under the threshold
+        response = api.post('gzip', data={'records': []})
+        self.assertEqual((response['encoding'], response['size']), (None, 15))
+        # not enabled
+        response = api.post('plain', data=data)
+        self.assertEqual((response['encoding'], response['size']), (None, size))
+
+    def test_wire_stats(self):
+        api = self.LocalApi()
+        data = {'records': ['record %s' % i for i in range(200)]}
+        api.post('gzip', data=data)
+        api.post('gzip', data=data)
+        api.post('plain', data={})
+        stats = api.get_wire_stats()
+        self.assertEqual(sorted(stats), ['gzip', 'plain'])
+        self.assertEqual(stats['gzip']['requests'], 2)
+        self.assertEqual(stats['gzip']['sent'], 2 * len(json.dumps(data)))
+        self.assertTrue(stats['gzip']['sent_on_wire'] < stats['gzip']['sent'] / 5)
+        self.assertEqual(stats['plain']['sent'], stats['plain']['sent_on_wire'])
+        self.assertTrue(stats['plain']['received'] > 10000)
+        self.assertTrue(stats['plain']['received_on_wire'] < stats['plain']['received'] / 5)
+
 
 class MyUserResource(JsonResource, ModelResource):
     model = User
@@ -234,6 +527,58 @@ class MyUserApi(ModelBasedApi, TestApi):
     resources_tree = {'user': {'class': MyUserResource}}
 
 
+class ConvertedUserResource(JsonResource, ModelResource):
+    model = User
+    fields_map = {'FirstName': 'first_name',
+                  'LastName': 'last_name',
+                  'Email': 'email'}
+
+    def get_local_first_name_value(self, value):
+        return value.lower()
+
+    def get_distant_first_name_value(self, value):
+        return value.upper()
+
+    def get_local_last_name_values(self, values):
+        self.columns.append(values)
+        return [value.lower() for value in values]
+
+
+class ModelResourceTest(TestCase):
+    def setUp(self):
+        self.api = TestApi()
+        self.resource = ConvertedUserResource(self.api)
+        self.resource.columns = []
+
+    def test_converters(self):
+        self.resource.instance = User(first_name='foo', last_name='bar', email='foo@bar.com')
+        self.assertEqual(self.resource.get_local_fields(), {'FirstName': 'FOO', 'LastName': 'bar', 'Email': 'foo@bar.com'})
+        self.assertEqual(self.resource.get_distant_fields({'FirstName': 'FOO', 'LastName': 'BAR', 'Email': 'foo@bar.com'}),
+                         {'first_name': 'foo', 'last_name': 'bar', 'email': 'foo@bar.com'})
+        self.assertEqual(self.resource.get_distant_value('first_name', 'foo'), 'FOO')
+        self.assertEqual(self.resource.get_local_value('last_name', 'BAR'), 'bar')
+        self.assertEqual(self.resource.get_local_value('email', 'foo@bar.com'), 'foo@bar.com')
+
+    def test_compiled_once(self):
+        ConvertedUserResource.get_converters()
+        self.assertTrue('_converters' in ConvertedUserResource.__dict__)
+        # the subclasses get their own
+        MyResource = type('MyResource', (ConvertedUserResource,), {'fields_map': {'FirstName': 'first_name'}})
+        self.assertEqual([converter[0] for converter in MyResource.get_converters()], ['FirstName'])
+        self.assertEqual([converter[0] for converter in ConvertedUserResource.get_converters()], ['Email', 'FirstName', 'LastName'])
+
+    def test_many(self):
+        payloads = [{'FirstName': 'FOO%s' % i, 'LastName': 'BAR%s' % i, 'Email': '%s@bar.com' % i} for i in range(3)]
+        rows = self.resource.get_distant_fields_many(payloads)
+        self.assertEqual(rows, [self.resource.get_distant_fields(payload) for payload in payloads])
+        # the column converter is called once for the whole batch, and once per get_distant_fields
+        self.assertEqual(self.resource.columns[0], ['BAR0', 'BAR1', 'BAR2'])
+        self.assertEqual(len(self.resource.columns), 4)
+
+        users = [User(first_name='foo%s' % i, last_name='bar', email='%s@bar.com' % i) for i in range(3)]
+        self.assertEqual(self.resource.get_local_fields_many(users)[2], {'FirstName': 'FOO2', 'LastName': 'bar', 'Email': '2@bar.com'})
+
+
 class ModelSyncTest(TestCase):
     """
     Django specific
@@ -274,6 +619,76 @@ class ModelSyncTest(TestCase):
                                                          data='{"LastName": "bar", "FirstName": "foo2"}',
                                                          timeout=1)
 
+    def test_update_changed_fields(self):
+        self.user.api_id = '001D000000IqhSLIAZ'
+        self.api.return_value = u'{"LastName": "bar3", "FirstName": "foo3"}'
+        self.api.pull('user', self.user)
+
+        self.user.first_name = 'foo4'
+        self.api.session.request = mock.MagicMock(return_value=make_response(requests.codes.no_content, u''))
+        self.api.push('user', self.user)
+        args, kwargs = self.api.session.request.call_args
+        self.assertEqual(args, ('PATCH', 'https://api.test.com/rest/v1.0/customer/001D000000IqhSLIAZ/'))
+        self.assertEqual(json.loads(kwargs['data']), {'FirstName': 'foo4'})
+
+        # nothing changed since the last push
+        self.assertEqual(self.api.push('user', self.user), {})
+        self.assertEqual(self.api.session.request.call_count, 1)
+
+        # a failed push keeps the fields changed
+        self.user.last_name = 'bar4'
+        self.api.session.request = mock.MagicMock(return_value=make_response(requests.codes.bad_request, u'[{"errorCode": "UNABLE_TO_LOCK_ROW", "message": "locked"}]'))
+        with self.assertRaises(APIException):
+            self.api.push('user', self.user)
+        self.api.session.request = mock.MagicMock(return_value=make_response(requests.codes.no_content, u''))
+        self.api.push('user', self.user)
+        self.assertEqual(json.loads(self.api.session.request.call_args[1]['data']), {'LastName': 'bar4'})
+
+    def test_create_synced_fields(self):
+        self.api.status_code = requests.status_codes.codes.created
+        self.api.return_value = u'{"id" : "001D000000IqhSLIAZ", "errors" : [], "success" : true}'
+        self.api.push('user', self.user)
+        self.api.push('user', self.user)
+        self.assertEqual(self.api.session.request.call_count, 1)
+
+    def test_push_store(self):
+        get_sf_cache().clear()
+        self.user.api_id = '001D000000IqhSLIAZ'
+
+        def fresh_user():
+            user = User.objects.get(pk=self.user.pk)
+            user.api_id = self.user.api_id
+            return user
+
+        self.api.push_store = PushStore('test')
+        self.api.status_code = requests.status_codes.codes.no_content
+        self.api.push('user', self.user)
+        self.assertEqual(self.api.session.request.call_count, 1)
+
+        # another process pushing the same fields
+        other_api = MyUserApi()
+        other_api.push_store = PushStore('test')
+        other_api.push('user', fresh_user())
+        self.assertFalse(other_api.session.request.called)
+        self.assertEqual(other_api.push_store.stats, {'pushed': 0, 'skipped': 1})
+
+        user = fresh_user()
+        user.first_name = 'foo2'
+        other_api.status_code = requests.status_codes.codes.no_content
+        other_api.push('user', user)
+        self.assertEqual(other_api.session.request.call_count, 1)
+        self.assertEqual(other_api.push_store.stats, {'pushed': 1, 'skipped': 1})
+
+        # only the fields changed since the last push are sent by the instances fresh from the db
+        self.assertEqual(json.loads(other_api.session.request.call_args[1]['data']), {'FirstName': 'foo2'})
+
+        # pulled fields don't need to be pushed back
+        self.api.return_value = u'{"LastName": "bar3", "FirstName": "foo3"}'
+        self.api.status_code = requests.status_codes.codes.ok
+        self.api.pull('user', self.user)
+        other_api.push('user', fresh_user())
+        self.assertEqual(other_api.session.request.call_count, 1)
+
     def test_fetch(self):
         self.user.api_id = '001D000000IqhSLIAZ'
         self.user.save()
@@ -281,20 +696,50 @@ class ModelSyncTest(TestCase):
         self.api.return_value = u'{"LastName": "bar3", "FirstName": "foo3"}'
         self.api.pull('user', self.user)
         self.api.session.request.assert_called_once_with('GET',
-                                                         'https://api.test.com/rest/v1.0/customer/001D000000IqhSLIAZ/',
+                                                         'https://api.test.com/rest/v1.0/customer/001D000000IqhSLIAZ/?fields=FirstName%2CLastName',
                                                          headers={'Content-Type': 'application/json'},
                                                          data='{}',
                                                          timeout=1)
         self.assertEqual(self.user.first_name, 'foo3')
         self.assertEqual(self.user.last_name, 'bar3')
 
+    def test_fetch_extra_fields(self):
+        self.user.api_id = '001D000000IqhSLIAZ'
+        api = type('MyApi', (MyUserApi,), {})()
+        api.resources['user'] = ('user', {'class': type('MyExtraUserResource', (MyUserResource,), {'extra_fields': ['LastModifiedDate']})}, None)
+        api.return_value = u'{"LastName": "bar3", "FirstName": "foo3", "LastModifiedDate": "2014-02-19T12:00:00.000+0000"}'
+        api.pull('user', self.user, save=False)
+        self.assertEqual(api.session.request.call_args[0][1],
+                         'https://api.test.com/rest/v1.0/customer/001D000000IqhSLIAZ/?fields=FirstName%2CLastModifiedDate%2CLastName')
+
     def test_fetch_unsynced(self):
         with self.assertRaises(ValueError):
             self.api.pull('user', self.user)
 
+    def test_pull_many(self):
+        self.user.api_id = '001D000000IqhSLIAZ'
+        unsynced = User.objects.create(username='foo2', first_name='foo2', last_name='bar2')
+        self.api.return_value = u'{"LastName": "bar3", "FirstName": "foo3"}'
+        missing = self.api.pull_many('user', [self.user, unsynced])
+        self.assertEqual(missing, [unsynced])
+        self.assertEqual(User.objects.get(pk=self.user.pk).first_name, 'foo3')
+
+    def test_push_many(self):
+        user2 = User.objects.create(username='foo2', first_name='foo2', last_name='bar2')
+        self.api.session.request = mock.MagicMock(side_effect=[
+            make_response(requests.codes.created, u'{"id": "001D000000IqhSLIAZ", "errors": [], "success": true}'),
+            make_response(requests.codes.bad_request, u'[{"errorCode": "REQUIRED_FIELD_MISSING", "message": "Required fields are missing: [Name]", "fields": ["Name"]}]'),
+        ])
+        results = self.api.push_many('user', [self.user, user2])
+        self.assertEqual(results[0], {'id': '001D000000IqhSLIAZ', 'success': True, 'errors': []})
+        self.assertFalse(results[1]['success'])
+        self.assertEqual(results[1]['errors'][0]['statusCode'], 'REQUIRED_FIELD_MISSING')
+
 
 class MySalesForceApi(TestApi, SalesForceApi):
+    api_version = '47.0'  # the newest resources used by the api need it
     sobjects_whitelist = ['Account',]
+    sobjects_check_interval = None
 
     def __init__(self, *args, **kwargs):
         # need to set the return value before the call to sobjects
@@ -316,12 +761,17 @@ class SalesForceApiTest(TestCase):
         # Note: using init instead of setUp because i only want this done once.
         super(SalesForceApiTest, self).__init__(*args, **kwargs)
 
-        self.token_response = {u'access_token': u'ACCESS_TOKEN', u'token_type': u'Bearer', u'signature': u'SIGNATURE', u'issued_at': u'1392809231037', u'instance_url': u'https://footest.salesforce.com', u'id': u'https://footest.salesforce.com/id/00D11000000CqsdEAC/005b0000000vDaGAAU'}
+        self.token_response = dict(token_response, signature=u'SIGNATURE', issued_at=unicode(int(time.time() * 1000)))
 
+        get_sf_cache().clear()
         with mock.patch.object(OAuth2Session, 'fetch_token', return_value=self.token_response) as mock_fetch_token:
             self.api = MySalesForceApi()
         self.mock_fetch_token = mock_fetch_token
 
+    def setUp(self):
+        # the token shared by the other tests instances
+        get_sf_cache().clear()
+
     def test_api_init(self):
         self.mock_fetch_token.assert_called_once()
         self.api.session.request.assert_called_once_with('GET',
@@ -337,6 +787,10 @@ class SalesForceApiTest(TestCase):
         with self.assertRaises(APIException):
             self.api.get_resource('Account_fooo')
 
+    def test_identity_path(self):
+        r = self.api.get_resource('identity')
+        self.assertEqual(r.get_url(), self.token_response['id'])
+
     def test_cascading_resource_path(self):
         expected = 'sobjects/Account/'
         r = self.api.get_resource('Account')
@@ -349,14 +803,690 @@ class SalesForceApiTest(TestCase):
 
     def test_invalid_session_id_recover(self):
         self.api.get('recent')  # call with a fresh token
-        self.mock_fetch_token.assert_not_called()
-        self.api.return_value = u'{"errorCode":"INVALID_SESSION_ID", "msg":"Session expired or invalid"}'
-        with mock.patch.object(OAuth2Session, 'fetch_token', return_value=self.token_response) as mock_fetch_token:
+        self.api.session.request.reset_mock()
+
+        expired = make_response(401, u'[{"errorCode":"INVALID_SESSION_ID", "message":"Session expired or invalid"}]')
+        self.api.session.request = mock.MagicMock(side_effect=[expired, MockResponse(self.api)])
+        self.api.status_code = requests.codes.created
+        self.api.return_value = u'{"id": "001D000000IqhSLIAZ", "errors": [], "success": true}'
+        new_token = dict(self.token_response, access_token=u'NEW_TOKEN')
+        with mock.patch.object(OAuth2Session, 'fetch_token', return_value=new_token) as mock_fetch_token:
+            response = self.api.post('Account', data={'Name': 'foo'})
+
+        # the failed call, then the rerun with the same body
+        self.assertEqual(self.api.session.request.call_count, 2)
+        first, rerun = self.api.session.request.call_args_list
+        self.assertEqual(first, rerun)
+        self.assertEqual(rerun[1]['data'], '{"Name": "foo"}')
+        self.assertEqual(response['id'], '001D000000IqhSLIAZ')
+        mock_fetch_token.assert_called_once()
+        self.assertEqual(self.api.token['access_token'], u'NEW_TOKEN')
+
+    def test_invalid_session_id_recover_patch(self):
+        expired = make_response(401, u'[{"errorCode":"INVALID_SESSION_ID", "message":"Session expired or invalid"}]')
+        self.api.session.request = mock.MagicMock(side_effect=[expired, make_response(requests.codes.no_content, u'')])
+        with mock.patch.object(OAuth2Session, 'fetch_token', return_value=self.token_response):
+            self.api.patch('Account', params={'id': '001D000000IqhSLIAZ'}, data={'Name': 'bar'})
+        self.assertEqual(self.api.session.request.call_count, 2)
+
+    def test_error_page(self):
+        self.api.session.request = mock.MagicMock(return_value=make_response(503, u'<html><body>Service Unavailable</body></html>'))
+        with self.assertRaises(APIException) as cm:
+            self.api.patch('Account', params={'id': '001D000000IqhSLIAZ'}, data={'Name': 'bar'})
+        self.assertEqual((cm.exception.status_code, cm.exception.payload), (503, {}))
+
+    def test_invalid_session_id_rerun_once(self):
+        self.api.status_code = 401
+        self.api.return_value = u'[{"errorCode":"INVALID_SESSION_ID", "message":"Session expired or invalid"}]'
+        self.api.session.request.reset_mock()
+        with mock.patch.object(OAuth2Session, 'fetch_token', return_value=self.token_response):
+            with self.assertRaises(APIException):
+                self.api.get('recent')
+        self.assertEqual(self.api.session.request.call_count, 2)
+
+    def test_proactive_refresh(self):
+        self.api.token = dict(self.token_response, issued_at=u'1392809231037')
+        self.api.session.request.reset_mock()
+        new_token = dict(self.token_response, access_token=u'NEW_TOKEN')
+        with mock.patch.object(OAuth2Session, 'fetch_token', return_value=new_token) as mock_fetch_token:
             self.api.get('recent')
+        mock_fetch_token.assert_called_once()
+        # no failed round trip
+        self.api.session.request.assert_called_once()
+        self.assertEqual(self.api.token['access_token'], u'NEW_TOKEN')
+
+    def test_single_flight_refresh(self):
+        stale = self.api.token
+        new_token = dict(self.token_response, access_token=u'NEW_TOKEN')
+
+        def slow_fetch(*args, **kwargs):
+            time.sleep(0.05)
+            return new_token
+
+        with mock.patch.object(OAuth2Session, 'fetch_token', side_effect=slow_fetch) as mock_fetch_token:
+            threads = [threading.Thread(target=self.api.refresh_session_id, kwargs={'stale_token': stale}) for i in range(5)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        mock_fetch_token.assert_called_once()
+        self.assertEqual(self.api.token['access_token'], u'NEW_TOKEN')
+
+    def test_single_flight_same_access_token(self):
+        # a new login while the session is alive returns the same access token, issued again
+        self.api.token = stale = dict(self.token_response, issued_at=u'1392809231037')
+        new_token = dict(self.token_response, issued_at=u'1392812831037')
+
+        def slow_fetch(*args, **kwargs):
+            time.sleep(0.05)
+            return new_token
+
+        with mock.patch.object(OAuth2Session, 'fetch_token', side_effect=slow_fetch) as mock_fetch_token:
+            threads = [threading.Thread(target=self.api.refresh_session_id, kwargs={'stale_token': stale}) for i in range(5)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        mock_fetch_token.assert_called_once()
+        self.assertEqual(self.api.token['issued_at'], u'1392812831037')
+
+
+class SObjectsCacheTest(TestCase):
+    def setUp(self):
+        get_sf_cache().clear()
+        self.token_response = token_response
+
+    def _get_api(self):
+        with mock.patch.object(OAuth2Session, 'fetch_token', return_value=self.token_response):
+            return MySalesForceApi()
 
-        # 1 for sobjects
-        # 2 for first 'recent' get
-        # 3 for invalid token
-        # 4 for rerun
+    def test_cached_tree(self):
+        api = self._get_api()
+        self.assertEqual(api.session.request.call_count, 1)
+
+        api = self._get_api()
+        # no describe call at all, the resources come from the cache
+        self.assertEqual(api.session.request.call_count, 0)
+        self.assertEqual(api.get_resource('Account').get_path(), 'sobjects/Account/')
+        with self.assertRaises(APIException):
+            api.get_resource('Contact')
+
+    def test_cache_key(self):
+        api = self._get_api()
+        self.assertEqual(api.get_sobjects_cache_key(), 'SalesForceApi:sobjects:00D11000000CqsdEAC:47.0:3')
+
+    def test_tree_version(self):
+        self._get_api()
+        # the tree cached by an older version of get_tree is fetched again
+        with mock.patch.object(MySalesForceApi, 'sobjects_tree_version', MySalesForceApi.sobjects_tree_version + 1):
+            api = self._get_api()
+        self.assertEqual(api.session.request.call_count, 1)
+
+    def test_check_not_modified(self):
+        api = self._get_api()
+        cache = get_sf_cache()
+        index = cache.get(api.get_sobjects_cache_key())
+
+        api.status_code = requests.codes.not_modified
+        api.return_value = u''
+        api.check_sobjects()
+        headers = api.session.request.call_args[1]['headers']
+        self.assertEqual(headers['If-Modified-Since'], index['last_modified'])
+        new_index = cache.get(api.get_sobjects_cache_key())
+        self.assertEqual(new_index['fingerprint'], index['fingerprint'])
+
+    def test_check_schema_changed(self):
+        api = self._get_api()
+        cache = get_sf_cache()
+        fingerprint = cache.get(api.get_sobjects_cache_key())['fingerprint']
+
+        api.sobjects_whitelist = []
+        api.return_value = u'{"sobjects": [{"name": "Lead", "urls": {"sobject": "/services/data/v29.0/sobjects/Lead", "describe": "/services/data/v29.0/sobjects/Lead/describe"}}]}'
+        api.check_sobjects()
+        api.get_resource('Lead.describe')
+        new_fingerprint = cache.get(api.get_sobjects_cache_key())['fingerprint']
+        self.assertNotEqual(new_fingerprint, fingerprint)
+        self.assertEqual(cache.get(api.get_sobjects_cache_key(new_fingerprint)).keys(), ['Lead'])
+
+
+def make_cached_response(status_code, text, headers={}):
+    response = make_response(status_code, text)
+    response.headers = headers
+    return response
+
+
+class CachedResource(SalesForceResource):
+    path = 'cached/{id}/'
+    methods = ['GET', 'PATCH']
+    cache_timeout = 60
+    cache_max_entries = 2
+
+
+class ResponseCacheTest(TestCase):
+    def setUp(self):
+        self.api = make_sf_api()
+        self.api.response_cache = ResponseCache('test')
+        self.api.make_resource('cached', {'class': CachedResource})
+        self.api.session.request = mock.MagicMock(return_value=make_cached_response(200, u'{"name": "Account"}'))
+
+    def test_cached(self):
+        describe = self.api.get('Account.describe')
+        self.assertEqual(describe, {'name': 'Account'})
+        describe['name'] = 'altered'
+        self.assertEqual(self.api.get('Account.describe'), {'name': 'Account'})
+        self.assertEqual(self.api.session.request.call_count, 1)
+        self.assertEqual(self.api.response_cache.stats, {'hits': 1, 'revalidated': 0, 'misses': 1})
+        # not cached
+        self.api.get('Account', params={'id': '001A'})
+        self.api.get('Account', params={'id': '001A'})
+        self.assertEqual(self.api.session.request.call_count, 3)
+
+    def test_expired(self):
+        self.api.get('limits')
+        with mock.patch('time.time', return_value=time.time() + 61):
+            self.api.get('limits')
+        # without validators
+        self.assertEqual(self.api.session.request.call_count, 2)
+        self.assertEqual(self.api.session.request.call_args[1]['headers'], {'Content-Type': 'application/json'})
+
+    def test_revalidate(self):
+        headers = {'ETag': '"abc"', 'Last-Modified': 'Wed, 19 Feb 2014 12:00:00 GMT'}
+        self.api.session.request = mock.MagicMock(side_effect=[make_cached_response(200, u'{"name": "Account"}', headers),
+                                                               make_cached_response(304, u'')])
+        self.api.get('Account.describe')
+        with mock.patch('time.time', return_value=time.time() + 3601):
+            self.assertEqual(self.api.get('Account.describe'), {'name': 'Account'})
+        self.assertEqual(self.api.session.request.call_args[1]['headers'],
+                         {'Content-Type': 'application/json', 'If-None-Match': '"abc"',
+                          'If-Modified-Since': 'Wed, 19 Feb 2014 12:00:00 GMT'})
+        self.assertEqual(self.api.response_cache.stats, {'hits': 0, 'revalidated': 1, 'misses': 1})
+        # fresh again
+        self.api.get('Account.describe')
+        self.assertEqual(self.api.session.request.call_count, 2)
+
+    def test_write_invalidates(self):
+        self.api.get('cached', params={'id': '1'})
+        self.api.get('cached', params={'id': '2'})
+        self.api.session.request.return_value = make_cached_response(204, u'')
+        self.api.patch('cached', params={'id': '1'}, data={'name': 'foo'})
+        self.api.session.request.return_value = make_cached_response(200, u'{"name": "foo"}')
+        self.assertEqual(self.api.get('cached', params={'id': '1'}), {'name': 'foo'})
+        self.assertEqual(self.api.get('cached', params={'id': '2'}), {'name': 'Account'})
         self.assertEqual(self.api.session.request.call_count, 4)
-        mock_fetch_token.assert_called_once()
+
+    def test_lru(self):
+        for i in ('1', '2', '1', '3'):
+            self.api.get('cached', params={'id': i})
+        self.assertEqual(self.api.session.request.call_count, 3)
+        # 2 was the least recently used
+        self.api.get('cached', params={'id': '1'})
+        self.api.get('cached', params={'id': '2'})
+        self.assertEqual(self.api.session.request.call_count, 4)
+
+    def test_shared(self):
+        self.api.response_cache = SharedResponseCache('test')
+        self.api.get('Account.describe')
+        other = SharedResponseCache('test')
+        resource = self.api.get_resource('Account.describe')
+        self.assertEqual(other.get(resource, 'https://footest.salesforce.com/rest/v1.0/sobjects/Account/describe/').values()[0]['payload'],
+                         {'name': 'Account'})
+        self.api.response_cache = other
+        self.api.get('Account.describe')
+        self.assertEqual(self.api.session.request.call_count, 1)
+
+    def test_disabled(self):
+        self.api.response_cache = None
+        self.api.get('Account.describe')
+        self.api.get('Account.describe')
+        self.assertEqual(self.api.session.request.call_count, 2)
+
+
+class ProjectedContactResource(SFInstanceResource):
+    fields = ['FirstName']
+
+
+class RecordCacheTest(TestCase):
+    def setUp(self):
+        self.api = make_sf_api()
+        self.api.record_cache = RecordCache('test')
+        self.api.make_resource('contact', {'class': ProjectedContactResource, 'path': 'sobjects/Contact/{id}/'})
+        self.api.make_resource('user', {'class': SFUserResource})
+        self.api.session.request = mock.MagicMock(return_value=make_response(200, u'{"Id": "001A", "Name": "foo"}'))
+
+    def test_read_through(self):
+        record = self.api.get('Account', params={'id': '001A'})
+        record['Name'] = 'altered'
+        self.assertEqual(self.api.get('Account', params={'id': '001A'}), {'Id': '001A', 'Name': 'foo'})
+        self.assertEqual(self.api.session.request.call_count, 1)
+        self.assertEqual(self.api.record_cache.stats, {'local_hits': 1, 'shared_hits': 0, 'misses': 1})
+        self.assertEqual(self.api.record_cache.get_hit_rate(), 0.5)
+        # another record
+        self.api.get('Account', params={'id': '001B'})
+        self.assertEqual(self.api.session.request.call_count, 2)
+
+    def test_shared(self):
+        self.api.get('Account', params={'id': '001A'})
+        # in another process
+        self.api.record_cache = RecordCache('test')
+        self.assertEqual(self.api.get('Account', params={'id': '001A'}), {'Id': '001A', 'Name': 'foo'})
+        self.assertEqual(self.api.record_cache.stats, {'local_hits': 0, 'shared_hits': 1, 'misses': 0})
+        self.assertEqual(self.api.session.request.call_count, 1)
+
+    def test_projection(self):
+        self.api.get('contact', params={'id': '003A'})
+        self.assertEqual(self.api.session.request.call_args[0][1], 'https://footest.salesforce.com/rest/v1.0/sobjects/Contact/003A/?fields=FirstName')
+        self.assertEqual(self.api.record_cache.get('Contact', '003A', 'FirstName'), {'Id': '001A', 'Name': 'foo'})
+        self.assertIsNone(self.api.record_cache.get('Contact', '003A', ''))
+
+    def test_write_invalidates(self):
+        for method in ('patch', 'delete'):
+            self.api.session.request.return_value = make_response(200, u'{"Id": "001A", "Name": "foo"}')
+            self.api.get('Account', params={'id': '001A'})
+            self.api.get('Account', params={'id': '001B'})
+            self.api.session.request.return_value = make_response(204, u'')
+            getattr(self.api, method)('Account', params={'id': '001A'}, data={'Name': 'bar'})
+            self.assertIsNone(self.api.record_cache.get('Account', '001A', ''))
+            self.assertIsNotNone(self.api.record_cache.get('Account', '001B', ''))
+
+    def test_batched_write_invalidates(self):
+        self.api.get('Account', params={'id': '001A'})
+        with self.api.batching():
+            self.api.patch('Account', params={'id': '001A'}, data={'Name': 'bar'})
+            self.assertIsNone(self.api.record_cache.get('Account', '001A', ''))
+            self.api.session.request.return_value = make_response(200, u'{"hasErrors": false, "results": [{"statusCode": 204, "result": null}]}')
+
+    def test_push_invalidates(self):
+        user = User(username='foo', email='003A', first_name='foo', last_name='bar')
+        self.api.record_cache.set('Contact', '003A', '', {'FirstName': 'old'})
+        self.api.session.request.return_value = make_response(204, u'')
+        self.api.push('user', user)
+        self.assertIsNone(self.api.record_cache.get('Contact', '003A', ''))
+
+        self.api.record_cache.set('Contact', '003A', '', {'FirstName': 'old'})
+        user.first_name = 'foo2'
+        self.api.session.request.return_value = make_response(200, u'[{"id": "003A", "success": true, "errors": []}]')
+        self.api.push_many('user', [user])
+        self.assertIsNone(self.api.record_cache.get('Contact', '003A', ''))
+
+    def test_feeds_invalidate(self):
+        for record_id in ('001A', '001B', '001C'):
+            self.api.record_cache.set('Account', record_id, '', {'Id': record_id})
+        start, end = datetime.datetime(2014, 2, 19), datetime.datetime(2014, 2, 20)
+        self.api.session.request.return_value = make_response(200, u'{"ids": ["001A"], "latestDateCovered": "2014-02-20T00:00:00.000+0000"}')
+        self.api.get('Account.updated', params={'start': start, 'end': end})
+        self.api.session.request.return_value = make_response(200, u'{"deletedRecords": [{"id": "001B", "deletedDate": "2014-02-19T12:00:00.000+0000"}]}')
+        self.api.get('Account.deleted', params={'start': start, 'end': end})
+        self.assertIsNone(self.api.record_cache.get('Account', '001A', ''))
+        self.assertIsNone(self.api.record_cache.get('Account', '001B', ''))
+        self.assertEqual(self.api.record_cache.get('Account', '001C', ''), {'Id': '001C'})
+
+    def test_local_lru(self):
+        cache = RecordCache('test')
+        cache.max_entries = 2
+        for record_id in ('001A', '001B', '001C'):
+            cache.set('Account', record_id, '', {'Id': record_id})
+        self.assertEqual(cache.local.keys(), ['test:Account:001B', 'test:Account:001C'])
+        # still in the shared tier
+        self.assertEqual(cache.get('Account', '001A', ''), {'Id': '001A'})
+        self.assertEqual(cache.stats['shared_hits'], 1)
+
+
+class TokenStoreTest(TestCase):
+    def setUp(self):
+        get_sf_cache().clear()
+        self.token_response = token_response
+        self.store = TokenStore('test:token')
+
+    def test_shared_between_instances(self):
+        with mock.patch.object(OAuth2Session, 'fetch_token', return_value=self.token_response) as mock_fetch_token:
+            api1 = MySalesForceApi()
+            api2 = MySalesForceApi()
+        self.assertEqual(mock_fetch_token.call_count, 1)
+        self.assertEqual(api2.session.token['access_token'], u'ACCESS_TOKEN')
+        self.assertEqual(api1.token_store.key, api2.token_store.key)
+
+    def test_fetch_stale(self):
+        self.store.set(self.token_response)
+        fetch = mock.MagicMock(return_value=dict(self.token_response, access_token=u'NEW_TOKEN'))
+        token = self.store.get_or_fetch(fetch, stale=self.token_response)
+        fetch.assert_called_once_with()
+        self.assertEqual(token['access_token'], u'NEW_TOKEN')
+        self.assertEqual(self.store.get()['access_token'], u'NEW_TOKEN')
+
+    def test_already_refreshed(self):
+        # another process already replaced the stale token
+        self.store.set(dict(self.token_response, access_token=u'NEW_TOKEN'))
+        fetch = mock.MagicMock()
+        token = self.store.get_or_fetch(fetch, stale=self.token_response)
+        self.assertFalse(fetch.called)
+        self.assertEqual(token['access_token'], u'NEW_TOKEN')
+
+    def test_already_refreshed_same_access_token(self):
+        stale = dict(self.token_response, issued_at=u'1392809231037')
+        self.store.set(dict(self.token_response, issued_at=u'1392812831037'))
+        fetch = mock.MagicMock()
+        token = self.store.get_or_fetch(fetch, stale=stale)
+        self.assertFalse(fetch.called)
+        self.assertEqual(token['issued_at'], u'1392812831037')
+
+    def test_wait_for_refreshing_process(self):
+        self.store.set(self.token_response)
+        # another process holds the lock and refreshes the token while we wait
+        self.store.cache.add(self.store.lock_key, 1)
+        refreshed = lambda interval: self.store.set(dict(self.token_response, access_token=u'NEW_TOKEN'))
+        fetch = mock.MagicMock()
+        with mock.patch('time.sleep', side_effect=refreshed):
+            token = self.store.get_or_fetch(fetch, stale=self.token_response)
+        self.assertFalse(fetch.called)
+        self.assertEqual(token['access_token'], u'NEW_TOKEN')
+
+
+class SFUserResource(JsonResource, ModelResource):
+    model = User
+    path = 'sobjects/Contact/'
+    distant_id = 'email'  # any char field of the User model would do
+    fields_map = {'FirstName': 'first_name',
+                  'LastName': 'last_name'}
+
+
+class SObjectCollectionsTest(TestCase):
+    def setUp(self):
+        self.api = make_sf_api(user_class=SFUserResource)
+        self.users = [User.objects.create(username='user%s' % i, first_name='foo%s' % i, last_name='bar') for i in range(3)]
+        self.users[2].email = '003D000000IqhSLIAZ'
+
+    def test_push_many(self):
+        self.api.session.request = mock.MagicMock(side_effect=[
+            make_response(200, u'[{"id": "003D000000IqhSLIAA", "success": true, "errors": []}, {"success": false, "errors": [{"statusCode": "DUPLICATES_DETECTED", "message": "Duplicate", "fields": []}]}]'),
+            make_response(200, u'[{"id": "003D000000IqhSLIAZ", "success": true, "errors": []}]'),
+        ])
+        results = self.api.push_many('user', self.users)
+
+        create, update = self.api.session.request.call_args_list
+        self.assertEqual(create[0], ('POST', 'https://footest.salesforce.com/rest/v1.0/composite/sobjects/'))
+        self.assertEqual(json.loads(create[1]['data']),
+                         {'allOrNone': False,
+                          'records': [{'attributes': {'type': 'Contact'}, 'FirstName': 'foo0', 'LastName': 'bar'},
+                                      {'attributes': {'type': 'Contact'}, 'FirstName': 'foo1', 'LastName': 'bar'}]})
+        self.assertEqual(update[0][0], 'PATCH')
+        self.assertEqual(json.loads(update[1]['data'])['records'][0]['id'], '003D000000IqhSLIAZ')
+
+        self.assertEqual([r['success'] for r in results], [True, False, True])
+        self.assertEqual(User.objects.get(pk=self.users[0].pk).email, '003D000000IqhSLIAA')
+        self.assertEqual(User.objects.get(pk=self.users[1].pk).email, '')
+
+    def test_push_many_changed_fields(self):
+        self.api.session.request = mock.MagicMock(return_value=make_response(200, u'[{"id": "003D000000IqhSLIAZ", "success": true, "errors": []}]'))
+        self.api.push_many('user', self.users[2:])
+        self.users[2].first_name = 'foo4'
+        self.api.push_many('user', self.users[2:])
+        self.assertEqual(json.loads(self.api.session.request.call_args[1]['data'])['records'],
+                         [{'attributes': {'type': 'Contact'}, 'id': '003D000000IqhSLIAZ', 'FirstName': 'foo4'}])
+        results = self.api.push_many('user', self.users[2:])
+        self.assertEqual(self.api.session.request.call_count, 2)
+        self.assertEqual(results, [{'id': '003D000000IqhSLIAZ', 'success': True, 'errors': []}])
+
+    def test_push_many_push_store(self):
+        self.api.push_store = PushStore('test')
+        self.api.session.request = mock.MagicMock(return_value=make_response(204, u''))
+        self.api.push('user', self.users[2])
+        self.users[2].first_name = 'foo4'
+        self.api.session.request.return_value = make_response(200, u'[{"id": "003D000000IqhSLIAZ", "success": true, "errors": []}]')
+        self.api.push_many('user', self.users[2:])
+        # back to the fields of the first push, which are no longer the distant ones
+        self.users[2].first_name = 'foo2'
+        self.api.session.request.return_value = make_response(204, u'')
+        self.api.push('user', self.users[2])
+        self.assertEqual(self.api.session.request.call_count, 3)
+        self.assertEqual(json.loads(self.api.session.request.call_args[1]['data']), {'FirstName': 'foo2'})
+        self.assertEqual(self.api.push_store.stats, {'pushed': 2, 'skipped': 0})
+
+    def test_push_many_old_api_version(self):
+        self.api.api_version = '41.0'
+        self.api.session.request = mock.MagicMock(return_value=make_response(201, u'{"id": "003D000000IqhSLIAA", "success": true, "errors": []}'))
+        results = self.api.push_many('user', self.users[:2])
+        self.assertEqual([args for args, kwargs in self.api.session.request.call_args_list],
+                         [('POST', 'https://footest.salesforce.com/rest/v1.0/sobjects/Contact/')] * 2)
+        self.assertEqual([r['success'] for r in results], [True, True])
+
+    def test_push_many_chunks(self):
+        self.api.session.request = mock.MagicMock(side_effect=[
+            make_response(200, u'[{"id": "003D000000IqhSLIAA", "success": true, "errors": []}]'),
+            make_response(401, u'[{"errorCode": "INVALID_FIELD", "message": "No such column"}]'),
+            make_response(200, u'[{"id": "003D000000IqhSLIAZ", "success": true, "errors": []}]'),
+        ])
+        with mock.patch('sforce.api.composite.SObjectCollectionsResource.max_records', 1):
+            results = self.api.push_many('user', self.users)
+        self.assertEqual(self.api.session.request.call_count, 3)
+        self.assertEqual(results[1]['errors'][0]['statusCode'], 'INVALID_FIELD')
+        self.assertEqual([r['success'] for r in results], [True, False, True])
+
+    def test_pull_many(self):
+        self.users[0].email = '003D000000IqhSLIAA'
+        self.api.push_store = PushStore('test')
+        self.api.return_value = u'[{"attributes": {"type": "Contact"}, "Id": "003D000000IqhSLIAA", "FirstName": "foo", "LastName": "baz"}, null]'
+        missing = self.api.pull_many('user', self.users)
+
+        self.api.session.request.assert_called_with('POST',
+                                                    'https://footest.salesforce.com/rest/v1.0/composite/sobjects/Contact/',
+                                                    headers={'Content-Type': 'application/json'},
+                                                    data=json.dumps({'ids': ['003D000000IqhSLIAA', '003D000000IqhSLIAZ'], 'fields': ['FirstName', 'LastName']}),
+                                                    timeout=1)
+        # users[1] is not synced, and the distant users[2] was not found
+        self.assertEqual(missing, [self.users[1], self.users[2]])
+        self.assertEqual(User.objects.get(pk=self.users[0].pk).last_name, 'baz')
+        self.assertEqual(User.objects.get(pk=self.users[2].pk).last_name, 'bar')
+        self.assertTrue(self.api.push_store.is_pushed('user', '003D000000IqhSLIAA', {'FirstName': 'foo', 'LastName': 'baz'}))
+
+    def test_pull_many_batches(self):
+        for user in self.users:
+            user.email = '003D000000IqhSLIA%s' % user.pk
+        self.api.return_value = u'[{"FirstName": "foo", "LastName": "baz"}, {"FirstName": "foo", "LastName": "baz"}]'
+        self.api.session.request.reset_mock()
+        self.api.pull_many('user', self.users, batch_size=2)
+        self.assertEqual(self.api.session.request.call_count, 2)
+
+    def test_pull_many_old_api_version(self):
+        self.api.api_version = '41.0'
+        self.users[0].email = '003D000000IqhTAIAA'
+        self.api.return_value = u'{"totalSize": 1, "done": true, "records": [{"attributes": {"type": "Contact"}, "Id": "003D000000IqhSLIAZ", "FirstName": "foo", "LastName": "baz"}]}'
+        missing = self.api.pull_many('user', self.users)
+        self.assertEqual(missing, [self.users[1], self.users[0]])
+        url = self.api.session.request.call_args[0][1]
+        self.assertEqual(urlparse.parse_qs(urlparse.urlparse(url).query)['q'],
+                         ["SELECT Id, FirstName, LastName FROM Contact WHERE Id IN ('003D000000IqhTAIAA', '003D000000IqhSLIAZ')"])
+        self.assertEqual(User.objects.get(pk=self.users[2].pk).last_name, 'baz')
+
+
+class SFAccountResource(SFUserResource):
+    path = 'sobjects/Account/'
+    fields_map = {'Name': 'username'}
+
+
+class SObjectTreeTest(TestCase):
+    def setUp(self):
+        self.api = make_sf_api(user_class=SFUserResource)
+        self.api.make_resource('account', {'class': SFAccountResource})
+        self.users = [User.objects.create(username='user%s' % i, first_name='foo%s' % i, last_name='bar') for i in range(4)]
+
+    def test_push_tree(self):
+        self.api.session.request = mock.MagicMock(return_value=make_response(201, u'{"hasErrors": false, "results": [{"referenceId": "ref0", "id": "001A"}, {"referenceId": "ref1", "id": "003B"}, {"referenceId": "ref2", "id": "003C"}, {"referenceId": "ref3", "id": "500D"}]}'))
+        account, contact, other_contact, case = self.users
+        self.api.push_store = PushStore('test')
+        results = self.api.push_tree('account', account, {'Contacts': ('user', [contact, (other_contact, {'Cases': ('user', [case])})])})
+
+        self.assertEqual(self.api.session.request.call_count, 1)
+        args, kwargs = self.api.session.request.call_args
+        self.assertEqual(args, ('POST', 'https://footest.salesforce.com/rest/v1.0/composite/tree/Account/'))
+        contact_record = lambda ref, user: {'attributes': {'type': 'Contact', 'referenceId': ref}, 'FirstName': user.first_name, 'LastName': 'bar'}
+        self.assertEqual(json.loads(kwargs['data']),
+                         {'records': [{'attributes': {'type': 'Account', 'referenceId': 'ref0'},
+                                       'Name': 'user0',
+                                       'Contacts': {'records': [contact_record('ref1', contact),
+                                                                dict(contact_record('ref2', other_contact),
+                                                                     Cases={'records': [contact_record('ref3', case)]})]}}]})
+        self.assertEqual(len(results), 4)
+        self.assertEqual([User.objects.get(pk=user.pk).email for user in self.users], ['001A', '003B', '003C', '500D'])
+        self.assertTrue(self.api.push_store.is_pushed('user', '003B', {'FirstName': 'foo1', 'LastName': 'bar'}))
+        # the instances know their synced fields, only the changed ones are pushed next
+        contact.first_name = 'foo5'
+        self.api.session.request.return_value = make_response(204, u'')
+        self.api.push('user', contact)
+        self.assertEqual(json.loads(self.api.session.request.call_args[1]['data']), {'FirstName': 'foo5'})
+
+    def test_push_tree_errors(self):
+        self.api.session.request = mock.MagicMock(return_value=make_response(400, u'{"hasErrors": true, "results": [{"referenceId": "ref1", "errors": [{"statusCode": "INVALID_EMAIL_ADDRESS", "message": "Email: invalid email address", "fields": ["Email"]}]}]}'))
+        with self.assertRaises(APIException) as cm:
+            self.api.push_tree('account', self.users[0], {'Contacts': ('user', self.users[1:2])})
+        self.assertEqual(cm.exception.payload['results'][0]['referenceId'], 'ref1')
+        self.assertEqual([User.objects.get(pk=user.pk).email for user in self.users[:2]], ['', ''])
+
+        self.users[1].email = '003B'
+        with self.assertRaises(ValueError):
+            self.api.push_tree('account', self.users[0], {'Contacts': ('user', self.users[1:2])})
+
+
+class BatchedContactResource(SFInstanceResource):
+    batchable = True
+    fields = ['FirstName', 'LastName']
+
+
+class CompositeBatchTest(TestCase):
+    def setUp(self):
+        self.api = make_sf_api()
+
+    def test_batching(self):
+        self.api.session.request = mock.MagicMock(return_value=make_response(200, u'{"hasErrors": true, "results": [{"statusCode": 200, "result": {"Id": "001A"}}, {"statusCode": 404, "result": [{"errorCode": "NOT_FOUND", "message": "not found"}]}, {"statusCode": 204, "result": null}]}'))
+        with self.api.batching():
+            found = self.api.get('Account', params={'id': '001A'})
+            missing = self.api.get('Account', params={'id': '001B'})
+            updated = self.api.patch('Account', params={'id': '001C'}, data={'Name': 'foo'})
+            self.assertFalse(self.api.session.request.called)
+
+        args, kwargs = self.api.session.request.call_args
+        self.assertEqual(args, ('POST', 'https://footest.salesforce.com/rest/v1.0/composite/batch/'))
+        self.assertEqual(json.loads(kwargs['data']),
+                         {'haltOnError': False,
+                          'batchRequests': [{'method': 'GET', 'url': 'v47.0/sobjects/Account/001A/'},
+                                            {'method': 'GET', 'url': 'v47.0/sobjects/Account/001B/'},
+                                            {'method': 'PATCH', 'url': 'v47.0/sobjects/Account/001C/', 'richInput': {'Name': 'foo'}}]})
+        self.assertEqual(found.get(), {'Id': '001A'})
+        with self.assertRaises(APIException) as cm:
+            missing.get()
+        self.assertEqual((cm.exception.status_code, cm.exception.payload['errorCode']), (404, 'NOT_FOUND'))
+        self.assertEqual(updated.get(), {})
+
+    def test_batch_size(self):
+        results = lambda count: u'{"hasErrors": false, "results": [%s]}' % ', '.join([u'{"statusCode": 200, "result": {}}'] * count)
+        self.api.session.request = mock.MagicMock(side_effect=[make_response(200, results(25)), make_response(200, results(5))])
+        with self.api.batching():
+            deferred = [self.api.get('Account', params={'id': str(i)}) for i in range(30)]
+            self.assertEqual(self.api.session.request.call_count, 1)
+        self.assertEqual(self.api.session.request.call_count, 2)
+        self.assertEqual([len(json.loads(kwargs['data'])['batchRequests']) for args, kwargs in self.api.session.request.call_args_list], [25, 5])
+        self.assertTrue(all(result.done() for result in deferred))
+
+    def test_connection_error(self):
+        results = u'{"hasErrors": false, "results": [%s]}' % ', '.join([u'{"statusCode": 200, "result": {}}'] * 5)
+        self.api.session.request = mock.MagicMock(side_effect=[requests.ConnectionError('connection refused'), make_response(200, results)])
+        with self.api.batching():
+            deferred = [self.api.get('Account', params={'id': str(i)}) for i in range(30)]
+        self.assertTrue(all(result.done() for result in deferred))
+        for result in deferred[:25]:
+            with self.assertRaises(requests.ConnectionError):
+                result.get()
+        self.assertEqual([result.get() for result in deferred[25:]], [{}] * 5)
+
+    def test_wait_sends(self):
+        self.api.session.request = mock.MagicMock(return_value=make_response(200, u'{"hasErrors": false, "results": [{"statusCode": 200, "result": {"Id": "001A"}}]}'))
+        with self.api.batching():
+            self.assertEqual(self.api.get('Account', params={'id': '001A'}).get(), {'Id': '001A'})
+            self.assertEqual(self.api.session.request.call_count, 1)
+        self.assertEqual(self.api.session.request.call_count, 1)
+
+    def test_projection(self):
+        self.api.make_resource('contact', {'class': BatchedContactResource, 'path': 'sobjects/Contact/{id}/'})
+        self.api.session.request = mock.MagicMock(return_value=make_response(200, u'{"hasErrors": false, "results": [{"statusCode": 200, "result": {"FirstName": "foo"}}]}'))
+        with self.api.batching():
+            self.api.get('contact', params={'id': '003A'})
+        subrequests = json.loads(self.api.session.request.call_args[1]['data'])['batchRequests']
+        self.assertEqual(subrequests, [{'method': 'GET', 'url': 'v47.0/sobjects/Contact/003A/?fields=FirstName%2CLastName'}])
+
+    def test_write_invalidates(self):
+        self.api.record_cache = RecordCache('test')
+        self.api.session.request = mock.MagicMock(return_value=make_response(200, u'{"hasErrors": false, "results": [{"statusCode": 204, "result": null}]}'))
+        with mock.patch.object(self.api, 'drop_responses') as drop_responses:
+            with self.api.batching():
+                self.api.patch('Account', params={'id': '001A'}, data={'Name': 'bar'})
+                # cached again by another thread, while the patch is queued
+                self.api.record_cache.set('Account', '001A', '', {'Name': 'foo'})
+        self.assertIsNone(self.api.record_cache.get('Account', '001A', ''))
+        self.assertIn('https://footest.salesforce.com/rest/v1.0/sobjects/Account/001A/',
+                      [args[0].get_url() for args, kwargs in drop_responses.call_args_list])
+
+    def test_old_api_version(self):
+        self.api.api_version = '33.0'
+        self.api.session.request = mock.MagicMock(return_value=make_response(200, u'{"Id": "001A"}'))
+        with self.api.batching():
+            result = self.api.get('Account', params={'id': '001A'})
+            # sent right away, on its own
+            self.assertTrue(result.done())
+            self.assertEqual(self.api.session.request.call_args[0], ('GET', 'https://footest.salesforce.com/rest/v1.0/sobjects/Account/001A/'))
+        self.assertEqual(result.get(), {'Id': '001A'})
+        self.assertEqual(self.api.session.request.call_count, 1)
+
+    def test_not_batchable(self):
+        self.api.session.request = mock.MagicMock(side_effect=[
+            make_response(200, u'{"totalSize": 0, "done": true, "records": []}'),
+            make_response(401, u'[{"errorCode": "API_DISABLED_FOR_ORG", "message": "disabled"}]'),
+        ])
+        with self.api.batching():
+            self.assertEqual(self.api.get('query', params={'q': 'SELECT Id FROM Account'})['totalSize'], 0)
+            result = self.api.delete('Account', params={'id': '001A'})
+        self.assertEqual(self.api.session.request.call_count, 2)
+        with self.assertRaises(APIException):
+            result.get()
+        # outside of the block, the requests are sent right away
+        self.api.session.request = mock.MagicMock(return_value=make_response(200, u'{"Id": "001A"}'))
+        self.assertEqual(self.api.get('Account', params={'id': '001A'}), {'Id': '001A'})
+
+
+class PagerTest(TestCase):
+    def setUp(self):
+        self.api = make_sf_api()
+        self.api.session.request = mock.MagicMock(side_effect=[
+            make_response(200, u'{"totalSize": 3, "done": false, "nextRecordsUrl": "/services/data/v29.0/query/01gD0000002HU6KIAW-1", "records": [{"Id": "1"}]}'),
+            make_response(200, u'{"totalSize": 3, "done": false, "nextRecordsUrl": "/services/data/v29.0/query/01gD0000002HU6KIAW-2", "records": [{"Id": "2"}]}'),
+            make_response(200, u'{"totalSize": 3, "done": true, "records": [{"Id": "3"}]}'),
+        ])
+
+    def _check_query(self, prefetch):
+        records = self.api.iter_query(u'SELECT Id FROM Account WHERE Name = \'h\xe9h\xe9\'', batch_size=200, prefetch=prefetch)
+        self.assertEqual([r['Id'] for r in records], ['1', '2', '3'])
+        calls = self.api.session.request.call_args_list
+        self.assertEqual([c[0][1] for c in calls],
+                         ['https://footest.salesforce.com/rest/v1.0/query/?q=SELECT+Id+FROM+Account+WHERE+Name+%3D+%27h%C3%A9h%C3%A9%27',
+                          'https://footest.salesforce.com/services/data/v29.0/query/01gD0000002HU6KIAW-1',
+                          'https://footest.salesforce.com/services/data/v29.0/query/01gD0000002HU6KIAW-2'])
+        for call in calls:
+            self.assertEqual(call[1]['headers']['Sforce-Query-Options'], 'batchSize=200')
+
+    def test_iter_query(self):
+        self._check_query(prefetch=False)
+
+    def test_iter_query_prefetch(self):
+        self._check_query(prefetch=True)
+
+    def test_lazy(self):
+        records = self.api.iter_query('SELECT Id FROM Account')
+        self.assertFalse(self.api.session.request.called)
+        next(records)
+        self.assertEqual(self.api.session.request.call_count, 1)
+
+    def test_next_page_url(self):
+        self.api.session.request = mock.MagicMock(side_effect=[
+            make_response(200, u'{"elements": [{"id": "1"}], "nextPageUrl": "/services/data/v29.0/chatter/feeds/news/me/feed-items?page=2"}'),
+            make_response(200, u'{"elements": [{"id": "2"}], "nextPageUrl": null}'),
+        ])
+        records = self.api.iter_records('chatter.feeds', records_key='elements', prefetch=True)
+        self.assertEqual([r['id'] for r in records], ['1', '2'])
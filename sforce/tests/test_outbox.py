@@ -0,0 +1,111 @@
+import mock
+import json
+import requests
+from StringIO import StringIO
+from datetime import timedelta
+from requests_oauthlib import OAuth2Session
+
+from django.test import TestCase
+from django.test.utils import override_settings
+from django.core.management import call_command
+from django.contrib.auth.models import User
+from django.utils import timezone
+
+from sforce.models import OutboxEntry
+from sforce.api.outbox import Outbox, enqueue
+from sforce.tests.test_client import MySalesForceApi, SFUserResource, make_response, make_sf_api, token_response
+
+
+class OutboxApi(MySalesForceApi):
+    def __init__(self):
+        super(OutboxApi, self).__init__()
+        self.make_resource('user', {'class': SFUserResource})
+
+
+class OutboxTest(TestCase):
+    def setUp(self):
+        self.api = make_sf_api(OutboxApi)
+        self.outbox = Outbox(self.api)
+        self.users = [User.objects.create(username='user%s' % i, first_name='foo%s' % i, last_name='bar') for i in range(2)]
+
+    def test_coalesce(self):
+        for i in range(3):
+            enqueue('user', self.users[0])
+        enqueue('user', self.users[1])
+        self.assertEqual(OutboxEntry.objects.count(), 2)
+        self.assertEqual(OutboxEntry.objects.get(object_id=str(self.users[0].pk)).version, 2)
+
+    def test_drain(self):
+        for user in self.users:
+            enqueue('user', user)
+        self.api.session.request = mock.MagicMock(return_value=make_response(200, u'[{"id": "003A", "success": true, "errors": []}, {"success": false, "errors": [{"statusCode": "DUPLICATES_DETECTED", "message": "Duplicate", "fields": []}]}]'))
+        self.assertEqual(self.outbox.drain(), (1, 1))
+        self.assertEqual(self.api.session.request.call_count, 1)
+        self.assertEqual(len(json.loads(self.api.session.request.call_args[1]['data'])['records']), 2)
+
+        self.assertEqual(User.objects.get(pk=self.users[0].pk).email, '003A')
+        entry = OutboxEntry.objects.get()
+        self.assertEqual((entry.object_id, entry.attempts, entry.last_error), (str(self.users[1].pk), 1, 'DUPLICATES_DETECTED: Duplicate'))
+        self.assertTrue(entry.next_attempt > timezone.now() + timedelta(seconds=20))
+        # not due yet
+        self.assertEqual(self.outbox.drain(), (0, 0))
+
+    def test_connection_error(self):
+        for user in self.users:
+            enqueue('user', user)
+        self.api.session.request = mock.MagicMock(side_effect=requests.ConnectionError('connection refused'))
+        self.assertEqual(self.outbox.drain(), (0, 2))
+        entries = OutboxEntry.objects.all()
+        self.assertEqual([(entry.attempts, entry.last_error) for entry in entries], [(1, 'connection refused')] * 2)
+        # retried after the backoff, not after the lease
+        self.assertTrue(all(entry.next_attempt < timezone.now() + timedelta(minutes=1) for entry in entries))
+
+    def test_saved_during_push(self):
+        enqueue('user', self.users[0])
+
+        def request(*args, **kwargs):
+            if request.calls == 0:
+                enqueue('user', self.users[0])
+            request.calls += 1
+            return make_response(200, u'[{"id": "003A", "success": true, "errors": []}]')
+        request.calls = 0
+
+        self.api.session.request = mock.MagicMock(side_effect=request)
+        self.assertEqual(self.outbox.drain(), (2, 0))
+        self.assertEqual(self.api.session.request.call_count, 2)
+        self.assertFalse(OutboxEntry.objects.exists())
+
+    def test_claim(self):
+        for user in self.users:
+            enqueue('user', user)
+        self.outbox.batch_size = 1
+        self.assertEqual(len(self.outbox.claim()), 1)
+        self.assertEqual(len(self.outbox.claim()), 1)
+        # the claimed entries are left to their worker until the lease ends
+        self.assertEqual(self.outbox.claim(), [])
+
+    def test_deleted_instance(self):
+        enqueue('user', self.users[0])
+        self.users[0].delete()
+        self.api.session.request = mock.MagicMock()
+        self.assertEqual(self.outbox.drain(), (0, 0))
+        self.assertFalse(self.api.session.request.called)
+        self.assertFalse(OutboxEntry.objects.exists())
+
+    def test_no_model(self):
+        self.api.make_resource('nomodel', {'class': type('NoModelResource', (SFUserResource,), {'model': None})})
+        enqueue('nomodel', self.users[0])
+        self.api.session.request = mock.MagicMock()
+        self.assertEqual(self.outbox.drain(), (0, 1))
+        self.assertFalse(self.api.session.request.called)
+        self.assertEqual(OutboxEntry.objects.get().last_error, 'The nomodel resource has no model.')
+
+    @override_settings(SF_OUTBOX_API='sforce.tests.test_outbox.OutboxApi')
+    def test_command(self):
+        enqueue('user', self.users[0])
+        with mock.patch.object(OAuth2Session, 'fetch_token', return_value=token_response):
+            with mock.patch.object(OutboxApi, 'push_many', return_value=[{'id': '003A', 'success': True, 'errors': []}]):
+                stdout = StringIO()
+                call_command('drain_sforce_outbox', stdout=stdout)
+        self.assertEqual(stdout.getvalue(), '1 pushed, 0 failed\n')
+        self.assertFalse(OutboxEntry.objects.exists())
@@ -0,0 +1,80 @@
+import mock
+import json
+from datetime import datetime, timedelta
+
+from django.test import TestCase
+from django.contrib.auth.models import User
+
+from sforce.models import SyncWatermark
+from sforce.api.sync import IncrementalSync, utc
+from sforce.tests.test_client import SFUserResource, make_response, make_sf_api
+
+
+class SyncUserResource(SFUserResource):
+    path = 'sobjects/Account/'
+    fields_map = {'FirstName': 'first_name',
+                  'LastName': 'last_name',
+                  'Username__c': 'username'}
+
+
+class IncrementalSyncTest(TestCase):
+    def setUp(self):
+        self.api = make_sf_api(user_class=SyncUserResource)
+        self.updated = User.objects.create(username='updated', first_name='foo', last_name='bar', email='001B')
+        self.deleted = User.objects.create(username='deleted', first_name='foo', last_name='bar', email='001C')
+
+    def test_run(self):
+        self.api.session.request = mock.MagicMock(side_effect=[
+            make_response(200, u'{"ids": ["001A", "001B", "001D"], "latestDateCovered": "2014-02-19T12:00:00.000+0000"}'),
+            make_response(200, u'[{"FirstName": "new", "LastName": "user", "Username__c": "new"}, {"FirstName": "foo2", "LastName": "bar2", "Username__c": "updated"}, null]'),
+            make_response(200, u'{"deletedRecords": [{"id": "001C", "deletedDate": "2014-02-19T11:00:00.000+0000"}], "latestDateCovered": "2014-02-19T12:30:00.000+0000", "earliestDateAvailable": "2014-01-19T12:00:00.000+0000"}'),
+        ])
+        self.assertEqual(IncrementalSync(self.api, 'user').run(), (1, 1, 1))
+
+        calls = self.api.session.request.call_args_list
+        self.assertTrue(calls[0][0][1].startswith('https://footest.salesforce.com/rest/v1.0/sobjects/Account/updated/?start='))
+        self.assertEqual(json.loads(calls[1][1]['data'])['ids'], ['001A', '001B', '001D'])
+        self.assertTrue(calls[2][0][1].startswith('https://footest.salesforce.com/rest/v1.0/sobjects/Account/deleted/?start='))
+
+        self.assertEqual(User.objects.get(pk=self.updated.pk).first_name, 'foo2')
+        self.assertEqual(User.objects.get(email='001A').username, 'new')
+        self.assertFalse(User.objects.filter(pk=self.deleted.pk).exists())
+
+        watermark = SyncWatermark.objects.get(resource='user')
+        self.assertEqual(watermark.updated, utc(datetime(2014, 2, 19, 12, 0)))
+        self.assertEqual(watermark.deleted, utc(datetime(2014, 2, 19, 12, 30)))
+
+    def test_watermark(self):
+        start = utc(datetime.utcnow() - timedelta(hours=1))
+        SyncWatermark.objects.create(resource='user', updated=start, deleted=start)
+        self.api.session.request = mock.MagicMock(side_effect=[
+            make_response(200, u'{"ids": [], "latestDateCovered": "2014-02-19T12:00:00.000+0000"}'),
+            make_response(200, u'{"deletedRecords": [], "latestDateCovered": "2014-02-19T12:30:00.000+0000"}'),
+        ])
+        IncrementalSync(self.api, 'user').run()
+        url = self.api.session.request.call_args_list[0][0][1]
+        self.assertIn('start=%s' % start.strftime('%Y-%m-%dT%H%%3A%M%%3A%S'), url)
+
+    def test_start(self):
+        sync = IncrementalSync(self.api, 'user')
+        end = datetime(2014, 3, 1)
+        self.assertEqual(sync.get_start(None, end), datetime(2014, 1, 30, 1))
+        self.assertEqual(sync.get_start(datetime(2014, 1, 1), end), datetime(2014, 1, 30, 1))
+        self.assertEqual(sync.get_start(datetime(2014, 2, 1), end), datetime(2014, 2, 1))
+
+    def test_split_exceeded_id_limit(self):
+        sync = IncrementalSync(self.api, 'user')
+        self.api.session.request = mock.MagicMock(side_effect=[
+            make_response(400, u'[{"errorCode": "EXCEEDED_ID_LIMIT", "message": "too many ids"}]'),
+            make_response(200, u'{"ids": ["001A"], "latestDateCovered": "2014-02-19T12:00:00.000+0000"}'),
+            make_response(200, u'{"ids": ["001B"], "latestDateCovered": "2014-02-20T12:00:00.000+0000"}'),
+        ])
+        payloads = sync.get_changes('updated', datetime(2014, 2, 18), datetime(2014, 2, 20, 12))
+        self.assertEqual([p['ids'] for p in payloads], [['001A'], ['001B']])
+        self.assertIn('end=2014-02-19T06%3A00%3A00', self.api.session.request.call_args_list[1][0][1])
+
+    def test_windows(self):
+        sync = IncrementalSync(self.api, 'user')
+        windows = list(sync.get_windows(datetime(2014, 1, 1), datetime(2014, 3, 1)))
+        self.assertEqual(windows, [(datetime(2014, 1, 1), datetime(2014, 1, 31)),
+                                   (datetime(2014, 1, 31), datetime(2014, 3, 1))])
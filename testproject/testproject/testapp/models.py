@@ -4,6 +4,7 @@ from django.db.models.signals import post_save
 
 from sforce.api.client import JsonResource, ModelResource
 from sforce.api.client import ModelBasedApi
+from sforce.api.outbox import enqueue
 
 
 class MyUser(models.Model):
@@ -21,19 +22,13 @@ class MyUserResource(JsonResource, ModelResource):
 
 
 class MyUserApi(ModelBasedApi):
-    user_resources_tree = {'user': {'class': MyUserResource}}
-
-    def __init__(self):
-        self.resources_tree.update(self.user_resources_tree)
-        super(MyUserApi, self).__init__()
+    resources_tree = {'user': {'class': MyUserResource}}
 
 
 @receiver(post_save, sender=MyUser)
-def user_saved(sender, **kwargs):
+def user_saved(sender, instance, **kwargs):
     """
-    Note: this is only an example,
-    the api instance should probably be a global singleton
-    and the api calls asynchronous
+    Only schedules the push, in the transaction of the save,
+    the drain_sforce_outbox command does it (with SF_OUTBOX_API = 'testproject.testapp.models.MyUserApi').
     """
-    api = MyUserApi()
-    api.push('user', sender)
+    enqueue('user', instance)